@@ -1,14 +1,19 @@
 
-from fastapi import Depends, HTTPException, Security
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import Header, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
-import psycopg2
 from dotenv import load_dotenv
-from fastapi import Request
 
 # Load environment variables
 load_dotenv()
@@ -18,13 +23,29 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Verified tokens remembered per process, so hot endpoints skip signature checks
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 4096))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# Database Connection
-DATABASE_URL = os.getenv("DATABASE_URL")
-conn = psycopg2.connect(DATABASE_URL)
-cursor = conn.cursor()
+# bcrypt cost factor; hashes with a different cost are rehashed on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# Dedicated bcrypt threads, so login bursts can't starve the shared thread pool
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", 4))
+# Hash jobs allowed to wait for a worker before requests are rejected with 429
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", 32))
+
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+# Jobs running or queued on hash_executor (only touched from the event loop)
+hash_jobs_in_flight = 0
 
 # Pydantic Models
 class Token(BaseModel):
@@ -41,6 +62,31 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+
+async def run_hash_job(func, *args):
+    """Run a bcrypt call on hash_executor, rejecting with 429 once the queue is full."""
+    global hash_jobs_in_flight
+
+    if hash_jobs_in_flight >= HASH_WORKERS + HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=429, detail="Too many authentication requests, try again shortly",
+            headers={"Retry-After": "1"}
+        )
+    hash_jobs_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(hash_executor, func, *args)
+    finally:
+        hash_jobs_in_flight -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await run_hash_job(pwd_context.hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> tuple:
+    """Return (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+    return await run_hash_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
 # JWT Token Functions
 def create_access_token(data: dict, expires_delta: timedelta) -> str:
     """Generate a JWT access token."""
@@ -49,50 +95,116 @@ def create_access_token(data: dict, expires_delta: timedelta) -> str:
     return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(request: Request):
-    """Manually extract and decode JWT token."""
-    auth_header = request.headers.get("Authorization")
-    print(f"\n🔍 Raw Authorization Header: {auth_header}")  # Print the raw header
+# token digest -> (user, exp), least recently used first
+verified_tokens: "OrderedDict[bytes, tuple]" = OrderedDict()
+# decode_token may also be called from worker threads
+verified_tokens_lock = threading.Lock()
 
-    if not auth_header or not auth_header.startswith("Bearer "):
-        print("❌ No Bearer token found in header!")
-        raise HTTPException(status_code=401, detail="Token missing or incorrect format")
 
-    token = auth_header.split("Bearer ")[1]
-    print(f"✅ Extracted Token: {token}")
+def decode_token(token: str) -> dict:
+    """Verify a JWT and return the user it belongs to, from the LRU when already verified."""
+    digest = hashlib.sha256(token.encode()).digest()
+    with verified_tokens_lock:
+        cached = verified_tokens.get(digest)
+        if cached is not None:
+            user, exp = cached
+            if exp > time.time():
+                verified_tokens.move_to_end(digest)
+                # Callers get their own copy; the cached one is shared
+                return dict(user)
+            verified_tokens.pop(digest, None)
 
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"✅ Decoded JWT Payload: {payload}")  # Print payload for debugging
+    except JWTError as e:
+        logging.debug(f"JWT decode error: {e}")
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
 
-        email = payload.get("sub")
-        if not email:
-            print("❌ 'sub' (email) missing from token!")
-            raise HTTPException(status_code=401, detail="Invalid token (No email)")
+    email = payload.get("sub")
+    if not email:
+        logging.debug("'sub' (email) missing from token")
+        raise HTTPException(status_code=401, detail="Invalid token (No email)")
 
-        return {"email": email}  # ✅ Return dict for easy use
+    user = {"email": email}
+    if payload.get("plan"):
+        # Plan at login time; entitlements.get_entitlement stays authoritative for limits
+        user["plan"] = payload["plan"]
 
-    except JWTError as e:
-        print(f"❌ JWT Decode Error: {e}")
-        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    exp = payload.get("exp")
+    if exp is not None:
+        with verified_tokens_lock:
+            verified_tokens[digest] = (dict(user), exp)
+            if len(verified_tokens) > TOKEN_CACHE_SIZE:
+                verified_tokens.popitem(last=False)
+    logging.debug(f"Authenticated user: {email}")
+    return user
+
+
+async def get_current_user(authorization: str = Header(None)) -> dict:
+    """FastAPI dependency: the user of the Bearer token in the Authorization header.
+
+    Async so a cache hit is served on the event loop instead of a threadpool hop.
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Token missing or incorrect format")
+    return decode_token(authorization[len("Bearer "):])
 
 # Authentication Route: Login
-def login_user(form_data: OAuth2PasswordRequestForm) -> dict:
+def _fetch_login_row(email: str):
+    from backend.main2 import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT email, password, is_verified, subscription_plan FROM users WHERE email = %s", (email,)
+        )
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def _update_password_hash(email: str, old_hash: str, new_hash: str):
+    from backend.main2 import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        # Only replace the hash we verified, in case the password changed meanwhile
+        cursor.execute(
+            "UPDATE users SET password = %s WHERE email = %s AND password = %s", (new_hash, email, old_hash)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def login_user(form_data: OAuth2PasswordRequestForm) -> dict:
     """Authenticate user and return JWT token."""
-    cursor.execute("SELECT email, password, is_verified FROM users WHERE email = %s", (form_data.username,))
-    db_user = cursor.fetchone()
+    db_user = await asyncio.to_thread(_fetch_login_row, form_data.username)
 
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")  # Email not found
 
-    email, hashed_password, is_verified = db_user
+    email, hashed_password, is_verified, plan = db_user
 
-    if not verify_password(form_data.password, hashed_password):
+    valid, new_hash = await check_password(form_data.password, hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")  # Wrong password
 
+    if new_hash:
+        try:
+            await asyncio.to_thread(_update_password_hash, email, hashed_password, new_hash)
+            logging.info(f"🔐 Rehashed password for {email} with cost {BCRYPT_ROUNDS}")
+        except Exception as e:
+            logging.error(f"Error rehashing password for {email}: {str(e)}")
+
     if not is_verified:
         raise HTTPException(status_code=401, detail="Email not verified. Please check your email.")
 
-    access_token = create_access_token(data={"sub": email}, expires_delta=timedelta(minutes=30))
+    claims = {"sub": email}
+    if plan:
+        claims["plan"] = plan
+    access_token = create_access_token(data=claims, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
 
     return {"access_token": access_token, "token_type": "bearer"}
@@ -0,0 +1,303 @@
+import asyncio
+import dataclasses
+import logging
+import os
+import time
+
+import psycopg2.extras
+
+from backend import bot_cache, log_store, polling, quotas, snapshots
+from backend.main2 import Bot, active_bots, close_imap_session, connect_imap, get_db_connection, log_message
+
+# Bootstrap tuning (overridable from the environment)
+BOOTSTRAP_CONCURRENCY = int(os.getenv("BOOTSTRAP_CONCURRENCY", 32))
+BOOTSTRAP_PER_SERVER_LIMIT = int(os.getenv("BOOTSTRAP_PER_SERVER_LIMIT", 4))
+BOOTSTRAP_FETCH_SIZE = int(os.getenv("BOOTSTRAP_FETCH_SIZE", 200))
+
+# Reconnect backoff for bots whose IMAP login failed
+RETRY_BASE_DELAY = 5  # seconds
+RETRY_MAX_DELAY = 300  # seconds
+
+# Bot attributes loaded from the bots table that PATCH /bots/{name} may change on a running bot
+CONFIG_FIELDS = (
+    "exchange", "symbol", "quantity", "email_address", "email_password", "imap_server", "email_subject",
+    "api_key", "api_secret", "account_id",
+)
+MAILBOX_FIELDS = {"email_address", "email_password", "imap_server"}
+
+# Progress / readiness report for the last bootstrap run
+bootstrap_report = {
+    "state": "idle",
+    "started_at": None,
+    "finished_at": None,
+    "all_live_at": None,
+    "time_to_all_live": None,
+    "total": 0,
+    "connected": 0,
+    "retrying": 0,
+}
+
+# Bots that still have to come up before the fleet is considered live
+pending_bots = set()
+
+# Per-IMAP-server semaphores so one provider doesn't get hammered with logins
+server_semaphores = {}
+
+
+def bot_from_row(bot_data) -> Bot:
+    """Build a Bot instance from a `bots` table row."""
+    return Bot(
+        name=bot_data["bot_name"],
+        exchange=bot_data["exchange"],
+        symbol=bot_data["symbol"],
+        quantity=bot_data["quantity"],
+        email_address=bot_data["email"],
+        email_password=bot_data["email_password"],
+        imap_server=bot_data["imap_server"],
+        email_subject=bot_data["email_subject"],
+        api_key=bot_data["api_key"],
+        api_secret=bot_data["api_secret"],
+        account_id=bot_data["account_id"],
+        paused=bot_data.get("paused", False) or False,
+        user_email=bot_data["user_email"]
+    )
+
+
+def schedule_retry(bot: Bot):
+    """Put a bot into the retry state with exponential backoff."""
+    bot.retry_attempts += 1
+    delay = min(RETRY_BASE_DELAY * 2 ** (bot.retry_attempts - 1), RETRY_MAX_DELAY)
+    bot.next_retry_at = time.time() + delay
+    log_message(bot.name, f"⏳ IMAP connection failed, retry #{bot.retry_attempts} in {delay}s")
+    bot_cache.record_bot_change(bot)
+
+
+def mark_live(bot: Bot):
+    """Clear a bot's retry state and update the readiness report."""
+    recovered = bot.retry_attempts > 0
+    bot.retry_attempts = 0
+    bot.next_retry_at = 0.0
+    if recovered:
+        bot_cache.record_bot_change(bot)
+
+    if bot.name not in pending_bots:
+        return
+    pending_bots.discard(bot.name)
+    bootstrap_report["connected"] += 1
+    bootstrap_report["retrying"] = sum(
+        1 for name in pending_bots if name in active_bots and active_bots[name].retry_attempts
+    )
+    if not pending_bots and bootstrap_report["state"] == "done":
+        _record_all_live()
+
+
+def _record_all_live():
+    bootstrap_report["all_live_at"] = time.time()
+    bootstrap_report["time_to_all_live"] = round(
+        bootstrap_report["all_live_at"] - bootstrap_report["started_at"], 3
+    )
+    logging.info(f"✅ All {bootstrap_report['total']} bots live in {bootstrap_report['time_to_all_live']}s")
+
+
+def get_server_semaphore(imap_server: str) -> asyncio.Semaphore:
+    key = (imap_server or "").lower()
+    if key not in server_semaphores:
+        server_semaphores[key] = asyncio.Semaphore(BOOTSTRAP_PER_SERVER_LIMIT)
+    return server_semaphores[key]
+
+
+def stream_bot_rows(only=None):
+    """Yield rows from the bots table (optionally just the named bots) using a server-side cursor."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(name="bootstrap_bots", cursor_factory=psycopg2.extras.DictCursor)
+        cursor.itersize = BOOTSTRAP_FETCH_SIZE
+        if only is None:
+            cursor.execute("SELECT * FROM bots")
+        else:
+            cursor.execute("SELECT * FROM bots WHERE bot_name = ANY(%s)", (list(only),))
+        for row in cursor:
+            yield dict(row)
+        cursor.close()
+    finally:
+        conn.close()
+
+
+async def connect_bot(bot: Bot, limiter: asyncio.Semaphore):
+    """Connect a single bot's mailbox within the global and per-server limits."""
+    if bot.next_retry_at > time.time():
+        # Restored backoff: the mailbox was failing before the restart, the email loop retries it
+        active_bots[bot.name] = bot
+        log_message(bot.name, f"⏳ Bot restored in backoff, reconnecting in {round(bot.next_retry_at - time.time())}s")
+        bootstrap_report["retrying"] += 1
+        return
+
+    async with limiter, get_server_semaphore(bot.imap_server):
+        connected = await asyncio.to_thread(connect_imap, bot)
+
+    active_bots[bot.name] = bot
+    status = "paused" if bot.paused else "active"
+    if connected:
+        log_message(bot.name, f"✅ Bot loaded from database ({status}) and connected to IMAP")
+        mark_live(bot)
+    elif bot.paused:
+        # Paused bots reconnect on resume, so they don't hold up readiness
+        log_message(bot.name, "⚠️ Bot loaded from database (paused) without an IMAP session")
+        mark_live(bot)
+    else:
+        log_message(bot.name, f"⚠️ Bot loaded from database ({status}) but failed to connect to IMAP")
+        schedule_retry(bot)
+        bootstrap_report["retrying"] += 1
+
+
+async def bootstrap_bots(only=None):
+    """Load every bot (or only the named ones) from the database and connect mailboxes in parallel."""
+    bootstrap_report.update(
+        state="running", started_at=time.time(), finished_at=None, all_live_at=None,
+        time_to_all_live=None, total=0, connected=0, retrying=0
+    )
+    pending_bots.clear()
+    limiter = asyncio.Semaphore(BOOTSTRAP_CONCURRENCY)
+    tasks = []
+
+    # Restore positions, executed signals and backoff before any bot connects or trades
+    try:
+        restored = await asyncio.to_thread(
+            snapshots.load_restore_state, sorted(only) if only is not None else None
+        )
+    except Exception as e:
+        logging.error(f"Error restoring bot runtime state: {str(e)}")
+        restored = {}
+
+    rows = stream_bot_rows(only)
+    while True:
+        # Pull rows off the blocking cursor without stalling the event loop
+        bot_data = await asyncio.to_thread(next, rows, None)
+        if bot_data is None:
+            break
+
+        bot_name = bot_data["bot_name"]
+        if bot_name in active_bots:
+            continue
+
+        bot = bot_from_row(bot_data)
+        snapshots.apply_restore_state(bot, restored.get(bot_name))
+
+        bootstrap_report["total"] += 1
+        pending_bots.add(bot_name)
+        tasks.append(asyncio.create_task(connect_bot(bot, limiter)))
+
+    if tasks:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error(f"Error bootstrapping bot: {str(result)}")
+
+    bootstrap_report["state"] = "done"
+    bootstrap_report["finished_at"] = time.time()
+    logging.info(
+        f"✅ Bootstrap finished: {bootstrap_report['connected']}/{bootstrap_report['total']} bots connected, "
+        f"{bootstrap_report['retrying']} retrying"
+    )
+    if not pending_bots:
+        _record_all_live()
+
+
+def apply_config(bot: Bot, bot_data: dict) -> set:
+    """Update a running bot's settings from its row in one step; return the changed attributes."""
+    stored = bot_from_row(bot_data)
+    changed = {name for name in CONFIG_FIELDS if getattr(bot, name) != getattr(stored, name)}
+    for name in changed:
+        setattr(bot, name, getattr(stored, name))
+    return changed
+
+
+async def swap_mailbox(bot: Bot) -> bool:
+    """Log in with the bot's current mailbox settings, then replace the old session in one step.
+
+    The email loop keeps using the old session until the new one is ready.
+    """
+    fresh = dataclasses.replace(bot, imap_session=None)
+    if not await asyncio.to_thread(connect_imap, fresh):
+        return False
+    old = dataclasses.replace(bot)
+    bot.imap_session = fresh.imap_session
+    await asyncio.to_thread(close_imap_session, old)
+    return True
+
+
+def fetch_bot_row(bot_name: str):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute("SELECT * FROM bots WHERE bot_name = %s", (bot_name,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+async def reconcile_bot(bot_name: str):
+    """Bring a running bot in line with its stored row after it was created, toggled, updated or deleted."""
+    bot_data = await asyncio.to_thread(fetch_bot_row, bot_name)
+    bot = active_bots.get(bot_name)
+
+    if bot_data is None:
+        if bot is not None:
+            await asyncio.to_thread(close_imap_session, bot)
+            del active_bots[bot_name]
+            snapshots.forget(bot_name)
+            polling.forget(bot_name)
+            log_message(bot_name, "🗑️ Bot removed")
+            log_store.remove_bot_log(bot_name)
+            bot_cache.invalidate_user(bot.user_email)
+        return
+
+    if bot is None:
+        bot = bot_from_row(bot_data)
+        try:
+            # It may have traded elsewhere until now (another node, worker, or an earlier bot of the user)
+            await quotas.reload_users([bot.user_email])
+        except Exception as e:
+            logging.error(f"Error reloading trade counters: {str(e)}")
+        restored = await asyncio.to_thread(snapshots.load_restore_state, [bot_name])
+        snapshots.apply_restore_state(bot, restored.get(bot_name))
+        active_bots[bot_name] = bot
+        if not bot.paused and not bot.next_retry_at and not await asyncio.to_thread(connect_imap, bot):
+            schedule_retry(bot)
+        log_message(bot_name, f"Bot activated for user {bot.user_email}")
+        bot_cache.invalidate_user(bot.user_email)
+        bot_cache.record_bot_change(bot)
+        return
+
+    changed = apply_config(bot, bot_data)
+    if changed:
+        # Exchange settings are read on every order, so only a mailbox change needs a new session
+        log_message(bot_name, f"⚙️ Configuration updated: {', '.join(sorted(changed))}")
+    if bool(bot_data["paused"]) != bot.paused:
+        bot.paused = bool(bot_data["paused"])
+        if bot.paused:
+            await asyncio.to_thread(close_imap_session, bot)
+            log_message(bot_name, "IMAP session closed - bot is now fully paused")
+        elif not bot.imap_session:
+            if await asyncio.to_thread(connect_imap, bot):
+                log_message(bot_name, "IMAP session re-established after resume")
+            else:
+                log_message(bot_name, "Failed to re-establish IMAP session after resume")
+    elif changed & MAILBOX_FIELDS and not bot.paused:
+        if await swap_mailbox(bot):
+            log_message(bot_name, "IMAP session switched to the new mailbox settings")
+        else:
+            await asyncio.to_thread(close_imap_session, bot)
+            schedule_retry(bot)
+    bot_cache.record_bot_change(bot)
+
+
+def get_bootstrap_report() -> dict:
+    """Return a snapshot of bootstrap progress and readiness."""
+    report = dict(bootstrap_report)
+    report["pending"] = sorted(pending_bots)
+    report["ready"] = report["state"] == "done" and not pending_bots
+    if report["started_at"] and not report["finished_at"]:
+        report["elapsed"] = round(time.time() - report["started_at"], 3)
+    return report
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+import psycopg2.extras
+from fastapi.encoders import jsonable_encoder
+
+from backend import metrics, state
+from backend.main2 import active_bots, get_db_connection
+
+# Non-secret columns exposed to the dashboard (never credentials)
+BOT_SUMMARY_COLUMNS = (
+    "id", "bot_name", "exchange", "symbol", "quantity", "email", "imap_server",
+    "email_subject", "account_id", "user_email", "created_at", "paused",
+)
+
+# Safety net for changes made outside this process
+BOT_CACHE_TTL = int(os.getenv("BOT_CACHE_TTL", 300))  # seconds
+
+# Per-user cached bot summaries:
+# user_email -> {"loaded_at": float, "bots": {bot_name: {"version": int, "summary": dict}}}
+# Versions come from bots.listing_version, one sequence shared by every process: a trigger bumps
+# it when the row changes and the engine when the bot's runtime state does. The highest version
+# doubles as the `since` cursor handed to clients, so a cursor from one API worker is valid on all.
+bot_cache = {}
+
+# Bots whose runtime change is being given a version
+_bumping = set()
+
+# Runtime state of bots run by the engine in another worker: bot_name -> last bot_state event
+remote_runtime = {}
+
+
+def runtime_fields(bot_name: str, stored_paused=False) -> dict:
+    """Status fields that live on the in-memory Bot rather than in the database."""
+    if bot_name in active_bots:
+        active_bot = active_bots[bot_name]
+        return {
+            "status": "active" if (
+                active_bot.monitoring_task and not active_bot.monitoring_task.done()) else "stopped",
+            "position": active_bot.position,
+            "paused": active_bot.paused,
+        }
+    if bot_name in remote_runtime:
+        return dict(remote_runtime[bot_name]["r"])
+    return {"status": "stopped", "position": "neutral", "paused": stored_paused or False}
+
+
+def _fetch_user_bots(user_email: str) -> list:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        with metrics.db_query_seconds.time("bot_listing"):
+            cursor.execute(
+                f"SELECT {', '.join(BOT_SUMMARY_COLUMNS)}, listing_version FROM bots WHERE user_email = %s ORDER BY id",
+                (user_email,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def bump_listing_version(bot_name: str):
+    """Take a new listing version for a bot whose runtime state changed (the trigger assigns it)."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE bots SET listing_version = DEFAULT WHERE bot_name = %s RETURNING listing_version", (bot_name,)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def _store(entries: dict, summary: dict, version: int):
+    """Insert or update a cached summary; versions only move forward."""
+    current = entries.get(summary["bot_name"])
+    if current is None:
+        entries[summary["bot_name"]] = {"version": version, "summary": summary}
+    elif current["summary"] != summary or version > current["version"]:
+        entries[summary["bot_name"]] = {"version": max(version, current["version"]), "summary": summary}
+
+
+async def load_user_bots(user_email: str) -> dict:
+    """Return the cached bot entries for a user, reloading from the database if stale."""
+    cached = bot_cache.get(user_email)
+    if cached and time.time() - cached["loaded_at"] < BOT_CACHE_TTL:
+        return cached["bots"]
+
+    rows = await asyncio.to_thread(_fetch_user_bots, user_email)
+    entries = cached["bots"] if cached else {}
+    seen = set()
+    for row in rows:
+        version = row.pop("listing_version")
+        summary = {**row, **runtime_fields(row["bot_name"], row.get("paused"))}
+        _store(entries, summary, max(version, remote_runtime.get(row["bot_name"], {}).get("v", 0)))
+        seen.add(row["bot_name"])
+    for bot_name in list(entries):
+        if bot_name not in seen:
+            del entries[bot_name]
+
+    bot_cache[user_email] = {"loaded_at": time.time(), "bots": entries}
+    return entries
+
+
+def _expire_user(user_email: str):
+    from backend import user_stream
+
+    cached = bot_cache.get(user_email)
+    if cached:
+        cached["loaded_at"] = 0
+    user_stream.notify_user(user_email)
+
+
+def invalidate_user(user_email: str):
+    """Drop a user's cached listing so the next request reloads it."""
+    _expire_user(user_email)
+    state.store.publish("bot_listing", {"u": user_email})
+
+
+def _refresh_runtime(user_email: str, bot_name: str, version: int):
+    cached = bot_cache.get(user_email)
+    if not cached or bot_name not in cached["bots"]:
+        return
+    summary = cached["bots"][bot_name]["summary"]
+    _store(cached["bots"], {**summary, **runtime_fields(bot_name, summary.get("paused"))}, version)
+
+
+def record_bot_change(bot):
+    """Refresh the runtime fields of a cached bot after its position, pause or health state changed.
+
+    Open streams are woken right away; the cached summary and the other workers are updated once
+    the change has a listing version.
+    """
+    from backend import user_stream
+
+    user_stream.notify_user(getattr(bot, "user_email", None))
+    if bot.name not in _bumping:
+        # A bump already under way picks up this change too: the state is read after it returns
+        _bumping.add(bot.name)
+        asyncio.get_running_loop().create_task(_publish_change(bot))
+
+
+async def _publish_change(bot):
+    from backend import user_stream
+
+    try:
+        version = await asyncio.to_thread(bump_listing_version, bot.name)
+    except Exception as e:
+        logging.error(f"Error versioning the state change of bot {bot.name}: {str(e)}")
+        version = None
+    finally:
+        _bumping.discard(bot.name)
+    if version is None:
+        # Deleted meanwhile, or the database is unreachable: the next listing reload catches up
+        _expire_user(bot.user_email)
+        return
+    user_email = getattr(bot, "user_email", None)
+    _refresh_runtime(user_email, bot.name, version)
+    if state.store.shared:
+        state.store.publish("bot_state", {
+            "b": bot.name, "u": user_email, "v": version,
+            "r": runtime_fields(bot.name), "h": user_stream.bot_state(bot.name),
+        })
+
+
+def apply_remote_state(event: dict):
+    from backend import user_stream
+
+    remote_runtime[event["b"]] = event
+    user_stream.notify_user(event["u"])
+    _refresh_runtime(event["u"], event["b"], event["v"])
+
+
+def apply_remote_invalidation(event: dict):
+    _expire_user(event["u"])
+
+
+def make_etag(entries: dict) -> str:
+    """Digest of the listing itself, so every worker gives the same data the same ETag."""
+    listing = sorted([name, entry["version"], jsonable_encoder(entry["summary"])] for name, entry in entries.items())
+    digest = hashlib.blake2b(json.dumps(listing, sort_keys=True).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def get_listing(entries: dict, since: int | None = None) -> dict:
+    """Build the /get-bots payload, optionally restricted to bots changed after `since`."""
+    cursor = max((entry["version"] for entry in entries.values()), default=0)
+    selected = entries.values()
+    if since is not None:
+        selected = [entry for entry in selected if entry["version"] > since]
+    bots = [
+        jsonable_encoder(entry["summary"])
+        for entry in sorted(selected, key=lambda entry: entry["summary"]["id"])
+    ]
+    payload = {"bots": bots, "cursor": cursor}
+    if since is not None:
+        payload["delta"] = True
+        payload["names"] = list(entries)
+    return payload
@@ -1,60 +1,36 @@
-from exchanges import binance, bybit, KuCoin, oanda, meta  # Assuming meta.py is inside the exchanges folder
+import time
+
+import aiohttp
 
-# Log streams for each bot
-bot_logs = {}
+from exchanges import binance, bybit, KuCoin, oanda, meta  # Assuming meta.py is inside the exchanges folder
+from backend import entitlements, fair_queue, journal, metrics, positions, quotas, state, tracing
+from backend.main2 import log_message
 
 # Adding the TradeSignal class that was missing
 class TradeSignal:
-    def __init__(self, action, symbol, quantity):
+    def __init__(self, action, symbol, quantity, message_id=None, detected_at=None):
         self.action = action
         self.symbol = symbol
         self.quantity = quantity
-
-def log_message(bot_name: str, message: str):
-    """Log a message for a specific bot."""
-    if bot_name not in bot_logs:
-        bot_logs[bot_name] = []
-    bot_logs[bot_name].append(message)
+        self.message_id = message_id
+        self.detected_at = detected_at
 
 async def close_position(bot, signal):
     """
     Close the open position for a bot (sell or buy).
+    Must be called with the bot's position lock held (see place_trade).
     """
     try:
         # Log the position closure attempt
         log_message(bot.name, f"🔒 Closing position for {bot.symbol} with quantity {bot.quantity}...")
 
-        if bot.position == 'buy':
-            # Close buy order by executing a sell
-            sell_signal = TradeSignal(action="sell", symbol=signal.symbol, quantity=signal.quantity)
-            
-            # Use the exchange map to place the closing order
-            exchange = bot.exchange.lower()
-            exchange_map = {
-                "binance": binance.place_order,
-                "bybit": bybit.place_order,
-                "kucoin": KuCoin.place_order,
-                "oanda": oanda.place_order_oanda,
-                "metatrader5": meta.place_order_metatrader5
-            }
-            
-            if exchange in exchange_map:
-                if exchange == "oanda":
-                    order_result = await exchange_map[exchange](bot.api_key, bot.account_id, sell_signal)
-                elif exchange == "metatrader5":
-                    order_result = await exchange_map[exchange](bot.login, bot.password, bot.server, sell_signal)
-                else:
-                    order_result = await exchange_map[exchange](bot.api_key, bot.api_secret, sell_signal)
-                
-                log_message(bot.name, f"❌ Closed BUY position for {bot.symbol} ({bot.quantity})")
-                bot.position = "neutral"  # Reset position
-            else:
-                log_message(bot.name, f"❌ Unsupported exchange for closing position: {exchange}")
-                return f"Failed to close position: Unsupported exchange {exchange}"
-                
-        elif bot.position == 'sell':
-            # Close sell order by executing a buy
-            buy_signal = TradeSignal(action="buy", symbol=signal.symbol, quantity=signal.quantity)
+        if bot.position in ('buy', 'sell'):
+            # Close a buy by executing a sell and vice versa
+            side = bot.position
+            closing_signal = TradeSignal(action="sell" if side == "buy" else "buy", symbol=signal.symbol,
+                                         quantity=signal.quantity,
+                                         message_id=getattr(signal, "message_id", None),
+                                         detected_at=getattr(signal, "detected_at", None))
             
             # Use the exchange map to place the closing order
             exchange = bot.exchange.lower()
@@ -67,15 +43,28 @@ async def close_position(bot, signal):
             }
             
             if exchange in exchange_map:
-                if exchange == "oanda":
-                    order_result = await exchange_map[exchange](bot.api_key, bot.account_id, buy_signal)
-                elif exchange == "metatrader5":
-                    order_result = await exchange_map[exchange](bot.login, bot.password, bot.server, buy_signal)
-                else:
-                    order_result = await exchange_map[exchange](bot.api_key, bot.api_secret, buy_signal)
+                positions.begin(bot, positions.CLOSING)
+                try:
+                    sent_at = time.time()
+                    if exchange == "oanda":
+                        order_result = await exchange_map[exchange](bot.api_key, bot.account_id, closing_signal)
+                    elif exchange == "metatrader5":
+                        order_result = await exchange_map[exchange](bot.login, bot.password, bot.server, closing_signal)
+                    else:
+                        order_result = await exchange_map[exchange](bot.api_key, bot.api_secret, closing_signal)
+                except Exception:
+                    # Still holding the position
+                    positions.settle(bot, side)
+                    raise
+                error = order_error(exchange, order_result)
+                if error:
+                    positions.settle(bot, side)
+                    journal.record_trade(bot, closing_signal, "close", "error", sent_at, time.time(), order_result)
+                    raise Exception(error)
                 
-                log_message(bot.name, f"❌ Closed SELL position for {bot.symbol} ({bot.quantity})")
-                bot.position = "neutral"  # Reset position
+                log_message(bot.name, f"❌ Closed {side.upper()} position for {bot.symbol} ({bot.quantity})")
+                positions.settle(bot, "neutral")
+                journal.record_trade(bot, closing_signal, "close", "success", sent_at, time.time(), order_result)
             else:
                 log_message(bot.name, f"❌ Unsupported exchange for closing position: {exchange}")
                 return f"Failed to close position: Unsupported exchange {exchange}"
@@ -90,6 +79,31 @@ async def close_position(bot, signal):
         raise Exception(f"Failed to close position: {str(e)}")
 
 
+def order_error(exchange: str, response):
+    """Error message of an order the exchange refused, or None if the order went through.
+
+    The adapters return the exchange's JSON as is, and {"status": "error", "message": ...}
+    when the request itself failed.
+    """
+    if not isinstance(response, dict):
+        return f"Unexpected response from {exchange}: {response!r}"
+    if response.get("status") == "error":
+        return response.get("message") or "Order failed"
+
+    exchange = (exchange or "").lower()
+    if exchange == "binance" and "code" in response and "orderId" not in response:
+        return f"{response.get('code')}: {response.get('msg')}"
+    if exchange == "bybit" and response.get("retCode", 0) != 0:
+        return f"{response.get('retCode')}: {response.get('retMsg')}"
+    if exchange == "kucoin" and str(response.get("code", "200000")) != "200000":
+        return f"{response.get('code')}: {response.get('msg')}"
+    if exchange == "oanda":
+        rejected = response.get("orderRejectTransaction") or response.get("orderCancelTransaction")
+        if response.get("errorMessage") or rejected:
+            return response.get("errorMessage") or (rejected or {}).get("reason") or "Order rejected"
+    return None
+
+
 async def check_trading_status(bot, signal):
     """Check if trading is allowed for the symbol on the exchange."""
     try:
@@ -130,6 +144,47 @@ async def check_trading_status(bot, signal):
         return False
 
 async def place_trade(bot, signal):
+    """
+    Place an order for the bot after checking the owner's plan trade limit.
+    The result's status is "success", "info" (nothing to do), "error" (may succeed on a retry)
+    or "rejected" (never will: trade limit, unsupported exchange, missing credentials).
+    An error result with "sent" set means an order reached the exchange, so retrying the
+    signal could trade it twice.
+    The check runs against in-memory counters, so no DB round trip is added to the order path.
+    Signals for one bot are executed one at a time under its position lock, and orders of all
+    users share the exchange slots fairly (see backend.fair_queue).
+    """
+    async with bot.position_lock:
+        return await _place_trade(bot, signal)
+
+
+async def _place_trade(bot, signal):
+    user_email = getattr(bot, "user_email", None)
+    reserved = False
+
+    # Duplicate signals are ignored by execute_trade and don't consume quota
+    if user_email and signal.action != bot.position:
+        entitlement = await entitlements.get_entitlement(user_email)
+        if not quotas.try_reserve_trade(user_email, entitlement.trade_limit):
+            log_message(bot.name, f"🚫 Trade limit of {entitlement.trade_limit} reached for the {entitlement.plan_id} plan")
+            return {"status": "rejected", "message": f"Trade limit reached for your {entitlement.plan_id} plan"}
+        reserved = True
+
+    started = time.perf_counter()
+    async with fair_queue.order_slot(bot, getattr(signal, "detected_at", None) or time.time()):
+        if state.store.owns(bot.name):
+            result = await execute_trade(bot, signal)
+        else:
+            # Lease lost while waiting: the new owner trades it from the still unread email
+            log_message(bot.name, "⏭️ Not placing the order: this engine no longer runs the bot")
+            result = {"status": "error", "message": "Bot is no longer run by this engine"}
+    metrics.place_trade_seconds.observe(time.perf_counter() - started, bot.exchange.lower(), result["status"])
+    if reserved and result["status"] != "success":
+        quotas.release_trade(user_email)
+    return result
+
+
+async def execute_trade(bot, signal):
     """
     Place an order for the bot depending on the trade signal.
     It first checks if trading is allowed, then handles positions and places the trade.
@@ -157,7 +212,7 @@ async def place_trade(bot, signal):
                 log_message(bot.name, f"✔️ {close_result}")
             except Exception as e:
                 log_message(bot.name, f"❌ Failed to close position: {str(e)}")
-                return {"status": "error", "message": f"Failed to close position: {str(e)}"}
+                return {"status": "error", "message": f"Failed to close position: {str(e)}", "sent": True}
         elif signal.action == bot.position:
             # Already in the same position
             log_message(bot.name, f"ℹ️ Bot already has an open {signal.action.upper()} position. Ignoring duplicate signal.")
@@ -174,42 +229,67 @@ async def place_trade(bot, signal):
 
     if exchange not in exchange_map:
         log_message(bot.name, f"❌ Unsupported exchange: {exchange}")
-        return {"status": "error", "message": f"Unsupported exchange: {exchange}"}
+        return {"status": "rejected", "message": f"Unsupported exchange: {exchange}"}
 
+    sent_at = None
+    positions.begin(bot, positions.OPENING)
     try:
         # Use the appropriate exchange handler based on the exchange type
         if exchange == "oanda":
             # Verify that account_id and api_key are available
             if not bot.account_id or not bot.api_key:
                 log_message(bot.name, f"❌ Missing credentials for OANDA: account_id or api_key")
-                return {"status": "error", "message": "Missing OANDA credentials"}
+                return {"status": "rejected", "message": "Missing OANDA credentials"}
                 
             log_message(bot.name, f"🔄 Placing {signal.action} order on OANDA for {signal.symbol}")
+            sent_at = time.time()
             order_result = await oanda.place_order_oanda(bot.api_key, bot.account_id, signal)
             
         elif exchange == "metatrader5":
             # Verify that MT5 credentials are available
             if not bot.login or not bot.password or not bot.server:
                 log_message(bot.name, f"❌ Missing credentials for MetaTrader5: login, password, or server")
-                return {"status": "error", "message": "Missing MetaTrader5 credentials"}
+                return {"status": "rejected", "message": "Missing MetaTrader5 credentials"}
                 
             log_message(bot.name, f"🔄 Placing {signal.action} order on MetaTrader5 for {signal.symbol}")
+            sent_at = time.time()
             order_result = await meta.place_order_metatrader5(bot.login, bot.password, bot.server, signal)
             
         else:
             # Standard exchange handling (Binance, Bybit, KuCoin)
             if not bot.api_key or not bot.api_secret:
                 log_message(bot.name, f"❌ Missing credentials for {exchange}: api_key or api_secret")
-                return {"status": "error", "message": f"Missing {exchange} credentials"}
+                return {"status": "rejected", "message": f"Missing {exchange} credentials"}
                 
             log_message(bot.name, f"🔄 Placing {signal.action} order on {exchange} for {signal.symbol}")
+            sent_at = time.time()
             order_result = await exchange_map[exchange](bot.api_key, bot.api_secret, signal)
 
+        acked_at = time.time()
+        error = order_error(exchange, order_result)
+        if error:
+            # Refused by the exchange: nothing was opened
+            journal.record_trade(bot, signal, "open", "error", sent_at, acked_at, order_result)
+            log_message(bot.name, f"❌ Order refused by {exchange}: {error}")
+            return {"status": "error", "message": f"Order refused by {exchange}: {error}", "sent": True}
+
         # Update the bot's position
-        bot.position = signal.action
+        positions.settle(bot, signal.action)
+        trace = getattr(signal, "trace", None)
+        if trace is not None:
+            trace["order_sent"] = sent_at
+            trace["acked"] = acked_at
+            tracing.record_trace(bot.name, trace)
+        journal.record_trade(bot, signal, "open", "success", sent_at, acked_at, order_result)
         log_message(bot.name, f"✅ Order placed successfully: {signal.action.upper()} {signal.symbol}")
         return {"status": "success", "message": f"Order placed: {signal.action} {signal.symbol}"}
 
     except Exception as e:
         log_message(bot.name, f"❌ Failed to place order: {str(e)}")
-        return {"status": "error", "message": f"Failed to place order: {str(e)}"}
+        if sent_at:
+            journal.record_trade(bot, signal, "open", "error", sent_at, time.time(), {"error": str(e)})
+        return {"status": "error", "message": f"Failed to place order: {str(e)}", "sent": bool(sent_at)}
+    finally:
+        if bot.pending == positions.OPENING:
+            # Rejected before or by the exchange: nothing was opened
+            positions.settle(bot, "neutral")
@@ -0,0 +1,34 @@
+"""Coalescing of the trade signals found in one pass over a bot's mailbox.
+
+After downtime a mailbox can hold a backlog of contradictory signals. Only the most recent
+fresh one expresses what the strategy wants now, so it is the only one traded; the others
+are dropped as superseded, and signals older than SIGNAL_MAX_AGE as stale.
+"""
+import os
+
+# Signals delivered longer ago than this are never traded (0 disables the cutoff)
+SIGNAL_MAX_AGE = float(os.getenv("SIGNAL_MAX_AGE", 300))  # seconds
+
+
+def signal_time(signal) -> float:
+    """When a signal was issued: INTERNALDATE (server clock), else the Date header, else when we parsed it."""
+    trace = signal.trace or {}
+    return trace.get("delivered") or trace.get("sent") or signal.detected_at
+
+
+def coalesce(batch: list, now: float) -> tuple:
+    """Pick the item to execute from a batch of {"signal": TradeSignal, ...} items.
+
+    Returns (item or None, [(item, reason), ...]) with reason "stale" or "superseded".
+    """
+    dropped = []
+    fresh = []
+    for item in sorted(batch, key=lambda item: signal_time(item["signal"])):
+        if SIGNAL_MAX_AGE and now - signal_time(item["signal"]) > SIGNAL_MAX_AGE:
+            dropped.append((item, "stale"))
+        else:
+            fresh.append(item)
+    if not fresh:
+        return None, dropped
+    dropped.extend((item, "superseded") for item in fresh[:-1])
+    return fresh[-1], dropped
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+from backend import metrics
+
+# Event-loop lag probe: how often the loop is pinged and how late a tick may be before it is a stall
+LOOP_PROBE_INTERVAL = float(os.getenv("LOOP_PROBE_INTERVAL", 0.1))  # seconds
+LOOP_STALL_THRESHOLD_MS = int(os.getenv("LOOP_STALL_THRESHOLD_MS", 250))
+
+# Stalls kept in memory for /admin/loop-stalls
+LOOP_STALL_HISTORY = int(os.getenv("LOOP_STALL_HISTORY", 50))
+
+# Sampling profiler limits
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 60))
+PROFILE_DEFAULT_INTERVAL_MS = int(os.getenv("PROFILE_DEFAULT_INTERVAL_MS", 5))
+
+# Comma-separated emails allowed to use the diagnostics endpoints
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Thread running the event loop, and the last time the loop answered the probe
+_loop_thread_id = None
+_last_tick = 0.0
+
+recent_stalls = deque(maxlen=LOOP_STALL_HISTORY)
+
+_profile_lock = threading.Lock()
+
+
+def is_admin(email: str) -> bool:
+    return bool(email) and email.lower() in ADMIN_EMAILS
+
+
+def _stack_of(thread_id: int) -> list:
+    frame = sys._current_frames().get(thread_id)
+    return traceback.format_stack(frame) if frame is not None else []
+
+
+def _watch_loop():
+    """Watchdog thread: capture the loop thread's stack while it is blocked past the threshold."""
+    threshold = LOOP_STALL_THRESHOLD_MS / 1000
+    stall = None
+    while True:
+        time.sleep(LOOP_PROBE_INTERVAL)
+        blocked_for = time.perf_counter() - _last_tick - LOOP_PROBE_INTERVAL
+        if blocked_for > threshold:
+            if stall is None:
+                # Only the first sample of a stall is kept: it shows the call that blocked
+                stall = {"started_at": time.time() - blocked_for, "stack": _stack_of(_loop_thread_id)}
+                metrics.event_loop_stalls_total.inc()
+            stall["duration_ms"] = round(blocked_for * 1000, 1)
+        elif stall is not None:
+            recent_stalls.append(stall)
+            logging.warning(
+                f"⏱️ Event loop blocked for {stall['duration_ms']}ms in:\n{''.join(stall['stack'][-8:])}"
+            )
+            stall = None
+
+
+async def run_loop_watchdog():
+    """Measure event-loop lag on every probe tick and start the stall watchdog thread."""
+    global _loop_thread_id, _last_tick
+
+    _loop_thread_id = threading.get_ident()
+    _last_tick = time.perf_counter()
+    threading.Thread(target=_watch_loop, name="loop-watchdog", daemon=True).start()
+
+    while True:
+        expected = time.perf_counter() + LOOP_PROBE_INTERVAL
+        await asyncio.sleep(LOOP_PROBE_INTERVAL)
+        _last_tick = time.perf_counter()
+        metrics.event_loop_lag_seconds.observe(max(_last_tick - expected, 0.0))
+
+
+def get_recent_stalls() -> list:
+    return list(reversed(recent_stalls))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_profile(seconds: float, interval_ms: int, all_threads: bool = False) -> str:
+    """Sample stacks for `seconds` and return them in collapsed-stack (flame graph) format.
+
+    Runs in a worker thread; returns None if another profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        own_thread = threading.get_ident()
+        interval = max(interval_ms, 1) / 1000
+        stacks = Counter()
+        deadline = time.perf_counter() + min(seconds, PROFILE_MAX_SECONDS)
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread or (not all_threads and thread_id != _loop_thread_id):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,187 @@
+"""Bot engine: IMAP watchers and trade execution, separable from the web API.
+
+Run it on its own with `python -m backend.engine` and start the API with ENGINE_MODE=external;
+both sides then talk through the Postgres state backend (STATE_BACKEND=postgres).
+ENGINE_MODE=pool runs it in worker processes of the web process instead (backend.engine_pool).
+"""
+import asyncio
+import logging
+import os
+import signal
+
+from backend import bootstrap, fair_queue, polling, quotas, snapshots, state, tracing
+from backend.main2 import (
+    active_bots, check_email_for_signals, engine_draining, ensure_paused_column, inflight_checks, keep_imap_alive,
+    start_background_tasks, startup_check_emails, stop_tasks
+)
+
+# How long shutdown waits for in-flight mailbox checks and their orders to finish
+ENGINE_DRAIN_TIMEOUT = float(os.getenv("ENGINE_DRAIN_TIMEOUT", 20))  # seconds
+
+# "embedded" runs the engine inside the web process, "external" leaves it to `python -m backend.engine`,
+# "pool" spreads it over worker processes of the web process
+ENGINE_MODE = os.getenv("ENGINE_MODE", "embedded").lower()
+
+
+# Shard coordinator of this process when it runs as an engine node with the shared state backend
+coordinator = None
+
+
+async def run_engine():
+    """Run the IMAP watchers over the bots this process owns."""
+    global coordinator
+
+    asyncio.create_task(keep_imap_alive())
+    asyncio.create_task(check_email_for_signals())
+    asyncio.create_task(snapshots.run_snapshot_writer())
+    if not state.store.shared:
+        # Single process: every bot is ours
+        await startup_check_emails()
+        return
+
+    from backend import sharding
+
+    if isinstance(state.store, state.PipeState):
+        # Engine pool worker: the stable hash of each bot decides whether it is ours
+        bot_names = await asyncio.to_thread(sharding.list_bot_names)
+        owned = {bot_name for bot_name in bot_names if state.store.owns(bot_name)}
+        try:
+            # A restarted worker must see what its predecessor (and the other workers) counted
+            await quotas.reload_users(await asyncio.to_thread(sharding.list_bot_owners, sorted(owned)))
+        except Exception as e:
+            logging.error(f"Error reloading trade counters: {str(e)}")
+        await startup_check_emails(only=owned)
+        return
+
+    await asyncio.to_thread(ensure_paused_column)
+    coordinator = sharding.ShardCoordinator()
+    await coordinator.run()
+
+
+async def drain():
+    """Stop starting mailbox checks and let the running ones finish their current order."""
+    engine_draining.set()
+    if inflight_checks:
+        logging.info(f"⏳ Draining {len(inflight_checks)} in-flight mailbox checks...")
+        _, pending = await asyncio.wait(set(inflight_checks.values()), timeout=ENGINE_DRAIN_TIMEOUT)
+        if pending:
+            logging.error(f"❌ {len(pending)} mailbox checks still running after {ENGINE_DRAIN_TIMEOUT}s")
+
+
+async def stop_engine():
+    """Drain and checkpoint the running bots, then hand them back so other engine nodes take over right away."""
+    if state.store.is_engine:
+        await drain()
+        try:
+            await snapshots.save_snapshots()
+        except Exception as e:
+            logging.error(f"Error saving bot snapshots on shutdown: {str(e)}")
+    if coordinator is not None:
+        await coordinator.leave()
+    if ENGINE_MODE == "pool":
+        from backend import engine_pool
+
+        await engine_pool.stop_pool()
+
+
+async def dispatch_bot_change(bot_name: str):
+    """Have the engine apply a bot's stored configuration (created, toggled or deleted)."""
+    if not state.store.shared:
+        await bootstrap.reconcile_bot(bot_name)
+        return
+    # Our own notifications aren't delivered back to us, so an engine node also applies it directly
+    state.store.publish("bot_control", {"b": bot_name})
+    if coordinator is not None:
+        await coordinator.reconcile(bot_name)
+
+
+def handle_bot_control(event: dict):
+    if coordinator is not None:
+        asyncio.create_task(coordinator.reconcile(event["b"]))
+    elif state.store.owns(event["b"]):
+        asyncio.create_task(bootstrap.reconcile_bot(event["b"]))
+
+
+def local_status() -> dict:
+    bots = list(active_bots.values())
+    status = {
+        "worker": state.WORKER_ID,
+        "bots": len(bots),
+        "connected": sum(1 for bot in bots if bot.imap_session),
+        "paused": sum(1 for bot in bots if bot.paused),
+        "retrying": sum(1 for bot in bots if bot.retry_attempts),
+        "bootstrap": bootstrap.get_bootstrap_report(),
+        "polling": polling.get_poll_report(),
+        "scheduling": fair_queue.get_scheduling_report(),
+    }
+    if coordinator is not None:
+        status.update(coordinator.status())
+    if isinstance(state.store, state.PipeState):
+        status["shard"] = state.store.shard
+    return status
+
+
+def handle_status_request(event: dict):
+    if state.store.is_engine:
+        state.store.reply(event, local_status())
+
+
+async def get_status() -> dict:
+    """Status of every engine node; `running` is False if none answered."""
+    nodes = []
+    if state.store.is_engine:
+        nodes.append(local_status())
+    nodes.extend(await state.store.request("engine_status", {}))
+    status = {"running": bool(nodes), "nodes": nodes}
+    for key in ("bots", "connected", "paused", "retrying"):
+        status[key] = sum(node[key] for node in nodes)
+    return status
+
+
+def local_latency(bot_name: str):
+    bot = active_bots.get(bot_name)
+    if bot is None:
+        return None
+    return {"user_email": bot.user_email, "latency": tracing.latency_report(bot_name)}
+
+
+def handle_latency_request(event: dict):
+    if state.store.is_engine:
+        latency = local_latency(event["b"])
+        if latency is not None:
+            state.store.reply(event, latency)
+
+
+async def get_latency(bot_name: str):
+    """Latency report and owner of a bot, from the engine node running it; None if no node does."""
+    if state.store.is_engine:
+        latency = local_latency(bot_name)
+        if latency is not None:
+            return latency
+    replies = await state.store.request("bot_latency", {"b": bot_name})
+    return replies[0] if replies else None
+
+
+async def serve():
+    """Run the engine until SIGTERM/SIGINT, then flush buffers and exit."""
+    if not state.store.shared:
+        logging.warning("⚠️ STATE_BACKEND is not postgres: the web API can't reach this engine")
+    await start_background_tasks(run_engine=True)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    logging.info("⚙️ Bot engine started")
+    await stopping.wait()
+
+    logging.info("🛑 Bot engine stopping...")
+    await stop_tasks()
+
+
+if __name__ == "__main__":
+    # Run the imported module, so the handlers main2 subscribes share its state
+    from backend import engine
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(engine.serve())
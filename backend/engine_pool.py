@@ -0,0 +1,117 @@
+"""Engine process pool: spreads the bots of one host over worker processes (ENGINE_MODE=pool).
+
+MIME parsing, regexes and TLS all run on the event loop's core, so a single engine process
+tops out at one CPU. In pool mode the web process starts ENGINE_WORKERS engine processes,
+each running the bots whose stable hash falls on its shard (state.shard_of). Log lines,
+bot state and metrics come back over the worker's pipe; bot control is routed to the owner.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+
+from backend import engine, metrics, state
+
+# Number of engine worker processes; defaults to one per core
+ENGINE_WORKERS = int(os.getenv("ENGINE_WORKERS", os.cpu_count() or 1))
+
+# How often a worker pushes its metrics to the web process
+METRICS_PUSH_INTERVAL = float(os.getenv("METRICS_PUSH_INTERVAL", 5))  # seconds
+
+# Pause before a crashed worker is restarted, and grace period for a clean shutdown
+POOL_RESTART_DELAY = 2  # seconds
+POOL_STOP_TIMEOUT = float(os.getenv("POOL_STOP_TIMEOUT", 30))  # seconds
+
+# Spawned rather than forked: the parent already runs an event loop and threads
+_context = multiprocessing.get_context("spawn")
+
+# Worker process per shard
+workers = []
+
+stopping = False
+
+
+def run_worker(shard: int, shards: int, conn):
+    """Entry point of a worker process."""
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s %(levelname)s [engine-{shard}] %(message)s")
+    asyncio.run(serve_worker(shard, shards, conn))
+
+
+async def push_metrics(shard: int):
+    while True:
+        await asyncio.sleep(METRICS_PUSH_INTERVAL)
+        state.store.publish("metrics", {"w": shard, "m": metrics.snapshot()})
+
+
+def handle_parent_disconnect(event: dict):
+    # The web process is gone; stop like on SIGTERM so buffers are flushed
+    logging.error("❌ Lost the pipe to the web process, stopping")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def serve_worker(shard: int, shards: int, conn):
+    state.store = state.PipeState([conn], shards=shards, shard=shard)
+    state.store.subscribe("disconnect", handle_parent_disconnect)
+    asyncio.create_task(push_metrics(shard))
+    await engine.serve()
+
+
+def install(shards: int = ENGINE_WORKERS):
+    """Switch this (web) process to the pipe state backend; call before the background tasks start."""
+    state.store = state.PipeState([None] * shards, shards=shards)
+    state.store.subscribe("disconnect", handle_worker_disconnect)
+    workers[:] = [None] * shards
+
+
+def spawn(shard: int):
+    parent_conn, child_conn = _context.Pipe()
+    process = _context.Process(
+        target=run_worker, args=(shard, len(workers), child_conn), name=f"engine-{shard}"
+    )
+    process.start()
+    child_conn.close()
+    workers[shard] = process
+    state.store.set_peer(shard, parent_conn)
+    logging.info(f"⚙️ Started engine worker {shard} (pid {process.pid})")
+
+
+async def start_pool():
+    """Start one engine process per shard."""
+    for shard in range(len(workers)):
+        await asyncio.to_thread(spawn, shard)
+    logging.info(f"⚙️ Engine pool running {len(workers)} workers")
+
+
+def _stop_process(process):
+    process.terminate()
+    process.join(POOL_STOP_TIMEOUT)
+    if process.is_alive():
+        logging.error(f"❌ Engine worker pid {process.pid} didn't stop in time, killing it")
+        process.kill()
+        process.join()
+
+
+async def restart_worker(shard: int):
+    process = workers[shard]
+    if process is not None:
+        # Make sure it is really gone before its bots get a new owner
+        await asyncio.to_thread(_stop_process, process)
+        logging.error(f"❌ Engine worker {shard} exited with code {process.exitcode}, restarting")
+    await asyncio.sleep(POOL_RESTART_DELAY)
+    if not stopping:
+        await asyncio.to_thread(spawn, shard)
+
+
+def handle_worker_disconnect(event: dict):
+    if not stopping:
+        asyncio.create_task(restart_worker(event["peer"]))
+
+
+async def stop_pool():
+    """SIGTERM every worker so each flushes its journal, then wait for them to exit."""
+    global stopping
+
+    stopping = True
+    processes = [process for process in workers if process is not None and process.is_alive()]
+    await asyncio.gather(*(asyncio.to_thread(_stop_process, process) for process in processes))
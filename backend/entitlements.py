@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+from backend import metrics, state
+from backend.main2 import get_db_connection
+
+# Subscription plans configuration (single source of truth)
+SUBSCRIPTION_PLANS = {
+    "free": {
+        "name": "Free Plan",
+        "price": 0,
+        "bot_limit": 1,
+        "trade_limit": 4,
+        "weight": 1,  # share of engine work under contention (see backend.fair_queue)
+        "duration": 30  # days
+    },
+    "basic": {
+        "name": "Basic Plan",
+        "price": 999,
+        "bot_limit": 5,
+        "trade_limit": -1,  # unlimited
+        "weight": 2,
+        "duration": 30  # days
+    },
+    "premium": {
+        "name": "Premium Plan",
+        "price": 1999,
+        "bot_limit": 6,
+        "trade_limit": -1,  # unlimited
+        "weight": 3,
+        "duration": 30  # days
+    }
+}
+
+DEFAULT_PLAN = "free"
+
+# How long a cached entitlement is trusted before re-reading Postgres
+ENTITLEMENT_CACHE_TTL = int(os.getenv("ENTITLEMENT_CACHE_TTL", 60))  # seconds
+
+
+@dataclass
+class Entitlement:
+    user_email: str
+    plan_id: str
+    active: bool
+    bot_limit: int
+    trade_limit: int
+    weight: int = 1
+    end_date: Optional[datetime] = None
+    loaded_at: float = 0.0
+
+
+# Cached entitlements per user
+entitlement_cache: Dict[str, Entitlement] = {}
+
+
+def get_plan(plan_id: str) -> dict:
+    """Return a plan definition, falling back to the free plan for unknown ids."""
+    return SUBSCRIPTION_PLANS.get(plan_id or DEFAULT_PLAN, SUBSCRIPTION_PLANS[DEFAULT_PLAN])
+
+
+def build_entitlement(user_email: str, plan_id: str, active: bool, end_date=None) -> Entitlement:
+    plan_id = plan_id if plan_id in SUBSCRIPTION_PLANS else DEFAULT_PLAN
+    plan = SUBSCRIPTION_PLANS[plan_id]
+    return Entitlement(
+        user_email=user_email,
+        plan_id=plan_id,
+        active=bool(active),
+        bot_limit=plan["bot_limit"],
+        trade_limit=plan["trade_limit"],
+        weight=plan["weight"],
+        end_date=end_date,
+        loaded_at=time.time()
+    )
+
+
+def _fetch_entitlement(user_email: str) -> Entitlement:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        with metrics.db_query_seconds.time("entitlement"):
+            cursor.execute("""
+                SELECT u.subscription_status, u.subscription_plan,
+                       (SELECT MAX(s.end_date) FROM subscriptions s
+                         WHERE s.user_email = u.email AND s.status = 'active')
+                FROM users u WHERE u.email = %s
+            """, (user_email,))
+            result = cursor.fetchone()
+    finally:
+        conn.close()
+
+    if not result:
+        return build_entitlement(user_email, DEFAULT_PLAN, False)
+    subscription_status, subscription_plan, end_date = result
+    return build_entitlement(user_email, subscription_plan, subscription_status, end_date)
+
+
+async def get_entitlement(user_email: str) -> Entitlement:
+    """Return a user's entitlement from memory, loading it from Postgres on a miss or expiry."""
+    entitlement = entitlement_cache.get(user_email)
+    if entitlement and time.time() - entitlement.loaded_at < ENTITLEMENT_CACHE_TTL:
+        return entitlement
+
+    entitlement = await asyncio.to_thread(_fetch_entitlement, user_email)
+    entitlement_cache[user_email] = entitlement
+    return entitlement
+
+
+def set_entitlement(user_email: str, plan_id: str, active: bool = True, end_date=None) -> Entitlement:
+    """Write-through update after the subscription state was committed to the database."""
+    entitlement = build_entitlement(user_email, plan_id, active, end_date)
+    entitlement_cache[user_email] = entitlement
+    # Other workers re-read it instead of serving their cached copy until the TTL
+    state.store.publish("entitlement", {"u": user_email})
+    logging.info(f"✅ Entitlement updated for {user_email}: {entitlement.plan_id}")
+    return entitlement
+
+
+def invalidate_entitlement(user_email: str):
+    entitlement_cache.pop(user_email, None)
+
+
+def apply_remote_invalidation(event: dict):
+    invalidate_entitlement(event["u"])
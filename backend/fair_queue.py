@@ -0,0 +1,184 @@
+"""Fair sharing of engine work between users.
+
+Mailbox checks and order executions each draw from a FairQueue: a fixed number of slots,
+at most a few per user. Waiting requests are served by class (order execution before mailbox
+polls before housekeeping such as keep_imap_alive), then by deadline, then by start-time fair
+queuing: every user has a virtual clock that advances by the time their work held a slot
+divided by their plan's weight (SUBSCRIPTION_PLANS), and the user furthest behind goes next.
+A tenant with huge inboxes pays for its own mailbox time, so it can't starve the others.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+from backend import entitlements, metrics
+
+# Request classes, served in this order
+EXECUTION = 0
+POLL = 1
+HOUSEKEEPING = 2
+CLASS_NAMES = {EXECUTION: "execution", POLL: "poll", HOUSEKEEPING: "housekeeping"}
+
+# Mailbox checks running at once, overall and per user
+MAILBOX_CONCURRENCY = int(os.getenv("MAILBOX_CONCURRENCY", 16))
+MAILBOX_USER_CONCURRENCY = int(os.getenv("MAILBOX_USER_CONCURRENCY", 2))
+
+# Orders in flight to the exchanges at once, overall and per user
+ORDER_CONCURRENCY = int(os.getenv("ORDER_CONCURRENCY", 32))
+ORDER_USER_CONCURRENCY = int(os.getenv("ORDER_USER_CONCURRENCY", 2))
+
+# An order should have been sent this long after its signal was issued; earlier deadlines go first
+ORDER_DEADLINE = float(os.getenv("ORDER_DEADLINE", 5))  # seconds
+
+# Assumed cost of a user's first request, until their actual slot times are known
+DEFAULT_COST = 0.05  # seconds
+
+
+class FairQueue:
+    """Slots of one engine resource, handed out by class, deadline, then weighted fair share."""
+
+    def __init__(self, name: str, slots: int, per_user: int):
+        self.name = name
+        self.slots = slots
+        self.per_user = per_user
+        self.in_use = 0
+        self.running = {}  # user -> slots held
+        self.finish_tags = {}  # user -> virtual time at which their queued work is paid for
+        self.costs = {}  # user -> moving average of slot time
+        self.virtual_time = 0.0
+        self.waiting = []  # heap of (class, deadline, start tag, seq, user, future)
+        self.capped = {}  # user -> waiting entries held back by the per-user limit
+        self.sequence = itertools.count()
+        self.idle_event = asyncio.Event()
+        self.idle_event.set()
+
+    def _can_run(self, user: str) -> bool:
+        return self.running.get(user, 0) < self.per_user
+
+    def _grant(self, user: str, start: float):
+        self.idle_event.clear()
+        self.in_use += 1
+        self.running[user] = self.running.get(user, 0) + 1
+        self.virtual_time = max(self.virtual_time, start)
+
+    def _dispatch(self):
+        while self.in_use < self.slots and self.waiting:
+            entry = heapq.heappop(self.waiting)
+            user, future = entry[4], entry[5]
+            if future.done():
+                # Cancelled while waiting
+                continue
+            if not self._can_run(user):
+                self.capped.setdefault(user, []).append(entry)
+                continue
+            self._grant(user, entry[2])
+            future.set_result(None)
+
+    def _release(self, user: str):
+        self.in_use -= 1
+        self.running[user] -= 1
+        if not self.running[user]:
+            del self.running[user]
+        for entry in self.capped.pop(user, ()):
+            heapq.heappush(self.waiting, entry)
+        self._dispatch()
+        if not self.in_use:
+            self.idle_event.set()
+
+    @asynccontextmanager
+    async def slot(self, user: str, weight: int = 1, request_class: int = POLL, deadline: float = None):
+        """Hold one slot of this resource for `user` while the block runs."""
+        user = user or ""
+        weight = max(weight, 1)
+        estimate = self.costs.get(user, DEFAULT_COST)
+        # Charged up front so a burst of the same user's requests queues behind each other
+        start = max(self.virtual_time, self.finish_tags.get(user, 0.0))
+        self.finish_tags[user] = start + estimate / weight
+
+        queued_at = time.perf_counter()
+        if not self.waiting and self.in_use < self.slots and self._can_run(user):
+            self._grant(user, start)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiting, (
+                request_class, float("inf") if deadline is None else deadline, start, next(self.sequence), user, future
+            ))
+            self.idle_event.clear()
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just as we were cancelled
+                    self._release(user)
+                raise
+        started = time.perf_counter()
+        metrics.fair_queue_wait_seconds.observe(started - queued_at, self.name, CLASS_NAMES[request_class])
+
+        try:
+            yield
+        finally:
+            cost = time.perf_counter() - started
+            # Settle the estimate against what the slot was actually held for
+            self.finish_tags[user] = self.finish_tags.get(user, start) + (cost - estimate) / weight
+            self.costs[user] = estimate + (cost - estimate) * 0.2
+            self._release(user)
+
+    async def wait_idle(self, timeout: float):
+        """Wait until nothing holds or waits for a slot, or at most `timeout` seconds."""
+        try:
+            await asyncio.wait_for(self.idle_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def status(self) -> dict:
+        waiting = {}
+        for entry in self.waiting:
+            if not entry[5].done():
+                name = CLASS_NAMES[entry[0]]
+                waiting[name] = waiting.get(name, 0) + 1
+        return {
+            "in_use": self.in_use,
+            "slots": self.slots,
+            "waiting": waiting,
+            "users": len(self.running),
+            "capped_users": len(self.capped),
+        }
+
+
+mailbox_queue = FairQueue("mailbox", MAILBOX_CONCURRENCY, MAILBOX_USER_CONCURRENCY)
+order_queue = FairQueue("orders", ORDER_CONCURRENCY, ORDER_USER_CONCURRENCY)
+
+
+async def user_weight(user_email: str) -> int:
+    if not user_email:
+        return 1
+    try:
+        entitlement = await entitlements.get_entitlement(user_email)
+    except Exception:
+        # Plan unknown while the database is unreachable: base share
+        return 1
+    return entitlement.weight
+
+
+@asynccontextmanager
+async def mailbox_slot(bot, request_class: int = POLL):
+    """Run a mailbox check (or keep-alive) of `bot` within its owner's fair share."""
+    weight = await user_weight(bot.user_email)
+    async with mailbox_queue.slot(bot.user_email, weight, request_class):
+        yield
+
+
+@asynccontextmanager
+async def order_slot(bot, issued_at: float):
+    """Send an order of `bot` within its owner's fair share, earliest deadline first."""
+    weight = await user_weight(bot.user_email)
+    async with order_queue.slot(bot.user_email, weight, EXECUTION, issued_at + ORDER_DEADLINE):
+        yield
+
+
+def get_scheduling_report() -> dict:
+    return {"mailbox": mailbox_queue.status(), "orders": order_queue.status()}
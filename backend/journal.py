@@ -0,0 +1,256 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from backend import metrics
+from backend.main2 import get_db_connection
+
+# How often buffered journal entries are written to Postgres
+JOURNAL_FLUSH_MS = int(os.getenv("JOURNAL_FLUSH_MS", 250))
+
+# Hard cap on buffered entries so a database outage can't exhaust memory
+JOURNAL_MAX_BUFFER = int(os.getenv("JOURNAL_MAX_BUFFER", 50000))
+
+JOURNAL_COLUMNS = (
+    "bot_name", "user_email", "kind", "status", "action", "symbol", "quantity",
+    "message_id", "detected_at", "sent_at", "acked_at",
+    "fill_qty", "fill_price", "position_after", "exchange_response", "trace",
+)
+
+# Entries waiting to be flushed (tuples in JOURNAL_COLUMNS order)
+journal_buffer = []
+
+
+def create_trades_table():
+    """Create the trades journal table if it doesn't exist."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS trades (
+            id BIGSERIAL PRIMARY KEY,
+            bot_name VARCHAR(100) NOT NULL,
+            user_email VARCHAR(100),
+            kind VARCHAR(20) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            action VARCHAR(10),
+            symbol VARCHAR(50),
+            quantity FLOAT,
+            message_id VARCHAR(300),
+            detected_at TIMESTAMPTZ,
+            sent_at TIMESTAMPTZ,
+            acked_at TIMESTAMPTZ,
+            fill_qty FLOAT,
+            fill_price FLOAT,
+            position_after VARCHAR(20),
+            exchange_response JSONB,
+            trace JSONB,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        ALTER TABLE trades ADD COLUMN IF NOT EXISTS trace JSONB;
+        CREATE INDEX IF NOT EXISTS trades_bot_name_id_idx ON trades (bot_name, id);
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, tz=timezone.utc).isoformat()
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_fill(exchange: str, response) -> tuple:
+    """Best-effort extraction of (fill_qty, fill_price) from an exchange response."""
+    if not isinstance(response, dict):
+        return None, None
+
+    exchange = (exchange or "").lower()
+    if exchange == "binance":
+        qty = _as_float(response.get("executedQty"))
+        fills = response.get("fills") or []
+        if fills and qty:
+            notional = sum(float(f.get("price") or 0) * float(f.get("qty") or 0) for f in fills)
+            return qty, notional / qty
+        return qty, None
+    if exchange == "oanda":
+        fill = response.get("orderFillTransaction") or {}
+        units = _as_float(fill.get("units"))
+        return (abs(units) if units is not None else None), _as_float(fill.get("price"))
+
+    # Generic shapes used by the remaining adapters
+    data = response.get("result") or response.get("data") or response
+    if not isinstance(data, dict):
+        return None, None
+    qty = _as_float(data.get("filled_qty") or data.get("dealSize") or data.get("qty") or data.get("volume"))
+    price = _as_float(data.get("avg_price") or data.get("price"))
+    return qty, price
+
+
+def record_trade(bot, signal, kind: str, status: str, sent_at=None, acked_at=None, response=None):
+    """Buffer a journal entry; the flush loop writes it to Postgres asynchronously."""
+    if len(journal_buffer) >= JOURNAL_MAX_BUFFER:
+        logging.error(f"Trade journal buffer full, dropping entry for bot {bot.name}")
+        return
+
+    fill_qty, fill_price = parse_fill(bot.exchange, response) if status == "success" else (None, None)
+    journal_buffer.append((
+        bot.name,
+        getattr(bot, "user_email", None),
+        kind,
+        status,
+        signal.action,
+        signal.symbol,
+        signal.quantity,
+        getattr(signal, "message_id", None),
+        _timestamp(getattr(signal, "detected_at", None)),
+        _timestamp(sent_at),
+        _timestamp(acked_at),
+        fill_qty,
+        fill_price,
+        bot.position,
+        json.dumps(response, default=str) if response is not None else None,
+        json.dumps(getattr(signal, "trace", None)) if getattr(signal, "trace", None) else None,
+    ))
+
+
+def take_buffer() -> list:
+    entries = journal_buffer[:]
+    journal_buffer.clear()
+    return entries
+
+
+def copy_entries(entries: list):
+    """Bulk-write journal entries with COPY."""
+    data = io.StringIO()
+    csv.writer(data).writerows(entries)
+    data.seek(0)
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        with metrics.db_query_seconds.time("journal_copy"):
+            cursor.copy_expert(
+                f"COPY trades ({', '.join(JOURNAL_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                data
+            )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+async def flush_journal():
+    entries = take_buffer()
+    if not entries:
+        return
+    try:
+        await asyncio.to_thread(copy_entries, entries)
+    except Exception:
+        # Keep the entries for the next attempt, oldest first
+        journal_buffer[:0] = entries[:max(JOURNAL_MAX_BUFFER - len(journal_buffer), 0)]
+        raise
+
+
+async def run_journal_writer():
+    """Create the journal table, then flush buffered entries every JOURNAL_FLUSH_MS."""
+    try:
+        await asyncio.to_thread(create_trades_table)
+    except Exception as e:
+        logging.error(f"Error creating trades table: {str(e)}")
+
+    while True:
+        await asyncio.sleep(JOURNAL_FLUSH_MS / 1000)
+        try:
+            await flush_journal()
+        except Exception as e:
+            logging.error(f"Error flushing trade journal: {str(e)}")
+
+
+def load_last_positions(bot_names=None) -> dict:
+    """Return each bot's position after its most recent successful journaled trade.
+
+    Pass `bot_names` to restrict the lookup to those bots. Trades from before the bot was
+    (re-)created belong to an earlier bot of the same name and are ignored.
+    """
+    create_trades_table()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT ON (t.bot_name) t.bot_name, t.position_after
+            FROM trades t
+            JOIN bots b ON b.bot_name = t.bot_name AND t.created_at >= b.created_at
+            WHERE t.status = 'success' AND t.position_after IS NOT NULL
+              AND (%s::text[] IS NULL OR t.bot_name = ANY(%s::text[]))
+            ORDER BY t.bot_name, t.id DESC
+        """, (bot_names, bot_names))
+        return dict(cursor.fetchall())
+    finally:
+        conn.close()
+
+
+def load_recent_message_ids(bot_names=None, limit: int = 50) -> dict:
+    """Message-IDs of each bot's most recent successful trades since it was created, oldest first."""
+    create_trades_table()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT bot_name, message_id FROM (
+                SELECT t.bot_name, t.message_id, t.id,
+                       row_number() OVER (PARTITION BY t.bot_name ORDER BY t.id DESC) AS n
+                FROM trades t
+                JOIN bots b ON b.bot_name = t.bot_name AND t.created_at >= b.created_at
+                WHERE t.status = 'success' AND t.message_id IS NOT NULL
+                  AND (%s::text[] IS NULL OR t.bot_name = ANY(%s::text[]))
+            ) recent
+            WHERE n <= %s
+            ORDER BY bot_name, id
+        """, (bot_names, bot_names, limit))
+        message_ids = {}
+        for bot_name, message_id in cursor.fetchall():
+            message_ids.setdefault(bot_name, []).append(message_id)
+        return message_ids
+    finally:
+        conn.close()
+
+
+def load_signal_times(bot_names=None, days: int = 30, limit: int = 200) -> dict:
+    """Epoch times at which each bot's most recent signals since it was created were detected, oldest first."""
+    create_trades_table()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT bot_name, EXTRACT(EPOCH FROM detected_at) FROM (
+                SELECT t.bot_name, t.detected_at, t.id,
+                       row_number() OVER (PARTITION BY t.bot_name ORDER BY t.id DESC) AS n
+                FROM trades t
+                JOIN bots b ON b.bot_name = t.bot_name AND t.created_at >= b.created_at
+                WHERE t.kind IN ('open', 'signal') AND t.detected_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+                  AND (%s::text[] IS NULL OR t.bot_name = ANY(%s::text[]))
+            ) recent
+            WHERE n <= %s
+            ORDER BY bot_name, id
+        """, (days, bot_names, bot_names, limit))
+        signal_times = {}
+        for bot_name, detected_at in cursor.fetchall():
+            signal_times.setdefault(bot_name, []).append(float(detected_at))
+        return signal_times
+    finally:
+        conn.close()
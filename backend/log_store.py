@@ -0,0 +1,370 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict
+
+import psycopg2.extras
+
+from backend import metrics, state
+
+# Lines kept in memory per bot; older lines are persisted to Postgres
+LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", 500))
+
+# Minimum level recorded for bot logs; lower-level events are dropped at the source
+BOT_LOG_LEVEL = logging.getLevelName(os.getenv("BOT_LOG_LEVEL", "INFO").upper())
+if not isinstance(BOT_LOG_LEVEL, int):
+    BOT_LOG_LEVEL = logging.INFO
+
+# Persistence and retention of overflowed lines
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 2))  # seconds
+LOG_FLUSH_BATCH = int(os.getenv("LOG_FLUSH_BATCH", 1000))
+LOG_MAX_PENDING = int(os.getenv("LOG_MAX_PENDING", 100000))
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", 14))
+
+
+class BotLogRecord:
+    """A structured bot log event, formatted only when a consumer reads it.
+
+    Consecutive events with the same `code` and fields are collapsed into `count` until the line
+    has been read; a repeat after that starts a new line.
+    """
+
+    __slots__ = ("level", "code", "template", "fields", "count")
+
+    def __init__(self, level: int, code, template: str, fields: dict):
+        self.level = level
+        self.code = code
+        self.template = template
+        self.fields = fields
+        self.count = 1
+
+    def render(self) -> str:
+        text = self.template.format(**self.fields) if self.fields else self.template
+        if self.count > 1:
+            text += f" (x{self.count})"
+        return text
+
+    __str__ = render
+
+
+def format_entry(entry: tuple) -> str:
+    """Render a (seq, timestamp, record) entry the way the dashboard shows it."""
+    _, timestamp, record = entry
+    return f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}] {record}"
+
+
+class BotLog:
+    """Fixed-size ring buffer of (seq, timestamp, message) entries for one bot.
+
+    Subscribers wait on `changed`, which is set and replaced whenever a line is appended.
+    Listeners are long-lived events (one per multiplexed stream) set on every append; they are
+    registered per bot name, so they carry over to a new buffer if the bot's log is recreated.
+    `read_seq` is the newest sequence number handed out to a reader.
+    """
+
+    __slots__ = ("entries", "next_seq", "read_seq", "changed", "subscribers", "listeners")
+
+    def __init__(self, size: int = LOG_BUFFER_SIZE, listeners: set = None):
+        self.entries = deque(maxlen=size)
+        self.next_seq = 1
+        self.read_seq = 0
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.listeners = set() if listeners is None else listeners
+
+    def wake(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+        for listener in self.listeners:
+            listener.set()
+
+    def first_seq(self) -> int:
+        return self.entries[0][0] if self.entries else self.next_seq
+
+    def append(self, message, timestamp: float) -> tuple:
+        """Append an entry and return it together with the entry it evicted, if any."""
+        evicted = self.entries[0] if len(self.entries) == self.entries.maxlen else None
+        entry = (self.next_seq, timestamp, message)
+        self.next_seq += 1
+        self.entries.append(entry)
+        return entry, evicted
+
+    def since(self, seq: int) -> list:
+        """Entries with a sequence number greater than `seq`."""
+        if not self.entries or seq >= self.entries[-1][0]:
+            return []
+        first_seq = self.entries[0][0]
+        start = max(seq - first_seq + 1, 0)
+        self.read_seq = self.entries[-1][0]
+        return [self.entries[i] for i in range(start, len(self.entries))]
+
+
+# One log store shared by main2 and bot_manager
+log_store: Dict[str, BotLog] = {}
+
+# Listener events per bot name (see BotLog)
+log_listeners: Dict[str, set] = {}
+
+# Event loop that owns subscriber wake-ups (log lines may be appended from worker threads)
+_loop = None
+
+# Lines evicted from ring buffers, waiting to be persisted: (bot_name, seq, timestamp, message)
+pending_lines = deque()
+
+
+def bind_loop(loop: asyncio.AbstractEventLoop):
+    global _loop
+    _loop = loop
+
+
+def _get_bot_log(bot_name: str) -> BotLog:
+    bot_log = log_store.get(bot_name)
+    if bot_log is None:
+        bot_log = log_store[bot_name] = BotLog(listeners=log_listeners.setdefault(bot_name, set()))
+    return bot_log
+
+
+def _wake_subscribers(bot_log: BotLog):
+    if bot_log.subscribers or bot_log.listeners:
+        try:
+            asyncio.get_running_loop()
+            bot_log.wake()
+        except RuntimeError:
+            if _loop is not None:
+                _loop.call_soon_threadsafe(bot_log.wake)
+
+
+def _publish_entry(bot_name: str, entry: tuple):
+    seq, timestamp, record = entry
+    state.store.publish("log", {"b": bot_name, "s": seq, "t": timestamp, "m": str(record)})
+
+
+def append_log(bot_name: str, message) -> int:
+    """Append a line to a bot's ring buffer, wake its subscribers and return the sequence number."""
+    store = state.store
+    if store.shared and not store.owns(bot_name):
+        # Only the engine node running the bot numbers its lines; the others forward theirs to it
+        store.publish("log_forward", {"b": bot_name, "m": str(message)})
+        return 0
+
+    bot_log = _get_bot_log(bot_name)
+
+    # Collapse repeats of the same event (keep-alive, paused...) into a counter. Readers don't
+    # fetch a sequence number twice, so once the line has been read (here, or on another node
+    # mirroring it) a repeat goes on a new line instead.
+    code = getattr(message, "code", None)
+    if code is not None and bot_log.entries and not store.shared:
+        last_seq, _, last = bot_log.entries[-1]
+        if last_seq > bot_log.read_seq and getattr(last, "code", None) == code and last.fields == message.fields:
+            last.count += 1
+            return last_seq
+
+    entry, evicted = bot_log.append(message, time.time())
+    if evicted is not None and len(pending_lines) < LOG_MAX_PENDING:
+        pending_lines.append((bot_name, *evicted))
+    if store.shared:
+        _publish_entry(bot_name, entry)
+
+    _wake_subscribers(bot_log)
+    return entry[0]
+
+
+def apply_remote_entry(event: dict):
+    """Mirror a line appended by the engine node running the bot, keeping its sequence number."""
+    bot_log = _get_bot_log(event["b"])
+    entry = (event["s"], event["t"], event["m"])
+    if entry[0] < bot_log.next_seq:
+        return
+    if entry[0] > bot_log.next_seq:
+        # Missed events; sequence numbers in the buffer must stay contiguous
+        bot_log.entries.clear()
+    bot_log.entries.append(entry)
+    bot_log.next_seq = entry[0] + 1
+    _wake_subscribers(bot_log)
+
+
+def apply_forwarded_line(event: dict):
+    """Record a line logged by another worker, if this process runs the bot."""
+    if state.store.owns(event["b"]):
+        append_log(event["b"], event["m"])
+
+
+def get_logs(bot_name: str, since: int = 0) -> list:
+    bot_log = log_store.get(bot_name)
+    return bot_log.since(since) if bot_log else []
+
+
+def first_seq(bot_name: str) -> int:
+    """Oldest sequence number still held in memory for a bot."""
+    return _get_bot_log(bot_name).first_seq()
+
+
+def subscribe(bot_name: str):
+    _get_bot_log(bot_name).subscribers += 1
+
+
+def unsubscribe(bot_name: str):
+    bot_log = log_store.get(bot_name)
+    if bot_log and bot_log.subscribers:
+        bot_log.subscribers -= 1
+
+
+def add_listener(bot_name: str, event: asyncio.Event):
+    _get_bot_log(bot_name).listeners.add(event)
+
+
+def remove_listener(bot_name: str, event: asyncio.Event):
+    listeners = log_listeners.get(bot_name)
+    if listeners is not None:
+        listeners.discard(event)
+        if not listeners:
+            del log_listeners[bot_name]
+
+
+def subscriber_count() -> int:
+    return sum(bot_log.subscribers + len(bot_log.listeners) for bot_log in log_store.values())
+
+
+async def wait_for_logs(bot_name: str, since: int):
+    """Return entries after `since`, waiting without polling until at least one exists.
+
+    Returns None once the bot's log was removed (see remove_bot_log).
+    """
+    bot_log = _get_bot_log(bot_name)
+    while True:
+        entries = bot_log.since(since)
+        if entries:
+            return entries
+        await bot_log.changed.wait()
+        if log_store.get(bot_name) is not bot_log:
+            return None
+
+
+def remove_bot_log(bot_name: str, persist: bool = False):
+    """Drop a bot's ring buffer once this process no longer runs it, ending the streams waiting on it.
+
+    With `persist`, the lines still in memory are queued for Postgres first, so the history
+    survives the bot moving to another engine.
+    """
+    bot_log = log_store.pop(bot_name, None)
+    if bot_log is None:
+        return
+    if persist:
+        for entry in bot_log.entries:
+            if len(pending_lines) >= LOG_MAX_PENDING:
+                break
+            pending_lines.append((bot_name, *entry))
+    # Waiters see the log is gone; listeners poll the bot's name and find no new lines
+    bot_log.wake()
+
+
+def _partition_name(day: date) -> str:
+    return f"bot_log_lines_{day:%Y%m%d}"
+
+
+def create_log_table():
+    """Create the partitioned bot_log_lines table if it doesn't exist."""
+    from backend.main2 import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bot_log_lines (
+            bot_name VARCHAR(100) NOT NULL,
+            seq BIGINT NOT NULL,
+            logged_at TIMESTAMPTZ NOT NULL,
+            message TEXT NOT NULL
+        ) PARTITION BY RANGE (logged_at);
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _ensure_partitions(cursor, days):
+    for day in days:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {_partition_name(day)} PARTITION OF bot_log_lines "
+            "FOR VALUES FROM (%s) TO (%s)",
+            (day.isoformat(), (day + timedelta(days=1)).isoformat())
+        )
+
+
+def write_lines(batch: list):
+    """Persist a batch of evicted log lines in one multi-row insert."""
+    from backend.main2 import get_db_connection
+
+    rows = [
+        (bot_name, seq, datetime.fromtimestamp(timestamp, tz=timezone.utc), str(record))
+        for bot_name, seq, timestamp, record in batch
+    ]
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        with metrics.db_query_seconds.time("log_flush"):
+            _ensure_partitions(cursor, {row[2].date() for row in rows})
+            psycopg2.extras.execute_values(
+                cursor, "INSERT INTO bot_log_lines (bot_name, seq, logged_at, message) VALUES %s", rows
+            )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def apply_retention():
+    """Drop daily partitions older than LOG_RETENTION_DAYS."""
+    from backend.main2 import get_db_connection
+
+    cutoff = _partition_name(datetime.now(timezone.utc).date() - timedelta(days=LOG_RETENTION_DAYS))
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = 'bot_log_lines'
+        """)
+        for (partition,) in cursor.fetchall():
+            if partition < cutoff:
+                cursor.execute(f"DROP TABLE IF EXISTS {partition}")
+                logging.info(f"🧹 Dropped expired log partition {partition}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def flush_pending_lines():
+    while pending_lines:
+        batch = [pending_lines.popleft() for _ in range(min(LOG_FLUSH_BATCH, len(pending_lines)))]
+        try:
+            await asyncio.to_thread(write_lines, batch)
+        except Exception:
+            pending_lines.extendleft(reversed(batch))
+            raise
+
+
+async def run_log_persistence():
+    """Persist overflowed log lines in batches and enforce the retention policy."""
+    try:
+        await asyncio.to_thread(create_log_table)
+    except Exception as e:
+        logging.error(f"Error creating log table: {str(e)}")
+
+    last_retention = 0.0
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        try:
+            await flush_pending_lines()
+            if time.time() - last_retention > 3600:
+                await asyncio.to_thread(apply_retention)
+                last_retention = time.time()
+        except Exception as e:
+            logging.error(f"Error persisting bot logs: {str(e)}")
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import os
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from backend import metrics
+from backend.main2 import get_db_connection
+
+# SMTP provider; for local testing point these at a stand-in such as
+# `python -m aiosmtpd -n -l localhost:1025` with SMTP_STARTTLS=false and no SMTP_USER
+SMTP_SERVER = os.getenv("SMTP_SERVER")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+MAIL_FROM = os.getenv("MAIL_FROM", SMTP_USER)
+
+# Authenticated connections kept open and reused by the sender
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 2))
+# Idle connections older than this are checked with NOOP before reuse
+SMTP_IDLE_CHECK = float(os.getenv("SMTP_IDLE_CHECK", 30))  # seconds
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 20))  # seconds
+
+# Delivery retries
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 6))
+MAIL_RETRY_BASE_DELAY = int(os.getenv("MAIL_RETRY_BASE_DELAY", 10))  # seconds
+MAIL_RETRY_MAX_DELAY = int(os.getenv("MAIL_RETRY_MAX_DELAY", 900))  # seconds
+
+# Queue polling: the sender also wakes immediately when a message is enqueued in this process
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", 5))  # seconds
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 20))
+# A claimed message not settled within this time (sender died) is delivered again
+MAIL_CLAIM_TIMEOUT = int(os.getenv("MAIL_CLAIM_TIMEOUT", 300))  # seconds
+
+# Set when a message was enqueued by this process
+_wake = None
+
+
+class SMTPPool:
+    """Thread-safe pool of logged-in SMTP connections."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = []  # (connection, last_used)
+        self.lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_USER:
+            server.login(SMTP_USER, SMTP_PASSWORD)
+        return server
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                server, last_used = self.idle.pop()
+            if time.monotonic() - last_used < SMTP_IDLE_CHECK:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.discard(server)
+        with metrics.smtp_connect_seconds.time():
+            return self._connect()
+
+    def release(self, server: smtplib.SMTP):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((server, time.monotonic()))
+                return
+        self.discard(server)
+
+    def discard(self, server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for server, _ in idle:
+            self.discard(server)
+
+
+smtp_pool = SMTPPool(SMTP_POOL_SIZE)
+
+
+def create_mail_table():
+    """Create the outbound_mail queue table if it doesn't exist."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbound_mail (
+            id BIGSERIAL PRIMARY KEY,
+            recipient VARCHAR(100) NOT NULL,
+            subject VARCHAR(200) NOT NULL,
+            body TEXT NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'queued',
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbound_mail_due
+            ON outbound_mail (next_attempt_at) WHERE status IN ('queued', 'sending');
+        -- Bodies hold verification codes and reset links: only kept until the message is done
+        ALTER TABLE outbound_mail ALTER COLUMN body DROP NOT NULL;
+        UPDATE outbound_mail SET body = NULL WHERE status IN ('sent', 'failed') AND body IS NOT NULL;
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def insert_mail(recipient: str, subject: str, body: str) -> int:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO outbound_mail (recipient, subject, body) VALUES (%s, %s, %s) RETURNING id",
+            (recipient, subject, body)
+        )
+        mail_id = cursor.fetchone()[0]
+        conn.commit()
+        return mail_id
+    finally:
+        conn.close()
+
+
+async def enqueue_mail(recipient: str, subject: str, body: str) -> int:
+    """Queue a message durably and return its id; delivery happens in the background."""
+    mail_id = await asyncio.to_thread(insert_mail, recipient, subject, body)
+    metrics.mail_messages_total.inc("queued")
+    if _wake is not None:
+        _wake.set()
+    return mail_id
+
+
+def get_mail_status(mail_id: int) -> dict:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT status, attempts, last_error, created_at, sent_at FROM outbound_mail WHERE id = %s",
+            (mail_id,)
+        )
+        row = cursor.fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    status, attempts, last_error, created_at, sent_at = row
+    return {
+        "id": mail_id, "status": status, "attempts": attempts, "last_error": last_error,
+        "created_at": created_at, "sent_at": sent_at
+    }
+
+
+def claim_due_mail() -> list:
+    """Claim a batch of due messages; SKIP LOCKED lets several workers share the queue.
+
+    A claim pushes next_attempt_at forward, so messages of a sender that died become due again.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE outbound_mail
+            SET status = 'sending', next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE id IN (
+                SELECT id FROM outbound_mail
+                WHERE status IN ('queued', 'sending') AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, recipient, subject, body, attempts
+        """, (MAIL_CLAIM_TIMEOUT, MAIL_BATCH_SIZE))
+        rows = cursor.fetchall()
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def record_result(mail_id: int, attempts: int, error: str = None):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if error is None:
+            cursor.execute(
+                "UPDATE outbound_mail SET status = 'sent', attempts = %s, sent_at = CURRENT_TIMESTAMP, "
+                "last_error = NULL, body = NULL WHERE id = %s",
+                (attempts, mail_id)
+            )
+        elif attempts >= MAIL_MAX_ATTEMPTS:
+            cursor.execute(
+                "UPDATE outbound_mail SET status = 'failed', attempts = %s, last_error = %s, body = NULL "
+                "WHERE id = %s",
+                (attempts, error, mail_id)
+            )
+        else:
+            delay = min(MAIL_RETRY_BASE_DELAY * 2 ** (attempts - 1), MAIL_RETRY_MAX_DELAY)
+            cursor.execute(
+                "UPDATE outbound_mail SET status = 'queued', attempts = %s, last_error = %s, "
+                "next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second' WHERE id = %s",
+                (attempts, error, delay, mail_id)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def deliver(recipient: str, subject: str, body: str):
+    """Send one message over a pooled connection; a broken connection is dropped, not reused."""
+    msg = EmailMessage()
+    msg.set_content(body)
+    msg["Subject"] = subject
+    msg["From"] = MAIL_FROM
+    msg["To"] = recipient
+
+    server = smtp_pool.acquire()
+    try:
+        server.send_message(msg)
+    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+        # The message was rejected, the session itself is still usable
+        smtp_pool.release(server)
+        raise
+    except Exception:
+        smtp_pool.discard(server)
+        raise
+    smtp_pool.release(server)
+
+
+async def send_claimed(row: tuple, slots: asyncio.Semaphore):
+    mail_id, recipient, subject, body, attempts = row
+    async with slots:
+        try:
+            await asyncio.to_thread(deliver, recipient, subject, body)
+            error = None
+            metrics.mail_messages_total.inc("sent")
+        except Exception as e:
+            error = str(e)
+            metrics.mail_messages_total.inc("retry" if attempts + 1 < MAIL_MAX_ATTEMPTS else "failed")
+            logging.warning(f"📧 Delivery of mail {mail_id} to {recipient} failed (attempt {attempts + 1}): {error}")
+    await asyncio.to_thread(record_result, mail_id, attempts + 1, error)
+
+
+async def run_mail_sender():
+    """Deliver queued mail in the background, retrying failures with exponential backoff."""
+    global _wake
+    _wake = asyncio.Event()
+    slots = asyncio.Semaphore(SMTP_POOL_SIZE)
+
+    try:
+        await asyncio.to_thread(create_mail_table)
+    except Exception as e:
+        logging.error(f"Error creating outbound mail table: {str(e)}")
+
+    while True:
+        try:
+            rows = await asyncio.to_thread(claim_due_mail)
+            if rows:
+                await asyncio.gather(*(send_claimed(row, slots) for row in rows))
+                continue
+        except Exception as e:
+            logging.error(f"Error in mail sender: {str(e)}")
+
+        _wake.clear()
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=MAIL_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
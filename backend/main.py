@@ -4,12 +4,11 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, Field
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
+import asyncio
 import psycopg2
 import os
 import secrets
 import random
-import smtplib
-from email.message import EmailMessage
 from dotenv import load_dotenv
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -18,9 +17,10 @@ from passlib.context import CryptContext
 from fastapi.responses import HTMLResponse
 
 # Importing modules from backend
-from backend import main2
+from backend import mailer, main2, state
 from backend.main2 import router
-from backend.auth import get_current_user, login_user, create_access_token, get_password_hash, verify_password
+from backend.auth import get_current_user, login_user, create_access_token, hash_password
+from backend.entitlements import get_entitlement, set_entitlement
 
 # Load environment variables
 load_dotenv()
@@ -29,8 +29,8 @@ load_dotenv()
 app = FastAPI()
 app.include_router(router)
 
-# Store verification codes temporarily
-verification_codes = {}
+# Pending signups wait in the shared state store until verified (see backend.state)
+VERIFICATION_CODE_TTL = 600  # seconds
 
 # Security and JWT setup
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")
@@ -85,39 +85,29 @@ cursor.execute(
 )
 conn.commit()
 
+# Change counter of each bot's dashboard listing, shared by all processes (see backend.bot_cache)
+cursor.execute(
+    """
+    CREATE SEQUENCE IF NOT EXISTS bot_listing_version;
+    ALTER TABLE bots ADD COLUMN IF NOT EXISTS listing_version BIGINT NOT NULL DEFAULT nextval('bot_listing_version');
+    CREATE OR REPLACE FUNCTION bump_bot_listing_version() RETURNS trigger AS $$
+    BEGIN
+        NEW.listing_version := nextval('bot_listing_version');
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE OR REPLACE TRIGGER bots_listing_version BEFORE UPDATE ON bots
+        FOR EACH ROW EXECUTE FUNCTION bump_bot_listing_version();
+    """
+)
+conn.commit()
+
 # Utility Functions
-def send_reset_email(email: str, reset_link: str):
-    smtp_server = os.getenv("SMTP_SERVER")
-    smtp_port = int(os.getenv("SMTP_PORT", 587))
-    smtp_user = os.getenv("SMTP_USER")
-    smtp_password = os.getenv("SMTP_PASSWORD")
-
-    msg = EmailMessage()
-    msg.set_content(f"Click the link to reset your password: {reset_link}\n\nThis link will expire in 15 minutes.")
-    msg["Subject"] = "Password Reset Request"
-    msg["From"] = smtp_user
-    msg["To"] = email
-
-    with smtplib.SMTP(smtp_server, smtp_port) as server:
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.send_message(msg)
-
-# Subscription plans configuration
-SUBSCRIPTION_PLANS = {
-    "free": {
-        "bot_limit": 1,
-        "trade_limit": 4
-    },
-    "basic": {
-        "bot_limit": 5,
-        "trade_limit": -1  # unlimited
-    },
-    "premium": {
-        "bot_limit": 6,
-        "trade_limit": -1  # unlimited
-    }
-}
+async def send_reset_email(email: str, reset_link: str):
+    await mailer.enqueue_mail(
+        email, "Password Reset Request",
+        f"Click the link to reset your password: {reset_link}\n\nThis link will expire in 15 minutes."
+    )
 
 # Pydantic Models
 class User(BaseModel):
@@ -138,24 +128,12 @@ class TokenData(BaseModel):
     email: str | None = None
 
 # Email Verification
-def send_verification_email(email: str, code: str):
+async def send_verification_email(email: str, code: str):
     try:
-        smtp_server = os.getenv("SMTP_SERVER")
-        smtp_port = int(os.getenv("SMTP_PORT", 587))
-        smtp_user = os.getenv("SMTP_USER")
-        smtp_password = os.getenv("SMTP_PASSWORD")
-
-        msg = EmailMessage()
-        msg.set_content(f"Your verification code is: {code}\n\nThis code will expire in 10 minutes.")
-        msg["Subject"] = "Email Verification Code"
-        msg["From"] = smtp_user
-        msg["To"] = email
-
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-
+        await mailer.enqueue_mail(
+            email, "Email Verification Code",
+            f"Your verification code is: {code}\n\nThis code will expire in 10 minutes."
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to send verification email.")
 
@@ -194,14 +172,18 @@ def subscription_page(request: Request):
 
 @app.get("/check-subscription-status")
 async def check_subscription_status(current_user: dict = Depends(get_current_user)):
-    # For now, returning mock data. You'll need to implement actual subscription check logic
-    cursor.execute("SELECT subscription_status FROM users WHERE email = %s", (current_user["email"],))
-    result = cursor.fetchone()
-    return {"active": result[0] if result else False}
+    entitlement = await get_entitlement(current_user["email"])
+    return {
+        "active": entitlement.active,
+        "plan": entitlement.plan_id,
+        "bot_limit": entitlement.bot_limit,
+        "trade_limit": entitlement.trade_limit,
+        "end_date": entitlement.end_date.isoformat() if entitlement.end_date else None
+    }
 
 @app.get("/create-subscription-payment/{plan_id}")
 def create_subscription_payment(plan_id: str):
-    from backend.payment import create_payment_intent, SUBSCRIPTION_PLANS
+    from backend.payment import create_payment_intent
     return create_payment_intent(plan_id)
 
 @app.post("/verify-payment")
@@ -211,6 +193,7 @@ async def verify_payment(payment_data: dict, current_user: dict = Depends(get_cu
         cursor.execute("""
             INSERT INTO subscriptions (user_email, plan_id, status, end_date, payment_id, amount)
             VALUES (%s, %s, %s, NOW() + INTERVAL '30 days', %s, %s)
+            RETURNING end_date
         """, (
             current_user["email"],
             payment_data["plan_id"],
@@ -218,6 +201,7 @@ async def verify_payment(payment_data: dict, current_user: dict = Depends(get_cu
             payment_data["payment_id"],
             payment_data["amount"]
         ))
+        end_date = cursor.fetchone()[0]
         
         # Update user's subscription status
         cursor.execute("""
@@ -228,6 +212,7 @@ async def verify_payment(payment_data: dict, current_user: dict = Depends(get_cu
         """, (payment_data["plan_id"], current_user["email"]))
         
         conn.commit()
+        set_entitlement(current_user["email"], payment_data["plan_id"], True, end_date)
         return {"success": True}
     except Exception as e:
         conn.rollback()
@@ -246,6 +231,7 @@ async def activate_free_plan(current_user: dict = Depends(get_current_user)):
             (current_user["email"],)
         )
         conn.commit()
+        set_entitlement(current_user["email"], "free", True)
         return {"success": True, "message": "Free plan activated successfully!"}
     except Exception as e:
         conn.rollback()
@@ -261,67 +247,80 @@ app.add_middleware(
 )
 
 # Routes
+def find_user(email: str):
+    cursor.execute("SELECT id, email FROM users WHERE email = %s", (email,))
+    return cursor.fetchone()
+
 @app.post("/signup")
-def signup(user: User):
-    cursor.execute("SELECT id FROM users WHERE email = %s", (user.email,))
-    existing_user = cursor.fetchone()
+async def signup(user: User):
+    existing_user = await asyncio.to_thread(find_user, user.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already exists.")
     
     verification_code = str(random.randint(100000, 999999))
-    verification_codes[user.email] = {
+    user_data = user.dict()
+    # Only the hash is kept while the signup is pending
+    user_data["password"] = await hash_password(user_data["password"])
+    await state.store.put("verification", user.email, {
         "code": verification_code,
-        "user_data": user.dict()
-    }
-    send_verification_email(user.email, verification_code)
+        "user_data": user_data
+    }, ttl=VERIFICATION_CODE_TTL)
+    await send_verification_email(user.email, verification_code)
     return {"message": "Verification code sent to your email."}
 
+def insert_verified_user(user_data: dict, hashed_password: str):
+    cursor.execute(
+        "INSERT INTO users (first_name, last_name, email, password, is_verified) VALUES (%s, %s, %s, %s, %s)",
+        (user_data['first_name'], user_data['last_name'], user_data['email'], hashed_password, True)
+    )
+    conn.commit()
+
 @app.post("/verify-email")
-def verify_email(data: VerifyCode):
-    if data.email in verification_codes:
-        stored_data = verification_codes[data.email]
+async def verify_email(data: VerifyCode):
+    stored_data = await state.store.get("verification", data.email)
+    if stored_data:
         if stored_data["code"] == data.code:
+            # Claim the code atomically so two workers can't both create the user
+            stored_data = await state.store.pop("verification", data.email)
+            if not stored_data:
+                raise HTTPException(status_code=400, detail="Verification code not found or expired.")
             user_data = stored_data["user_data"]
-            hashed_password = get_password_hash(user_data['password'])
-
-            cursor.execute(
-                "INSERT INTO users (first_name, last_name, email, password, is_verified) VALUES (%s, %s, %s, %s, %s)",
-                (user_data['first_name'], user_data['last_name'], user_data['email'], hashed_password, True)
-            )
-            conn.commit()
-            del verification_codes[data.email]
+
+            await asyncio.to_thread(insert_verified_user, user_data, user_data['password'])
             return {"message": "Email verified successfully."}
         else:
             raise HTTPException(status_code=400, detail="Invalid verification code.")
     raise HTTPException(status_code=400, detail="Verification code not found or expired.")
 
 @app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    return login_user(form_data)
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    return await login_user(form_data)
 
 @app.post("/forgot-password")
-def forgot_password(request: Request, data: VerifyCode):
-    cursor.execute("SELECT id, email FROM users WHERE email = %s", (data.email,))
-    user = cursor.fetchone()
+async def forgot_password(request: Request, data: VerifyCode):
+    user = await asyncio.to_thread(find_user, data.email)
     if not user:
         raise HTTPException(status_code=404, detail="Email not registered")
 
     reset_token = create_access_token(data={"sub": data.email}, expires_delta=timedelta(minutes=15))
     reset_link = f"{request.url.scheme}://{request.headers.get('host')}/reset-password?token={reset_token}"
-    send_reset_email(data.email, reset_link)
+    await send_reset_email(data.email, reset_link)
     return {"message": "Password reset link sent."}
 
+def update_password(email: str, hashed_password: str):
+    cursor.execute("UPDATE users SET password = %s WHERE email = %s", (hashed_password, email))
+    conn.commit()
+
 @app.post("/reset-password")
-def reset_password(data: VerifyCode):
+async def reset_password(data: VerifyCode):
     try:
         payload = jwt.decode(data.code, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
         if not email:
             raise HTTPException(status_code=400, detail="Invalid reset token")
         
-        hashed_password = get_password_hash(data.code)
-        cursor.execute("UPDATE users SET password = %s WHERE email = %s", (hashed_password, email))
-        conn.commit()
+        hashed_password = await hash_password(data.code)
+        await asyncio.to_thread(update_password, email, hashed_password)
         return {"message": "Password reset successful."}
 
     except JWTError:
@@ -9,34 +9,51 @@ import psycopg2.extras
 from dotenv import load_dotenv
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, Header
 from pydantic import BaseModel
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
 from typing import Optional, Dict, List
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
 from email.header import decode_header
 import time
-from fastapi.responses import JSONResponse
-import random
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from backend import log_store, metrics
+from backend.auth import decode_token, get_current_user
 
 # Load environment variables
 load_dotenv()
 
-# Get database URL and secret key from environment variables
+# Get database URL from environment variables (JWT settings live in backend.auth)
 DATABASE_URL = os.getenv("DATABASE_URL")
-SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")
-ALGORITHM = "HS256"
 
 # OAuth2 setup
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 router = APIRouter()
 
-# Log streams for each bot
-bot_logs = {}
-
 # Active bots dictionary
 active_bots: Dict[str, 'Bot'] = {}
 
+# Set when the engine shuts down: no new mailbox checks start and running ones stop after the current email
+engine_draining = asyncio.Event()
+
+# Mailbox check in progress per bot, awaited while draining and before a bot is handed over
+inflight_checks: Dict[str, asyncio.Task] = {}
+
+# Websocket clients send their token in the first message, within this long after connecting
+WEBSOCKET_AUTH_TIMEOUT = 10  # seconds
+
+# Idle IMAP sessions (not polled for this long) get a NOOP so the server doesn't drop them
+IMAP_KEEPALIVE_INTERVAL = 30  # seconds
+
+# Message-IDs of executed signal emails kept per bot (see backend.snapshots)
+RECENT_MESSAGE_IDS = int(os.getenv("RECENT_MESSAGE_IDS", 50))
+
+# Passes that retry a signal whose order never reached the exchange, before its email is given up
+SIGNAL_MAX_RETRIES = int(os.getenv("SIGNAL_MAX_RETRIES", 3))
+
 
 @dataclass
 class Bot:
@@ -45,7 +62,9 @@ class Bot:
     symbol: str
     quantity: float
     position: str = "neutral"
+    pending: Optional[str] = None  # "opening" / "closing" while an order is in flight (see backend.positions)
     paused: bool = False  # New field to track pause state
+    user_email: str = None  # Owner of the bot
 
     # API fields for standard exchanges
     api_key: str = None
@@ -67,6 +86,19 @@ class Bot:
     email_subject: str = None
     imap_session: imaplib.IMAP4_SSL = None
 
+    # Reconnect backoff state (see backend.bootstrap)
+    retry_attempts: int = 0
+    next_retry_at: float = 0.0
+
+    # Message-IDs of signal emails already traded, so they are never executed twice
+    recent_message_ids: deque = field(default_factory=lambda: deque(maxlen=RECENT_MESSAGE_IDS))
+
+    # Failed attempts per signal email still being retried (see execute_batch)
+    signal_failures: Dict[str, int] = field(default_factory=dict)
+
+    # Serializes position changes of this bot (see backend.positions)
+    position_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+
     # Task reference for monitoring
     monitoring_task = None
 
@@ -76,6 +108,9 @@ class TradeSignal:
     action: str
     symbol: str
     quantity: float
+    message_id: Optional[str] = None  # Message-ID of the source email
+    detected_at: Optional[float] = None  # When the signal was parsed from the email
+    trace: Dict[str, float] = field(default_factory=dict)  # Stage timestamps, see backend.tracing
 
 
 class BotConfigRequest(BaseModel):
@@ -104,6 +139,35 @@ class BotConfigRequest(BaseModel):
     emailSubject: str | None = None
 
 
+class BotUpdateRequest(BaseModel):
+    """Settings of a running bot that PATCH /bots/{name} may change; omitted fields stay as they are."""
+    exchange: str | None = None
+    symbol: str | None = None
+    quantity: float | None = None
+    apiKey: str | None = None
+    apiSecret: str | None = None
+    accountId: str | None = None
+    emailAddress: str | None = None
+    emailPassword: str | None = None
+    imapServer: str | None = None
+    emailSubject: str | None = None
+
+
+# BotUpdateRequest field -> bots table column
+BOT_UPDATE_COLUMNS = {
+    "exchange": "exchange",
+    "symbol": "symbol",
+    "quantity": "quantity",
+    "apiKey": "api_key",
+    "apiSecret": "api_secret",
+    "accountId": "account_id",
+    "emailAddress": "email",
+    "emailPassword": "email_password",
+    "imapServer": "imap_server",
+    "emailSubject": "email_subject",
+}
+
+
 def get_db_connection():
     """Get a connection to the PostgreSQL database."""
     try:
@@ -118,21 +182,65 @@ def normalize_symbol(symbol: str) -> str:
     return re.sub(r'\W+', '', symbol.upper())
 
 
-def log_message(bot_name: str, message: str):
-    """Log a message for a specific bot."""
-    if bot_name not in bot_logs:
-        bot_logs[bot_name] = []
+# Multi-line email templates, rendered lazily; `{body:.500}` truncates the body at read time
+TRADE_EXECUTED_TEMPLATE = """
+                        ✅ Trade executed successfully: {action} {symbol}
+                        💹 Trade Details:
+                          - Exchange: {exchange}
+                          - Symbol: {symbol}
+                          - Action: {action}
+                          - Quantity: {quantity}
+                        📅 Email Date: {date}  
+                        📨 Subject: {subject}  
+                        📝 Body: {body:.500}
+                        """
+TRADE_FAILED_TEMPLATE = """
+                        ❌ Trade failed: {error}  
+                        📅 Email Date: {date}  
+                        📨 Subject: {subject}  
+                        📝 Body: {body:.500}
+                        """
+TRADE_REJECTED_TEMPLATE = """
+                        🚫 Trade rejected: {error}  
+                        📅 Email Date: {date}  
+                        📨 Subject: {subject}  
+                        📝 Body: {body:.500}
+                        """
+NO_SIGNAL_TEMPLATE = """
+                    🚫 No valid trade signal found in email.  
+                    📅 Email Date: {date}  
+                    📨 Subject: {subject}  
+                    📝 Body: {body:.500}
+                    """
+SUBJECT_MISMATCH_TEMPLATE = """
+                🚫 Email ignored — Subject mismatch.  
+                📅 Email Date: {date}  
+                📨 Subject: {subject}  
+                📝 Body: {body:.500}
+                """
+
+
+def log_message(bot_name: str, message: str, level: int = logging.INFO, code: str = None, **fields):
+    """Log a message for a specific bot.
 
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    formatted_message = f"[{timestamp}] {message}"
-    bot_logs[bot_name].append(formatted_message)
-    logging.info(f"Bot {bot_name}: {message}")
+    `message` is a str.format template rendered from `fields` only when read.
+    Events below BOT_LOG_LEVEL are dropped, and repeats of the same `code` are counted
+    instead of stored again. Warnings and errors are mirrored to the process log.
+    """
+    if level < log_store.BOT_LOG_LEVEL:
+        return
+    record = log_store.BotLogRecord(level, code, message, fields)
+    log_store.append_log(bot_name, record)
+    if level >= logging.WARNING:
+        logging.log(level, "Bot %s: %s", bot_name, record)
 
 
 def connect_imap(bot: Bot):
     """Establish a secure IMAP connection for a bot."""
+    start = time.perf_counter()
     try:
-        log_message(bot.name, f"📩 Connecting to IMAP server {bot.imap_server} for bot '{bot.name}'...")
+        log_message(bot.name, "📩 Connecting to IMAP server {server} for bot '{bot}'...",
+                    code="imap_connecting", server=bot.imap_server, bot=bot.name)
         bot.imap_session = imaplib.IMAP4_SSL(bot.imap_server)
         status, response = bot.imap_session.login(bot.email_address, bot.email_password)
 
@@ -143,14 +251,42 @@ def connect_imap(bot: Bot):
         if status != "OK":
             raise Exception("Failed to select INBOX.")
 
-        log_message(bot.name, f"✅ IMAP session established successfully for bot '{bot.name}'! Inbox selected.")
+        log_message(bot.name, "✅ IMAP session established successfully for bot '{bot}'! Inbox selected.",
+                    code="imap_connected", bot=bot.name)
+        metrics.imap_connect_seconds.observe(time.perf_counter() - start, "success")
         return True
     except Exception as e:
-        log_message(bot.name, f"⚠️ IMAP connection failed: {str(e)}")
+        metrics.imap_connect_seconds.observe(time.perf_counter() - start, "failure")
+        log_message(bot.name, "⚠️ IMAP connection failed: {error}", level=logging.WARNING,
+                    code="imap_connect_failed", error=str(e))
         bot.imap_session = None
         return False
 
 
+def close_imap_session(bot: Bot):
+    """Log out of a bot's mailbox, ignoring errors from a dead connection."""
+    if bot.imap_session:
+        try:
+            bot.imap_session.close()
+            bot.imap_session.logout()
+        except Exception:
+            pass
+        bot.imap_session = None
+
+
+def email_timestamps(msg, fetch_response) -> dict:
+    """Epoch seconds for when an email was sent (Date header) and delivered (INTERNALDATE)."""
+    timestamps = {}
+    try:
+        timestamps["sent"] = parsedate_to_datetime(msg.get("Date")).timestamp()
+    except (TypeError, ValueError, IndexError):
+        pass
+    internal_date = imaplib.Internaldate2tuple(fetch_response) if fetch_response else None
+    if internal_date:
+        timestamps["delivered"] = time.mktime(internal_date)
+    return timestamps
+
+
 def decode_email_subject(subject):
     """Decode email subject line to proper text format.
 
@@ -241,42 +377,54 @@ def get_email_body(msg):
 
 
 async def check_email_for_signals():
-    """Check unread emails in the inbox for trade signals for each bot, prioritizing newest first."""
-    # Import bot_manager at the function level to avoid circular imports
-    from backend import bot_manager
+    """Check each bot's inbox for trade signals whenever its adaptive poll schedule says it is due.
 
-    # Reduce the main loop delay to check more frequently
-    check_interval = 1  # Check every second
+    Due checks run within their owner's fair share of the mailbox slots (see backend.fair_queue).
+    """
+    from backend import fair_queue, polling
 
-    while True:
-        tasks = []
-        for bot_name, bot in active_bots.items():
-            # Create a task for each bot to check emails concurrently
-            tasks.append(asyncio.create_task(check_bot_emails(bot_name, bot)))
+    def finished(bot_name):
+        return lambda task: inflight_checks.pop(bot_name, None)
 
-        # Wait for all tasks to complete
-        if tasks:
-            await asyncio.gather(*tasks)
+    async def fair_check(bot):
+        async with fair_queue.mailbox_slot(bot):
+            await check_bot_emails(bot.name, bot)
 
-        # Short sleep to prevent excessive CPU usage
-        await asyncio.sleep(check_interval)
+    while not engine_draining.is_set():
+        # A bot whose check is still queued or running isn't due again
+        for bot in polling.due_bots(active_bots, inflight_checks, time.time()):
+            task = asyncio.create_task(fair_check(bot))
+            inflight_checks[bot.name] = task
+            task.add_done_callback(finished(bot.name))
+        polling.start_seeding()
+
+        await asyncio.sleep(polling.POLL_TICK)
 
 
 async def check_bot_emails(bot_name: str, bot):
     """Check emails for a single bot"""
+    from backend import bootstrap, state
+
+    # Its lease may have been lost (or handed over) since the check was scheduled
+    if not state.store.owns(bot_name):
+        return
+
     # Skip paused bots
     if bot.paused:
-        # Only log this once in a while to avoid spamming logs
-        if random.random() < 0.01:  # ~1% chance to log
-            log_message(bot_name, "⏸️ Bot is paused, skipping email check")
+        # Repeats collapse into a single counted line
+        log_message(bot_name, "⏸️ Bot is paused, skipping email check", level=logging.DEBUG, code="paused")
         return
 
     if not bot.imap_session:
-        log_message(bot_name, "⚠️ IMAP session inactive. Reconnecting...")
+        # Bots in the retry state wait out their backoff before reconnecting
+        if time.time() < bot.next_retry_at:
+            return
+        log_message(bot_name, "⚠️ IMAP session inactive. Reconnecting...", level=logging.WARNING, code="imap_inactive")
         if not connect_imap(bot):
-            log_message(bot_name, "⚠️ Failed to reconnect to IMAP, will retry later")
-            await asyncio.sleep(5)  # Wait a bit before trying other bots
+            log_message(bot_name, "⚠️ Failed to reconnect to IMAP, will retry later", level=logging.WARNING, code="imap_reconnect_failed")
+            bootstrap.schedule_retry(bot)
             return
+        bootstrap.mark_live(bot)
 
     try:
         # Check pause state AGAIN before search
@@ -284,16 +432,20 @@ async def check_bot_emails(bot_name: str, bot):
             return
 
         # Search for unread emails in newest-first order
+        search_started = time.perf_counter()
         try:
             # First try with SORT command which is more reliable for sorting
             status, messages = bot.imap_session.sort('REVERSE DATE', 'UTF-8', 'UNSEEN')
         except Exception as e:
-            log_message(bot_name, f"⚠️ SORT command failed, falling back to standard search: {str(e)}")
+            log_message(bot_name, "⚠️ SORT command failed, falling back to standard search: {error}",
+                        level=logging.DEBUG, code="sort_unsupported", error=str(e))
             # Fallback to basic search without date sorting (IMAP servers without SORT capability)
             status, messages = bot.imap_session.search(None, "(UNSEEN)")
+        metrics.imap_search_seconds.observe(time.perf_counter() - search_started)
+        seen_at = time.time()
 
         if status != "OK":
-            log_message(bot_name, "⚠️ IMAP search failed.")
+            log_message(bot_name, "⚠️ IMAP search failed.", level=logging.WARNING, code="imap_search_failed")
             return
 
         # Process the message IDs
@@ -304,29 +456,52 @@ async def check_bot_emails(bot_name: str, bot):
             # Handle the SORT command result format
             unread_ids = messages
 
-        log_message(bot_name, f"📥 Found {len(unread_ids)} unread emails to process")
+        log_message(bot_name, "📥 Found {count} unread emails to process", level=logging.DEBUG,
+                    code="unread_found", count=len(unread_ids))
 
+        # Signals found in this pass, executed after coalescing
+        batch = []
+        session = bot.imap_session
         for num in unread_ids:
             # Check pause state AGAIN before each email
-            if bot.paused:
+            if bot.paused or engine_draining.is_set():
+                break
+            # A big inbox mustn't hold up orders and other users' checks until it is fully read
+            await asyncio.sleep(0)
+            if bot.imap_session is not session:
+                # Closed or switched to another mailbox meanwhile; these message numbers are stale
                 break
 
-            status, msg_data = bot.imap_session.fetch(num, "(RFC822)")
+            fetch_started = time.perf_counter()
+            status, msg_data = bot.imap_session.fetch(num, "(INTERNALDATE RFC822)")
+            fetched_at = time.time()
+            metrics.imap_fetch_seconds.observe(time.perf_counter() - fetch_started)
 
             if status != "OK" or not msg_data or not msg_data[0]:
-                log_message(bot_name, f"⚠️ Failed to fetch email")
+                log_message(bot_name, "⚠️ Failed to fetch email", level=logging.WARNING, code="fetch_failed")
                 continue
 
+            metrics.emails_scanned_total.inc()
+            parse_started = time.perf_counter()
             msg = email.message_from_bytes(msg_data[0][1])
 
+            message_id = msg.get("Message-ID")
+            if message_id and message_id in bot.recent_message_ids:
+                # Traded before a restart, but the email wasn't marked as seen
+                log_message(bot_name, "⏭️ Skipping already executed signal email {message_id}",
+                            code="already_executed", message_id=message_id)
+                mark_email(bot, num, True, "already executed")
+                continue
+
             # Extract subject, date, and body
             subject = decode_email_subject(msg.get("Subject", ""))
             date_str = msg.get("Date", "Unknown date")
 
             # Get email body
             body = get_email_body(msg)
+            metrics.email_parse_seconds.observe(time.perf_counter() - parse_started)
             if not body:
-                log_message(bot_name, "⚠️ Could not extract email body. Skipping.")
+                log_message(bot_name, "⚠️ Could not extract email body. Skipping.", level=logging.WARNING, code="empty_body")
                 continue
 
             # Check for subject match using email_subject from database or symbol
@@ -335,166 +510,208 @@ async def check_bot_emails(bot_name: str, bot):
                 # If email_subject is specified in database, check if it's in the subject
                 if bot.email_subject.lower() in subject.lower():
                     should_process = True
-                    log_message(bot_name, f"📄 Email subject match found: '{bot.email_subject}'")
+                    log_message(bot_name, "📄 Email subject match found: '{subject}'", subject=bot.email_subject)
             else:
                 # Fallback to symbol matching if no email_subject is specified
                 normalized_symbol = normalize_symbol(bot.symbol)
                 if normalized_symbol.lower() in subject.lower():
                     should_process = True
-                    log_message(bot_name, f"📄 Symbol match found in subject: '{normalized_symbol}'")
+                    log_message(bot_name, "📄 Symbol match found in subject: '{symbol}'", symbol=normalized_symbol)
 
             if should_process:
-                log_message(bot_name, f"📄 Processing email body for trading signals...")
+                metrics.emails_matched_total.inc()
+                log_message(bot_name, "📄 Processing email body for trading signals...", level=logging.DEBUG)
 
                 # Process the body for buy/sell signals
                 body_lower = body.lower()
 
                 # Define the signal based on keywords in the body
                 action = None
+                detected_at = time.time()
                 if re.search(r'\b(buy|demand)\b', body_lower):
                     action = "buy"
                     log_message(bot_name, "🔍 BUY signal detected in the email body!")
                 elif re.search(r'\b(sell|supply)\b', body_lower):
                     action = "sell"
                     log_message(bot_name, "🔍 SELL signal detected in the email body!")
+                if action:
+                    metrics.signals_detected_total.inc(action)
 
                 if action:
-                    # Check for position conflict
-                    if bot.position != "neutral" and bot.position != action:
-                        log_message(bot_name, f"🔁 Signal conflict detected: Closing '{bot.position}' positions to switch to '{action}'.")
-
-                        try:
-                            # Close existing position before switching
-                            close_signal = TradeSignal(action="close", symbol=bot.symbol, quantity=bot.quantity)
-                            close_result = await bot_manager.close_position(bot, close_signal)
-                            log_message(bot_name, f"🔒 Closed '{bot.position}' position: {close_result}")
-
-                            # Update position to neutral after closing
-                            bot.position = "neutral"
-                        except Exception as e:
-                            log_message(bot_name, f"❌ Failed to close position: {str(e)}")
-                            continue
-
-                    # Create a trade signal
+                    # Create a trade signal; the batch is coalesced once every email was read
                     signal = TradeSignal(
                         action=action,
                         symbol=bot.symbol,
-                        quantity=bot.quantity
+                        quantity=bot.quantity,
+                        message_id=message_id,
+                        detected_at=detected_at,
+                        trace={
+                            **email_timestamps(msg, msg_data[0][0]),
+                            "seen": seen_at,
+                            "fetched": fetched_at,
+                            "parsed": detected_at,
+                        }
                     )
-
-                    try:
-                        # Execute the trade
-                        log_message(bot_name, f"🚀 Executing {action.upper()} order for {bot.symbol}...")
-                        result = await bot_manager.place_trade(bot, signal)
-
-                        log_message(bot_name, f"""
-                        ✅ Trade executed successfully: {action.upper()} {bot.symbol}
-                        💹 Trade Details:
-                          - Exchange: {bot.exchange}
-                          - Symbol: {bot.symbol}
-                          - Action: {action.upper()}
-                          - Quantity: {bot.quantity}
-                        📅 Email Date: {date_str}  
-                        📨 Subject: {subject}  
-                        📝 Body: {body[:500]}{'...' if len(body) > 500 else ''}
-                        """)
-
-                        # Update bot position
-                        bot.position = action
-
-                        # Mark email as seen since we found and executed a valid signal
-                        if bot.imap_session:
-                            try:
-                                bot.imap_session.store(num, '+FLAGS', '\\Seen')
-                                log_message(bot_name, f"📧 Marked email as seen after successful trade")
-                            except Exception as e:
-                                log_message(bot_name, f"⚠️ Failed to mark email as seen: {str(e)}")
-                                # Try to reconnect
-                                reconnect_bot(bot)
-
-                    except Exception as e:
-                        log_message(bot_name, f"""
-                        ❌ Trade failed: {str(e)}  
-                        📅 Email Date: {date_str}  
-                        📨 Subject: {subject}  
-                        📝 Body: {body[:500]}{'...' if len(body) > 500 else ''}
-                        """)
-
-                        # Mark email as UNSEEN if trade failed
-                        if bot.imap_session:
-                            try:
-                                # Remove the \Seen flag to mark as unread again
-                                bot.imap_session.store(num, '-FLAGS', '\\Seen')
-                                log_message(bot_name, f"📧 Marked email as UNSEEN again (trade failed)")
-                            except Exception as e:
-                                log_message(bot_name, f"⚠️ Failed to mark email as unseen: {str(e)}")
-                                # Try to reconnect
-                                reconnect_bot(bot)
+                    batch.append({"num": num, "session": session, "signal": signal, "date": date_str,
+                                  "subject": subject, "body": body})
                 else:
-                    log_message(bot_name, f"""
-                    🚫 No valid trade signal found in email.  
-                    📅 Email Date: {date_str}  
-                    📨 Subject: {subject}  
-                    📝 Body: {body[:500]}{'...' if len(body) > 500 else ''}
-                    """)
-
+                    log_message(bot_name, NO_SIGNAL_TEMPLATE, code="no_signal",
+                                date=date_str, subject=subject, body=body)
 
                     # Mark email as UNSEEN again so it remains unread for the user
-                    if bot.imap_session:
-                        try:
-                            # Remove the \Seen flag to mark as unread again
-                            bot.imap_session.store(num, '-FLAGS', '\\Seen')
-                            log_message(bot_name, f"📧 Marked email as UNSEEN again (no valid signal)")
-                        except Exception as e:
-                            log_message(bot_name, f"⚠️ Failed to mark email as unseen: {str(e)}")
-                            # Try to reconnect
-                            reconnect_bot(bot)
+                    mark_email(bot, num, False, "no valid signal")
             else:
-                log_message(bot_name, f"""
-                🚫 Email ignored — Subject mismatch.  
-                📅 Email Date: {date_str}  
-                📨 Subject: {subject}  
-                📝 Body: {body[:500]}{'...' if len(body) > 500 else ''}
-                """)
-
+                log_message(bot_name, SUBJECT_MISMATCH_TEMPLATE, level=logging.DEBUG, code="subject_mismatch",
+                            date=date_str, subject=subject, body=body)
 
                 # Mark email as UNSEEN again so it remains unread for the user
-                if bot.imap_session:
-                    try:
-                        # Remove the \Seen flag to mark as unread again
-                        bot.imap_session.store(num, '-FLAGS', '\\Seen')
-                        log_message(bot_name, f"📧 Marked email as UNSEEN again (subject mismatch)")
-                    except Exception as e:
-                        log_message(bot_name, f"⚠️ Failed to mark email as unseen: {str(e)}")
-                        # Try to reconnect
-                        reconnect_bot(bot)
+                mark_email(bot, num, False, "subject mismatch")
 
             # If there's an error with the IMAP session, break and try to reconnect
             if not bot.imap_session:
-                log_message(bot_name, "⚠️ IMAP session lost during processing")
+                log_message(bot_name, "⚠️ IMAP session lost during processing", level=logging.WARNING, code="imap_lost")
                 reconnect_bot(bot)
                 break
 
+        if batch and not bot.paused:
+            await execute_batch(bot, batch)
+
     except Exception as e:
-        log_message(bot_name, f"⚠️ Email check failed: {str(e)}")
+        log_message(bot_name, "⚠️ Email check failed: {error}", level=logging.WARNING, code="check_failed", error=str(e))
         bot.imap_session = None
 
-    await asyncio.sleep(1)
 
+def mark_email(bot, num, seen: bool, reason: str, session=None):
+    """Set or clear an email's \\Seen flag, reconnecting if the session broke.
+
+    `session` is the IMAP session `num` was read with, if that may have been replaced since.
+    """
+    if not bot.imap_session:
+        return
+    if session is not None and bot.imap_session is not session:
+        # Another mailbox (or a new session) now: the message number means something else there
+        log_message(bot.name, "⏭️ Not marking email as {flag}: the mailbox session changed", level=logging.DEBUG,
+                    flag="seen" if seen else "unseen")
+        return
+    try:
+        bot.imap_session.store(num, '+FLAGS' if seen else '-FLAGS', '\\Seen')
+        log_message(bot.name, "📧 Marked email as {flag} ({reason})", level=logging.DEBUG,
+                    flag="seen" if seen else "UNSEEN again", reason=reason)
+    except Exception as e:
+        log_message(bot.name, "⚠️ Failed to mark email as {flag}: {error}", level=logging.WARNING,
+                    flag="seen" if seen else "unseen", error=str(e))
+        # Try to reconnect
+        reconnect_bot(bot)
+
+
+async def execute_batch(bot, batch: list):
+    """Trade only the net final intent of a mailbox pass; older and stale signals are dropped."""
+    from backend import bot_manager, coalescing, journal, polling, state
+
+    if not state.store.owns(bot.name):
+        # The lease went to another node during this pass; fetching marked the emails as seen,
+        # so they are flagged unread again for the new owner
+        log_message(bot.name, "⏭️ Not trading {count} signals: this engine no longer runs the bot",
+                    level=logging.WARNING, code="lease_lost", count=len(batch))
+        for item in batch:
+            mark_email(bot, item["num"], False, "left to the new owner", item["session"])
+        return
+    for item in batch:
+        polling.record_signal(bot.name, coalescing.signal_time(item["signal"]))
+    final, dropped = coalescing.coalesce(batch, time.time())
+    for item, reason in dropped:
+        signal = item["signal"]
+        metrics.signals_coalesced_total.inc(reason)
+        log_message(bot.name, "⏭️ Dropped {reason} {action} signal from {date}", code="signal_dropped",
+                    reason=reason, action=signal.action.upper(), date=item["date"])
+        journal.record_trade(bot, signal, "signal", reason)
+        bot.signal_failures.pop(signal_key(item), None)
+        if signal.message_id:
+            bot.recent_message_ids.append(signal.message_id)
+        mark_email(bot, item["num"], True, f"{reason} signal", item["session"])
+    if final is None:
+        return
+
+    signal = final["signal"]
+    try:
+        # Execute the trade
+        log_message(bot.name, "🚀 Executing {action} order for {symbol}...",
+                    action=signal.action.upper(), symbol=bot.symbol)
+        signal.trace["queued"] = time.time()
+        result = await bot_manager.place_trade(bot, signal)
+        status = result.get("status")
+        if status in ("success", "info", "rejected") and signal.message_id:
+            bot.recent_message_ids.append(signal.message_id)
+        if status != "error":
+            bot.signal_failures.pop(signal_key(final), None)
+
+        if status == "success":
+            log_message(bot.name, TRADE_EXECUTED_TEMPLATE, code="trade_executed",
+                        action=signal.action.upper(), exchange=bot.exchange, symbol=bot.symbol,
+                        quantity=bot.quantity, date=final["date"], subject=final["subject"], body=final["body"])
+            # Mark email as seen since we found and executed a valid signal
+            mark_email(bot, final["num"], True, "trade executed", final["session"])
+        elif status == "info":
+            log_message(bot.name, "ℹ️ {detail}", code="trade_skipped", detail=result.get("message"))
+            mark_email(bot, final["num"], True, "nothing to trade", final["session"])
+        elif status == "rejected":
+            # Retrying can't help (trade limit, configuration): consume the email
+            log_message(bot.name, TRADE_REJECTED_TEMPLATE, level=logging.WARNING, code="trade_rejected",
+                        error=result.get("message"), date=final["date"], subject=final["subject"], body=final["body"])
+            mark_email(bot, final["num"], True, "trade rejected", final["session"])
+        else:
+            trade_failed(bot, final, result.get("message"), result.get("sent", False))
+    except Exception as e:
+        trade_failed(bot, final, str(e), False)
+
+
+def signal_key(item: dict) -> str:
+    return item["signal"].message_id or f"#{item['num'].decode()}"
+
+
+def trade_failed(bot, item: dict, error: str, sent: bool):
+    """Leave a failed signal's email unread for the next pass, unless retrying could trade it twice
+    (an order reached the exchange) or it already failed SIGNAL_MAX_RETRIES times."""
+    key = signal_key(item)
+    attempts = bot.signal_failures.get(key, 0) + 1
+    if sent or attempts > SIGNAL_MAX_RETRIES:
+        bot.signal_failures.pop(key, None)
+        if item["signal"].message_id:
+            bot.recent_message_ids.append(item["signal"].message_id)
+        log_message(bot.name, TRADE_FAILED_TEMPLATE, level=logging.ERROR, code="trade_failed",
+                    error=error, date=item["date"], subject=item["subject"], body=item["body"])
+        mark_email(bot, item["num"], True, "trade failed, not retried", item["session"])
+        return
+    bot.signal_failures[key] = attempts
+    log_message(bot.name, "⚠️ Trade failed, retrying on the next pass ({attempt}/{retries}): {error}",
+                level=logging.WARNING, code="trade_retry", attempt=attempts, retries=SIGNAL_MAX_RETRIES, error=error)
+    mark_email(bot, item["num"], False, "trade failed", item["session"])
 
 
 async def keep_imap_alive():
-    """Keep each bot's IMAP session alive."""
+    """Keep idle IMAP sessions alive.
+
+    A poll keeps a session alive too, so only bots not polled within IMAP_KEEPALIVE_INTERVAL get
+    a NOOP. This is housekeeping: it waits for pending orders and queues behind mailbox checks.
+    """
+    from backend import fair_queue, polling
+
     while True:
         try:
-            for bot_name, bot in active_bots.items():
-                if bot.imap_session:
+            await asyncio.sleep(IMAP_KEEPALIVE_INTERVAL)
+            for bot_name, bot in list(active_bots.items()):
+                if not bot.imap_session or time.time() - polling.last_polled_at(bot_name) < IMAP_KEEPALIVE_INTERVAL:
+                    continue
+                await fair_queue.order_queue.wait_idle(IMAP_KEEPALIVE_INTERVAL)
+                async with fair_queue.mailbox_slot(bot, fair_queue.HOUSEKEEPING):
+                    if not bot.imap_session:
+                        continue
                     try:
                         status, response = bot.imap_session.noop()
                         if status == "OK":
-                            log_message(bot_name, "✅ IMAP connection is healthy")
+                            log_message(bot_name, "✅ IMAP connection is healthy", code="imap_healthy")
                         else:
-                            log_message(bot_name, "⚠️ IMAP connection appears stale, reconnecting...")
+                            log_message(bot_name, "⚠️ IMAP connection appears stale, reconnecting...", level=logging.WARNING, code="imap_stale")
                             # Close old connection if possible
                             try:
                                 bot.imap_session.close()
@@ -504,12 +721,9 @@ async def keep_imap_alive():
                             # Reconnect
                             connect_imap(bot)
                     except Exception as e:
-                        log_message(bot_name, f"⚠️ Error in IMAP keep-alive: {str(e)}")
+                        log_message(bot_name, "⚠️ Error in IMAP keep-alive: {error}", level=logging.WARNING, code="keepalive_failed", error=str(e))
                         # Reconnect on error
                         connect_imap(bot)
-
-            # Check every 5 minutes
-            await asyncio.sleep(30)
         except Exception as e:
             logging.error(f"Error in keep_imap_alive: {str(e)}")
             await asyncio.sleep(60)  # Shorter sleep on error
@@ -539,95 +753,130 @@ def reconnect_bot(bot):
         return False
 
 
+def subscribe_shared_events():
+    from backend import bot_cache, engine, entitlements, state
+
+    state.store.subscribe("log", log_store.apply_remote_entry)
+    state.store.subscribe("log_forward", log_store.apply_forwarded_line)
+    state.store.subscribe("bot_state", bot_cache.apply_remote_state)
+    state.store.subscribe("bot_listing", bot_cache.apply_remote_invalidation)
+    state.store.subscribe("bot_control", engine.handle_bot_control)
+    state.store.subscribe("engine_status", engine.handle_status_request)
+    state.store.subscribe("bot_latency", engine.handle_latency_request)
+    state.store.subscribe("entitlement", entitlements.apply_remote_invalidation)
+    state.store.subscribe("metrics", metrics.apply_remote_snapshot)
+
+
+async def start_background_tasks(run_engine: bool):
+    """Start the shared background tasks, plus the bot engine if this process may run it."""
+    from backend import diagnostics, engine, journal, mailer, quotas, state
+
+    logging.info("🚀 Starting background tasks...")
+    asyncio.create_task(diagnostics.run_loop_watchdog())
+    log_store.bind_loop(asyncio.get_running_loop())
+    subscribe_shared_events()
+    await state.store.start(engine=run_engine)
+    asyncio.create_task(log_store.run_log_persistence())
+    asyncio.create_task(quotas.sync_trade_counters())
+    asyncio.create_task(journal.run_journal_writer())
+    asyncio.create_task(mailer.run_mail_sender())
+    if run_engine:
+        asyncio.create_task(engine.run_engine())
+
+
 @router.on_event("startup")
 async def start_tasks():
     """Initialize tasks that run on application startup."""
-    logging.info("🚀 Starting background tasks...")
-    asyncio.create_task(keep_imap_alive())
-    asyncio.create_task(check_email_for_signals())
-    asyncio.create_task(startup_check_emails())
+    from backend import engine, state
 
+    if engine.ENGINE_MODE == "pool":
+        if not state.store.shared:
+            from backend import engine_pool
+
+            engine_pool.install()
+            await start_background_tasks(run_engine=False)
+            await engine_pool.start_pool()
+            return
+        logging.error(
+            "❌ ENGINE_MODE=pool needs STATE_BACKEND=memory (with postgres, run one `python -m backend.engine` "
+            "per core), running the engine in the web process"
+        )
+
+    embedded = engine.ENGINE_MODE != "external"
+    if not embedded and not state.store.shared:
+        logging.error("❌ ENGINE_MODE=external needs STATE_BACKEND=postgres, running the engine in the web process")
+        embedded = True
+    await start_background_tasks(run_engine=embedded)
 
-# Modify the startup_check_emails function to load the paused state
-async def startup_check_emails():
-    """Initial check for all active bots on startup."""
-    logging.info("📨 Performing initial email check for all bots...")
 
-    # Retrieve bots from database
+@router.on_event("shutdown")
+async def stop_tasks():
+    """Hand over engine leases, then flush buffered journal entries and quota counters before exiting."""
+    from backend import engine, journal, mailer, quotas, state
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        await engine.stop_engine()
+    except Exception as e:
+        logging.error(f"Error releasing engine leases on shutdown: {str(e)}")
 
-        # Add the paused column to the bots table if it doesn't exist
+    for flush in (journal.flush_journal, quotas.flush_increments, log_store.flush_pending_lines, state.store.stop):
         try:
-            cursor.execute("ALTER TABLE bots ADD COLUMN IF NOT EXISTS paused BOOLEAN DEFAULT FALSE")
-            conn.commit()
-            logging.info("✅ Added 'paused' column to bots table if it didn't exist")
+            await flush()
         except Exception as e:
-            logging.error(f"Error adding paused column: {str(e)}")
-            conn.rollback()
+            logging.error(f"Error flushing on shutdown: {str(e)}")
+    await asyncio.to_thread(mailer.smtp_pool.close)
+
 
-        cursor.execute("SELECT * FROM bots")
-        bots_data = cursor.fetchall()
+def ensure_paused_column():
+    """Add the paused column to the bots table if it doesn't exist."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("ALTER TABLE bots ADD COLUMN IF NOT EXISTS paused BOOLEAN DEFAULT FALSE")
+        conn.commit()
+        logging.info("✅ Added 'paused' column to bots table if it didn't exist")
+    except Exception as e:
+        logging.error(f"Error adding paused column: {str(e)}")
+        conn.rollback()
+    finally:
         conn.close()
 
-        # Initialize and start each bot
-        for bot_data in bots_data:
-            bot_name = bot_data["bot_name"]
-
-            # Create bot instance if not already active
-            if bot_name not in active_bots:
-                # Check if the paused column exists in the result
-                paused_state = bot_data.get("paused", False)
-
-                bot = Bot(
-                    name=bot_data["bot_name"],
-                    exchange=bot_data["exchange"],
-                    symbol=bot_data["symbol"],
-                    quantity=bot_data["quantity"],
-                    email_address=bot_data["email"],
-                    email_password=bot_data["email_password"],
-                    imap_server=bot_data["imap_server"],
-                    email_subject=bot_data["email_subject"],
-                    api_key=bot_data["api_key"],
-                    api_secret=bot_data["api_secret"],
-                    account_id=bot_data["account_id"],
-                    paused=paused_state  # Set the paused state from the database
-                )
 
-                # Connect to IMAP
-                if connect_imap(bot):
-                    status = "paused" if paused_state else "active"
-                    log_message(bot_name, f"✅ Bot loaded from database ({status}) and connected to IMAP")
-                    active_bots[bot_name] = bot
-                else:
-                    log_message(bot_name, "⚠️ Bot loaded from database but failed to connect to IMAP")
+async def startup_check_emails(only=None):
+    """Initial check for all active bots (or only the named ones) on startup."""
+    from backend import bootstrap
 
+    logging.info("📨 Performing initial email check for all bots...")
+
+    try:
+        await asyncio.to_thread(ensure_paused_column)
+
+        # Stream bots from the database and connect mailboxes in parallel
+        await bootstrap.bootstrap_bots(only)
         logging.info(f"✅ Initialized {len(active_bots)} bots from database")
     except Exception as e:
         logging.error(f"Error initializing bots on startup: {str(e)}")
 
 
-async def get_current_user(authorization: str = Header(None)):
-    """Extract user from the Authorization header."""
-    if not authorization or not authorization.startswith("Bearer "):
-        logging.warning("❌ No Bearer token found in header!")
-        raise HTTPException(status_code=401, detail="Bearer token missing")
+@router.get("/bootstrap-status")
+async def bootstrap_status():
+    """Report startup progress and time until every bot was live (per engine node when sharded)."""
+    from backend import engine, state
 
-    token = authorization.split("Bearer ")[1]
-    logging.info(f"✅ Token extracted: {token[:10]}...")
+    status = await engine.get_status()
+    if not status["running"]:
+        raise HTTPException(status_code=503, detail="Bot engine is not running")
+    if not state.store.shared:
+        return status["nodes"][0]["bootstrap"]
+    return {"nodes": {node.get("node", node["worker"]): node["bootstrap"] for node in status["nodes"]}}
 
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        if not email:
-            logging.warning("❌ 'sub' (email) missing from token!")
-            raise HTTPException(status_code=401, detail="Invalid token")
-        logging.info(f"✅ Successfully authenticated user: {email}")
-        return {"email": email}
-    except JWTError as e:
-        logging.error(f"❌ JWT Error: {str(e)}")
-        raise HTTPException(status_code=401, detail="Could not validate credentials")
+
+@router.get("/engine-status")
+async def engine_status():
+    """Where the bot engine runs and how many of its bots are connected."""
+    from backend import engine
+
+    return await engine.get_status()
 
 
 @router.post("/create-bot")
@@ -636,39 +885,26 @@ async def create_bot(
     current_user: dict = Depends(get_current_user)
 ):
     """Create a trading bot and save to the database with user email."""
+    from backend import bot_cache, engine, entitlements, state
+
+    conn = None
     try:
         user_email = current_user["email"]
 
-        # Check subscription status
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Check if subscription is active
-        cursor.execute("SELECT subscription_status FROM users WHERE email = %s", (user_email,))
-        subscription_result = cursor.fetchone()
-        if not subscription_result or not subscription_result[0]:
-            conn.close()
+        # Check subscription status from the in-memory entitlement cache
+        entitlement = await entitlements.get_entitlement(user_email)
+        if not entitlement.active:
             return JSONResponse(
                 status_code=403,
                 content={"detail": "Please activate a subscription plan first"}
             )
 
-        # Count existing bots for this user
-        cursor.execute("SELECT COUNT(*) FROM bots WHERE user_email = %s", (user_email,))
-        bot_count = cursor.fetchone()[0]
-
-        # Get user's current plan (assuming free if not specified)
-        cursor.execute("SELECT subscription_plan FROM users WHERE email = %s", (user_email,))
-        plan_result = cursor.fetchone()
-        current_plan = plan_result[0] if plan_result and plan_result[0] else "free"
-
-        # Check bot limit
-        from backend.payment import SUBSCRIPTION_PLANS
-        if bot_count >= SUBSCRIPTION_PLANS[current_plan]["bot_limit"]:
-            conn.close()
+        # Check bot limit against the cached bot listing
+        bot_count = len(await bot_cache.load_user_bots(user_email))
+        if bot_count >= entitlement.bot_limit:
             return JSONResponse(
                 status_code=403,
-                content={"detail": f"Bot limit reached for your {current_plan} plan. Please upgrade to create more bots."}
+                content={"detail": f"Bot limit reached for your {entitlement.plan_id} plan. Please upgrade to create more bots."}
             )
         user_email = current_user["email"]
         logging.info(f"✅ Creating bot for authenticated user: {user_email}")
@@ -717,7 +953,8 @@ async def create_bot(
             server=config.server,
             slopping=config.slopping,
             deviation=config.deviation,
-            magic_number=config.magicNumber
+            magic_number=config.magicNumber,
+            user_email=user_email
         )
 
         # Test IMAP connection
@@ -751,8 +988,13 @@ async def create_bot(
 
         log_message(temp_bot.name, f"✅ Bot '{temp_bot.name}' created by {user_email} and saved to database!")
 
-        # Store the bot in active_bots
-        active_bots[temp_bot.name] = temp_bot
+        # Keep the tested session when running single-process, otherwise hand the bot to its engine node
+        if not state.store.shared:
+            active_bots[temp_bot.name] = temp_bot
+        else:
+            await asyncio.to_thread(close_imap_session, temp_bot)
+            await engine.dispatch_bot_change(temp_bot.name)
+        bot_cache.invalidate_user(user_email)
 
         # Instead of calling monitor_emails, use the existing check_email_for_signals function
         # This function is already running in the background
@@ -786,12 +1028,44 @@ async def create_bot(
         )
 
 
+@router.delete("/delete-bot/{bot_name}")
+async def delete_bot(
+    bot_name: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Delete a bot and stop its watcher in the engine."""
+    from backend import bot_cache, engine
+
+    user_email = current_user["email"]
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM bots WHERE bot_name = %s AND user_email = %s RETURNING bot_name",
+            (bot_name, user_email)
+        )
+        deleted = cursor.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Bot '{bot_name}' not found or doesn't belong to you")
+    bot_cache.invalidate_user(user_email)
+    await engine.dispatch_bot_change(bot_name)
+    # Also drops the copy this process kept of a log numbered by another engine node
+    log_store.remove_bot_log(bot_name)
+    return {"message": f"Bot '{bot_name}' has been deleted"}
+
+
 # Add a new endpoint to toggle bot pause state
 @router.post("/toggle-bot/{bot_name}")
 async def toggle_bot(
     bot_name: str,
     current_user: dict = Depends(get_current_user)
 ):
+    from backend import engine
+
     try:
         user_email = current_user["email"]
 
@@ -811,65 +1085,17 @@ async def toggle_bot(
                 content={"detail": f"Bot '{bot_name}' not found or doesn't belong to you"}
             )
 
-        # Check if the bot is in active_bots
-        if bot_name not in active_bots:
-            # Bot exists in DB but not in active_bots, let's add it
-            bot = Bot(
-                name=bot_data["bot_name"],
-                exchange=bot_data["exchange"],
-                symbol=bot_data["symbol"],
-                quantity=bot_data["quantity"],
-                email_address=bot_data["email"],
-                email_password=bot_data["email_password"],
-                imap_server=bot_data["imap_server"],
-                email_subject=bot_data["email_subject"],
-                api_key=bot_data["api_key"],
-                api_secret=bot_data["api_secret"],
-                account_id=bot_data["account_id"],
-                paused=False  # Default to not paused
-            )
-
-            # Connect to IMAP
-            connect_imap(bot)
-            active_bots[bot_name] = bot
-            log_message(bot_name, f"Bot activated by user {user_email}")
-
-            conn.close()
-            return {"message": f"Bot '{bot_name}' has been activated", "paused": False}
-
-        # Get the new paused state (toggle current state)
-        new_paused_state = not active_bots[bot_name].paused
-
-        # Update the paused state immediately
-        active_bots[bot_name].paused = new_paused_state
-
-        # If pausing, immediately close IMAP connection
-        if new_paused_state:
-            if active_bots[bot_name].imap_session:
-                try:
-                    log_message(bot_name, "Forcefully closing IMAP session due to pause")
-                    active_bots[bot_name].imap_session.close()
-                    active_bots[bot_name].imap_session.logout()
-                except Exception as e:
-                    log_message(bot_name, f"Error during forced IMAP logout: {str(e)}")
-                finally:
-                    # Always set to None even if close/logout failed
-                    active_bots[bot_name].imap_session = None
-                    log_message(bot_name, "IMAP session set to None - bot is now fully paused")
-        # If resuming, re-establish the connection
-        elif not active_bots[bot_name].imap_session:
-            if connect_imap(active_bots[bot_name]):
-                log_message(bot_name, "IMAP session re-established after resume")
-            else:
-                log_message(bot_name, "Failed to re-establish IMAP session after resume")
-
-        # Update the database
+        # The stored flag is what the engine runs the bot by: a bot that is down while unpaused
+        # (engine in another process, mailbox login failing) still gets paused, and resuming
+        # a paused bot makes the engine (re)start it
+        new_paused_state = not bot_data["paused"]
         cursor.execute(
-            "UPDATE bots SET paused = %s WHERE bot_name = %s",
-            (new_paused_state, bot_name)
+            "UPDATE bots SET paused = %s WHERE bot_name = %s AND user_email = %s",
+            (new_paused_state, bot_name, user_email)
         )
         conn.commit()
         conn.close()
+        await engine.dispatch_bot_change(bot_name)
 
         state = "paused" if new_paused_state else "resumed"
         return {
@@ -883,40 +1109,168 @@ async def toggle_bot(
         raise HTTPException(status_code=500, detail=f"Failed to toggle bot: {str(e)}")
 
 
-@router.websocket("/ws/logs/{bot_name}")
-async def websocket_logs(websocket: WebSocket, bot_name: str):
-    """WebSocket to stream logs for a specific bot."""
+def fetch_user_bot(bot_name: str, user_email: str):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute("SELECT * FROM bots WHERE bot_name = %s AND user_email = %s", (bot_name, user_email))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def update_bot_columns(bot_name: str, user_email: str, columns: dict):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        assignments = ", ".join(f"{column} = %s" for column in columns)
+        cursor.execute(
+            f"UPDATE bots SET {assignments} WHERE bot_name = %s AND user_email = %s",
+            (*columns.values(), bot_name, user_email)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@router.patch("/bots/{bot_name}")
+async def update_bot(
+    bot_name: str,
+    update: BotUpdateRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Change a bot's settings in place; only a changed mailbox gets a new IMAP session."""
+    from backend import bootstrap, bot_cache, engine
+
+    user_email = current_user["email"]
+    bot_data = await asyncio.to_thread(fetch_user_bot, bot_name, user_email)
+    if not bot_data:
+        raise HTTPException(status_code=404, detail=f"Bot '{bot_name}' not found or doesn't belong to you")
+
+    columns = {
+        BOT_UPDATE_COLUMNS[name]: value
+        for name, value in update.dict(exclude_unset=True).items()
+        if value is not None and bot_data[BOT_UPDATE_COLUMNS[name]] != value
+    }
+    if not columns:
+        return {"message": f"Bot '{bot_name}' is unchanged", "updated": []}
+
+    if {"exchange", "symbol"} & set(columns):
+        position = bot_cache.runtime_fields(bot_name, bot_data["paused"])["position"]
+        if position != "neutral":
+            raise HTTPException(
+                status_code=409,
+                detail=f"Close the open {position} position before changing the exchange or symbol"
+            )
+
+    if {"email", "email_password", "imap_server"} & set(columns):
+        # Test the new mailbox before the running bot switches to it
+        probe = bootstrap.bot_from_row({**bot_data, **columns})
+        if not await asyncio.to_thread(connect_imap, probe):
+            raise HTTPException(status_code=400, detail="Failed to connect to the IMAP server.")
+        await asyncio.to_thread(close_imap_session, probe)
+
+    await asyncio.to_thread(update_bot_columns, bot_name, user_email, columns)
+    bot_cache.invalidate_user(user_email)
+    await engine.dispatch_bot_change(bot_name)
+    return {"message": f"Bot '{bot_name}' has been updated", "updated": sorted(columns)}
+
+
+async def authenticate_websocket(websocket: WebSocket) -> Optional[tuple]:
+    """Accept a websocket and return the user whose JWT its first message carries ({"token": ...}),
+    along with that message.
+
+    Browsers can't set headers on websockets and query strings end up in access logs, so the
+    token is sent over the connection. Closes with code 4401 and returns None without a valid token.
+    """
     await websocket.accept()
-    last_sent_message = ""  # Keep track of the last sent message
+    try:
+        first = await asyncio.wait_for(websocket.receive_json(), WEBSOCKET_AUTH_TIMEOUT)
+        return decode_token(str(first.get("token") or "")), first
+    except WebSocketDisconnect:
+        return None
+    except (asyncio.TimeoutError, HTTPException, ValueError, AttributeError):
+        await websocket.close(code=4401)
+        return None
 
+
+@router.websocket("/ws/logs/{bot_name}")
+async def websocket_logs(websocket: WebSocket, bot_name: str, since: int = 0, format: str = "text"):
+    """WebSocket to stream logs for one of the user's bots.
+
+    The first message sent must be {"token": ...}; see authenticate_websocket. Bots that
+    don't exist or belong to someone else are closed with code 4404.
+    Each connection keeps its own cursor into the bot's log buffer, so any number of
+    tabs can follow the same bot. Pass `since` to resume after the last sequence number
+    received; with `format=json` every line carries its `seq` and the server first
+    sends a handshake describing where the stream resumes.
+    """
+    authenticated = await authenticate_websocket(websocket)
+    if authenticated is None:
+        return
+    user, _ = authenticated
     try:
-        while True:
-            if bot_name in bot_logs and bot_logs[bot_name]:
-                message = bot_logs[bot_name][0]  # Peek at the next message
+        bot_row = await asyncio.to_thread(fetch_user_bot, bot_name, user["email"])
+    except Exception as e:
+        logging.error(f"Error loading bot {bot_name} for its log stream: {str(e)}")
+        await websocket.close(code=1011)
+        return
+    if bot_row is None:
+        await websocket.close(code=4404)
+        return
 
-                # Check if this message is about the bot being paused and is the same as the last message
-                is_paused_message = "⏸️ Bot is paused" in message
+    last_seq = since  # Read cursor into the bot's log ring buffer
+    use_json = format == "json"
 
-                # Only send message if it's not a repeated pause message
-                if not (is_paused_message and "Bot is paused" in last_sent_message):
-                    # Remove from the queue and send
-                    bot_logs[bot_name].pop(0)
-                    try:
-                        await websocket.send_text(message)
-                        last_sent_message = message  # Update the last sent message
-                        logging.info(f"Sent log: {message}")
-                    except RuntimeError:
-                        logging.warning("WebSocket closed before sending message.")
-                        break
+    # Notice disconnects while we are parked waiting for new lines
+    async def wait_for_disconnect():
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    disconnected = asyncio.create_task(wait_for_disconnect())
+    log_store.subscribe(bot_name)
+
+    try:
+        if use_json:
+            oldest = log_store.first_seq(bot_name)
+            await websocket.send_json({
+                "type": "hello",
+                "resume_from": max(since, oldest - 1),
+                "gap": since > 0 and since < oldest - 1,
+            })
+
+        while True:
+            next_lines = asyncio.create_task(log_store.wait_for_logs(bot_name, last_seq))
+            await asyncio.wait({next_lines, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_lines.cancel()
+                break
+
+            lines = next_lines.result()
+            if lines is None:
+                # The bot was deleted or moved to another engine
+                break
+            # Repeated events (e.g. "paused") are already collapsed at the source
+            for entry in lines:
+                last_seq = entry[0]
+                message = log_store.format_entry(entry)
+                if use_json:
+                    await websocket.send_json({"seq": last_seq, "message": message})
                 else:
-                    # Skip repeated pause message but still remove it from the queue
-                    bot_logs[bot_name].pop(0)
-            await asyncio.sleep(0.5)
+                    await websocket.send_text(message)
     except WebSocketDisconnect:
         logging.warning(f"WebSocket disconnected for bot {bot_name}")
+    except RuntimeError:
+        logging.warning("WebSocket closed before sending message.")
     except Exception as e:
         logging.error(f"WebSocket Error: {e}")
     finally:
+        log_store.unsubscribe(bot_name)
+        disconnected.cancel()
         try:
             await websocket.close()
         except Exception:
@@ -924,54 +1278,138 @@ async def websocket_logs(websocket: WebSocket, bot_name: str):
         logging.info(f"WebSocket connection closed for bot {bot_name}")
 
 
-@router.get("/get-bots")
-async def get_bots(current_user: dict = Depends(get_current_user)):
-    """Retrieve all bots from the database for the authenticated user with all columns."""
+@router.websocket("/ws/user")
+async def websocket_user(websocket: WebSocket, interval: Optional[int] = None):
+    """Single authenticated stream multiplexing logs, position, pause state and health of all the user's bots.
+
+    The first message sent must be {"token": ..., "cursors": {...}}; see authenticate_websocket.
+    `cursors` (bot name to sequence number) resumes log streams after the last received
+    sequence numbers, and `interval` overrides the coalescing window in milliseconds.
+    """
+    from backend import user_stream
+
+    authenticated = await authenticate_websocket(websocket)
+    if authenticated is None:
+        return
+    user, hello = authenticated
+
+    resume = hello.get("cursors")
+    if not isinstance(resume, dict):
+        resume = {}
+    resume = {
+        bot_name: seq for bot_name, seq in resume.items()
+        if isinstance(seq, int) and not isinstance(seq, bool) and seq >= 0
+    }
+
     try:
-        user_email = current_user["email"]
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        await user_stream.serve_user_stream(
+            websocket, user["email"],
+            interval if interval is not None else user_stream.USER_STREAM_COALESCE_MS,
+            resume
+        )
+    except (WebSocketDisconnect, RuntimeError):
+        logging.warning(f"User stream disconnected for {user['email']}")
+    except Exception as e:
+        logging.error(f"User stream error: {e}")
+    finally:
+        try:
+            await websocket.close()
+        except Exception:
+            pass
 
-        # Select all columns from the bots table for the authenticated user
-        cursor.execute("SELECT * FROM bots WHERE user_email = %s", (user_email,))
-        bots = cursor.fetchall()
-        conn.close()
 
-        # Convert to list of dictionaries
-        bots_list = []
-        for bot in bots:
-            bot_dict = dict(bot)
-            # Mask sensitive information
-            if "email_password" in bot_dict:
-                bot_dict["email_password"] = "********"
-            if "api_key" in bot_dict:
-                bot_dict["api_key"] = "********"
-            if "api_secret" in bot_dict:
-                bot_dict["api_secret"] = "********"
-            if "password" in bot_dict:
-                bot_dict["password"] = "********"
-
-            # Add status information if the bot is active
-            if bot_dict["bot_name"] in active_bots:
-                active_bot = active_bots[bot_dict["bot_name"]]
-                bot_dict["status"] = "active" if (
-                            active_bot.monitoring_task and not active_bot.monitoring_task.done()) else "stopped"
-                bot_dict["position"] = active_bot.position
-                bot_dict["paused"] = active_bot.paused  # Include the paused state
-            else:
-                bot_dict["status"] = "stopped"
-                bot_dict["position"] = "neutral"
-                bot_dict["paused"] = bot_dict.get("paused", False)  # Default to False if not present
+@router.get("/get-bots")
+async def get_bots(
+    request: Request,
+    since: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Retrieve the authenticated user's bots from the per-user summary cache.
+
+    Supports `If-None-Match` against the returned `ETag`, and a `since` cursor
+    that limits the response to bots changed after that cursor.
+    """
+    from backend import bot_cache
 
-            bots_list.append(bot_dict)
+    try:
+        entries = await bot_cache.load_user_bots(current_user["email"])
+        etag = bot_cache.make_etag(entries)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
 
-        return {"bots": bots_list}
+        return JSONResponse(content=bot_cache.get_listing(entries, since), headers={"ETag": etag})
     except Exception as e:
-        if 'conn' in locals() and conn:
-            conn.close()
         raise HTTPException(status_code=500, detail=f"Failed to retrieve bots: {str(e)}")
 
 
+@router.get("/bot-latency/{bot_name}")
+async def bot_latency(bot_name: str, current_user: dict = Depends(get_current_user)):
+    """Rolling latency percentiles per pipeline segment, from email Date header to exchange ack.
+
+    Traces live on the engine node running the bot, which may be another process.
+    """
+    from backend import engine
+
+    latency = await engine.get_latency(bot_name)
+    if not latency or latency["user_email"] != current_user["email"]:
+        raise HTTPException(status_code=404, detail=f"Bot '{bot_name}' not found or doesn't belong to you")
+    return latency["latency"]
+
+
+@router.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of the process metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def require_admin(current_user: dict = Depends(get_current_user)):
+    from backend import diagnostics
+
+    if not diagnostics.is_admin(current_user["email"]):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+
+@router.get("/admin/loop-stalls")
+async def loop_stalls(current_user: dict = Depends(require_admin)):
+    """Most recent event-loop stalls with the stack that was blocking."""
+    from backend import diagnostics
+
+    return {"threshold_ms": diagnostics.LOOP_STALL_THRESHOLD_MS, "stalls": diagnostics.get_recent_stalls()}
+
+
+@router.get("/admin/mail/{mail_id}")
+async def mail_status(mail_id: int, current_user: dict = Depends(require_admin)):
+    """Delivery status of a queued outbound email."""
+    from backend import mailer
+
+    status = await asyncio.to_thread(mailer.get_mail_status, mail_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Mail not found")
+    return status
+
+
+@router.get("/admin/profile")
+async def profile(
+    seconds: float = 10,
+    interval_ms: int = 5,
+    threads: str = "loop",
+    current_user: dict = Depends(require_admin)
+):
+    """Sample the live process for a bounded time and download collapsed stacks for a flame graph."""
+    from backend import diagnostics
+
+    if seconds <= 0 or seconds > diagnostics.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {diagnostics.PROFILE_MAX_SECONDS}]")
+    result = await asyncio.to_thread(diagnostics.sample_profile, seconds, interval_ms, threads == "all")
+    if result is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(
+        result,
+        headers={"Content-Disposition": f'attachment; filename="profile-{int(time.time())}.folded"'}
+    )
+
+
 @router.get("/status")
 async def status():
     return {"message": "Trading Bot is running with database integration!"}
\ No newline at end of file
@@ -0,0 +1,259 @@
+import functools
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Every metric registers itself here in creation order
+REGISTRY = []
+
+# Latest metric snapshots pushed by engine pool workers: shard -> {metric name: exported values}
+remote_snapshots = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(labelnames, labels, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter keyed by label values."""
+
+    __slots__ = ("name", "help", "labelnames", "values")
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def export(self) -> dict:
+        return dict(self.values)
+
+    def merge(self, values: dict, other: dict):
+        for labels, value in other.items():
+            values[labels] = values.get(labels, 0) + value
+
+    def samples(self, values=None):
+        for labels, value in (self.values if values is None else values).items():
+            yield self.name, _label_text(self.labelnames, labels), value
+
+
+class Gauge:
+    """Gauge whose value is set directly or computed by a callback at scrape time.
+
+    A callback returns either a number or a {label_values_tuple: number} dict.
+    """
+
+    __slots__ = ("name", "help", "labelnames", "values", "callback")
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.callback = callback
+        REGISTRY.append(self)
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def export(self) -> dict:
+        if self.callback is None:
+            return dict(self.values)
+        result = self.callback()
+        return dict(result) if isinstance(result, dict) else {(): result}
+
+    # Gauges of several processes are summed (bot counts, subscribers...)
+    merge = Counter.merge
+
+    def samples(self, values=None):
+        for labels, value in (self.export() if values is None else values).items():
+            yield self.name, _label_text(self.labelnames, labels), value
+
+
+class Histogram:
+    """Fixed-bucket histogram; an observation is a bisect plus two additions."""
+
+    __slots__ = ("name", "help", "labelnames", "buckets", "series")
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            # per-bucket counts (last slot is +Inf), then sum
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def export(self) -> dict:
+        return {labels: [list(counts), total] for labels, (counts, total) in self.series.items()}
+
+    def merge(self, values: dict, other: dict):
+        for labels, (counts, total) in other.items():
+            current = values.get(labels)
+            if current is None or len(current[0]) != len(counts):
+                values[labels] = [list(counts), total]
+            else:
+                values[labels] = [[a + b for a, b in zip(current[0], counts)], current[1] + total]
+
+    def samples(self, values=None):
+        for labels, (counts, total) in (self.series if values is None else values).items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", _label_text(self.labelnames, labels, (("le", le),)), cumulative
+            yield f"{self.name}_sum", _label_text(self.labelnames, labels), total
+            yield f"{self.name}_count", _label_text(self.labelnames, labels), cumulative
+
+
+def snapshot() -> dict:
+    """Current values of every metric, as pushed by an engine pool worker to the web process."""
+    return {metric.name: metric.export() for metric in REGISTRY}
+
+
+def apply_remote_snapshot(event: dict):
+    remote_snapshots[event["w"]] = event["m"]
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text exposition format.
+
+    Snapshots of engine pool workers are added to this process's own values.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        values = None
+        if remote_snapshots:
+            values = metric.export()
+            for remote in list(remote_snapshots.values()):
+                metric.merge(values, remote.get(metric.name, {}))
+        for name, labels, value in metric.samples(values):
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# IMAP ingestion
+imap_connect_seconds = Histogram("imap_connect_seconds", "IMAP connect and login duration", ("outcome",))
+imap_search_seconds = Histogram("imap_search_seconds", "IMAP UNSEEN search duration")
+imap_fetch_seconds = Histogram("imap_fetch_seconds", "IMAP message fetch duration")
+imap_polls_total = Counter("imap_polls_total", "Mailbox polls started by the adaptive poll schedule")
+imap_polls_baseline_total = Counter(
+    "imap_polls_baseline_total", "Mailbox polls a fixed POLL_MIN_INTERVAL schedule would have started"
+)
+emails_scanned_total = Counter("emails_scanned_total", "Emails fetched and inspected")
+emails_matched_total = Counter("emails_matched_total", "Emails whose subject matched a bot")
+signals_detected_total = Counter("signals_detected_total", "Trade signals detected in emails", ("action",))
+signals_coalesced_total = Counter(
+    "signals_coalesced_total", "Signals dropped by coalescing instead of being traded", ("reason",)
+)
+email_parse_seconds = Histogram(
+    "email_parse_seconds", "Email MIME parsing and body extraction time",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+
+# Execution
+place_trade_seconds = Histogram(
+    "place_trade_seconds", "place_trade latency per exchange and outcome", ("exchange", "outcome")
+)
+exchange_request_seconds = Histogram(
+    "exchange_request_seconds", "Exchange HTTP order request latency", ("exchange", "outcome")
+)
+
+# Event loop
+event_loop_lag_seconds = Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a scheduled probe tick",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+event_loop_stalls_total = Counter("event_loop_stalls_total", "Event loop stalls above the watchdog threshold")
+
+# Outbound mail
+mail_messages_total = Counter("mail_messages_total", "Outbound mail queue events", ("outcome",))
+smtp_connect_seconds = Histogram("smtp_connect_seconds", "SMTP connect, STARTTLS and login duration")
+
+# Database
+db_query_seconds = Histogram("db_query_seconds", "Database query duration", ("query",))
+
+# Engine scheduling
+fair_queue_wait_seconds = Histogram(
+    "fair_queue_wait_seconds", "Time engine work waited for a fair-queue slot", ("queue", "class")
+)
+
+
+def instrument_exchange(exchange: str):
+    """Decorate an exchange adapter's async order call to record its latency and outcome."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "exception"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "error" if isinstance(result, dict) and result.get("status") == "error" else "success"
+                return result
+            finally:
+                exchange_request_seconds.observe(time.perf_counter() - start, exchange, outcome)
+        return wrapper
+    return decorator
+
+
+# Gauges computed at scrape time, so they cost nothing on the hot path
+def _bot_states() -> dict:
+    from backend.main2 import active_bots
+
+    counts = {("active",): 0, ("paused",): 0, ("erroring",): 0}
+    for bot in list(active_bots.values()):
+        if bot.paused:
+            counts[("paused",)] += 1
+        elif bot.imap_session is None or bot.retry_attempts:
+            counts[("erroring",)] += 1
+        else:
+            counts[("active",)] += 1
+    return counts
+
+
+def _websocket_subscribers() -> dict:
+    from backend import log_store, user_stream
+
+    return {
+        ("bot_logs",): sum(bot_log.subscribers for bot_log in list(log_store.log_store.values())),
+        ("user_stream",): sum(len(events) for events in list(user_stream.user_listeners.values())),
+    }
+
+
+bots_gauge = Gauge("bots", "Bots by runtime state", ("state",), callback=_bot_states)
+websocket_subscribers = Gauge(
+    "websocket_subscribers", "Open websocket log subscribers", ("stream",), callback=_websocket_subscribers
+)
@@ -0,0 +1,188 @@
+"""Adaptive mailbox poll schedule.
+
+Without IMAP IDLE a signal is only seen when the mailbox is polled, but most strategies fire
+around session opens or candle closes. Each bot's signal times are bucketed into a time-of-day
+histogram (seeded from the trades journal): a bot that signalled within POLL_HOT_WINDOW, or
+whose history shows activity around the current time of day, is polled every
+POLL_MIN_INTERVAL, and quiet bots back off towards POLL_MAX_INTERVAL. Bots without enough
+history to learn from stay at the minimum. Polls per IMAP server are capped at
+POLL_PROVIDER_RATE, most overdue bot first.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from backend import journal, metrics
+
+# Poll interval of a hot bot, and of a bot whose history shows no activity at this time of day
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", 1))  # seconds
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", 15))  # seconds
+
+# A bot stays hot this long after its last signal, since signals tend to come in bursts
+POLL_HOT_WINDOW = float(os.getenv("POLL_HOT_WINDOW", 900))  # seconds
+
+# Signal times kept per bot, and how far back the journal is read for them on startup
+POLL_HISTORY = int(os.getenv("POLL_HISTORY", 200))
+POLL_HISTORY_DAYS = int(os.getenv("POLL_HISTORY_DAYS", 30))
+
+# Below this many known signals there is no pattern yet, so the bot is polled at the minimum interval
+POLL_MIN_HISTORY = 5
+
+# Mailbox polls per second allowed against one IMAP server, shared by all its bots
+POLL_PROVIDER_RATE = float(os.getenv("POLL_PROVIDER_RATE", 20))
+
+# How often the scheduler looks for due bots
+POLL_TICK = 0.25  # seconds
+
+# Width of a time-of-day histogram slot (UTC)
+SLOT_SECONDS = 900
+SLOTS = 86400 // SLOT_SECONDS
+
+
+@dataclass
+class PollSchedule:
+    signal_times: deque = field(default_factory=lambda: deque(maxlen=POLL_HISTORY))
+    histogram: list = field(default_factory=lambda: [0] * SLOTS)
+    last_signal_at: float = 0.0
+    next_poll_at: float = 0.0
+    polled_at: float = 0.0
+    interval: float = POLL_MIN_INTERVAL
+
+
+# Poll schedule per running bot
+schedules: Dict[str, PollSchedule] = {}
+
+# Bots whose history hasn't been read from the journal yet
+unseeded = set()
+seeding: Optional[asyncio.Task] = None
+
+# Token bucket per IMAP server: [tokens, refilled_at]
+provider_buckets: Dict[str, list] = {}
+
+# Polls made against what a fixed POLL_MIN_INTERVAL schedule would have made
+poll_budget = {"polls": 0, "baseline": 0.0, "ticked_at": None}
+
+
+def _slot(at: float) -> int:
+    return int(at % 86400 // SLOT_SECONDS)
+
+
+def record_signal(bot_name: str, at: float):
+    """Learn from a signal issued at `at`; the bot turns hot."""
+    schedule = schedules.setdefault(bot_name, PollSchedule())
+    if len(schedule.signal_times) == schedule.signal_times.maxlen:
+        schedule.histogram[_slot(schedule.signal_times[0])] -= 1
+    schedule.signal_times.append(at)
+    schedule.histogram[_slot(at)] += 1
+    if at > schedule.last_signal_at:
+        schedule.last_signal_at = at
+        schedule.next_poll_at = min(schedule.next_poll_at, at + POLL_MIN_INTERVAL)
+
+
+def poll_interval(schedule: PollSchedule, now: float) -> float:
+    """Seconds until a bot's next poll, from its recent activity and its time-of-day history."""
+    if now - schedule.last_signal_at < POLL_HOT_WINDOW or len(schedule.signal_times) < POLL_MIN_HISTORY:
+        return POLL_MIN_INTERVAL
+    # Activity from the previous to the next slot, relative to the bot's busiest such window
+    windows = [
+        schedule.histogram[slot - 1] + schedule.histogram[slot] + schedule.histogram[(slot + 1) % SLOTS]
+        for slot in range(SLOTS)
+    ]
+    score = windows[_slot(now)] / max(windows)
+    return POLL_MIN_INTERVAL + (POLL_MAX_INTERVAL - POLL_MIN_INTERVAL) * (1 - score) ** 2
+
+
+def take_provider_token(imap_server: str, now: float) -> bool:
+    bucket = provider_buckets.setdefault((imap_server or "").lower(), [POLL_PROVIDER_RATE, now])
+    bucket[0] = min(POLL_PROVIDER_RATE, bucket[0] + (now - bucket[1]) * POLL_PROVIDER_RATE)
+    bucket[1] = now
+    if bucket[0] < 1:
+        return False
+    bucket[0] -= 1
+    return True
+
+
+def due_bots(bots: dict, busy: set, now: float) -> list:
+    """Bots to poll now, most overdue first; `busy` names bots whose last check is still running."""
+    pollable = [
+        bot for bot in bots.values()
+        if not bot.paused and (bot.imap_session or now >= bot.next_retry_at)
+    ]
+    if poll_budget["ticked_at"] is not None:
+        baseline = (now - poll_budget["ticked_at"]) / POLL_MIN_INTERVAL * len(pollable)
+        poll_budget["baseline"] += baseline
+        metrics.imap_polls_baseline_total.inc(amount=baseline)
+    poll_budget["ticked_at"] = now
+
+    due = []
+    for bot in pollable:
+        schedule = schedules.get(bot.name)
+        if schedule is None:
+            schedule = schedules[bot.name] = PollSchedule()
+            unseeded.add(bot.name)
+        if now >= schedule.next_poll_at and bot.name not in busy:
+            due.append((schedule.next_poll_at, bot, schedule))
+    due.sort(key=lambda item: item[0])
+
+    polled = []
+    for _, bot, schedule in due:
+        if not take_provider_token(bot.imap_server, now):
+            # Stays due; it goes first once the server has capacity again
+            continue
+        schedule.polled_at = now
+        schedule.interval = poll_interval(schedule, now)
+        schedule.next_poll_at = now + schedule.interval
+        polled.append(bot)
+    poll_budget["polls"] += len(polled)
+    metrics.imap_polls_total.inc(amount=len(polled))
+    return polled
+
+
+def last_polled_at(bot_name: str) -> float:
+    schedule = schedules.get(bot_name)
+    return schedule.polled_at if schedule else 0.0
+
+
+def forget(bot_name: str):
+    schedules.pop(bot_name, None)
+    unseeded.discard(bot_name)
+
+
+async def seed_history():
+    """Learn the signal pattern of newly scheduled bots from the trades journal."""
+    bot_names = sorted(unseeded)
+    unseeded.clear()
+    try:
+        signal_times = await asyncio.to_thread(journal.load_signal_times, bot_names, POLL_HISTORY_DAYS, POLL_HISTORY)
+    except Exception as e:
+        # They are polled at the minimum interval until they signal
+        logging.error(f"Error loading signal history for the poll schedule: {str(e)}")
+        return
+    for bot_name, times in signal_times.items():
+        if bot_name in schedules:
+            for at in times:
+                record_signal(bot_name, at)
+
+
+def start_seeding():
+    global seeding
+
+    if unseeded and (seeding is None or seeding.done()):
+        seeding = asyncio.create_task(seed_history())
+
+
+def get_poll_report() -> dict:
+    """Poll tiers of the running bots and the polls saved against a fixed POLL_MIN_INTERVAL schedule."""
+    intervals = [schedule.interval for schedule in schedules.values()]
+    baseline = round(poll_budget["baseline"])
+    return {
+        "hot": sum(1 for interval in intervals if interval <= POLL_MIN_INTERVAL),
+        "cold": sum(1 for interval in intervals if interval >= POLL_MAX_INTERVAL),
+        "polls": poll_budget["polls"],
+        "baseline_polls": baseline,
+        "saved_polls": max(0, baseline - poll_budget["polls"]),
+        "saved_ratio": round(max(0, baseline - poll_budget["polls"]) / baseline, 3) if baseline else 0.0,
+    }
@@ -0,0 +1,59 @@
+"""Per-bot position state machine.
+
+    neutral --open--> opening --filled--> long | short --close--> closing --closed--> neutral
+                      opening --failed--> neutral          closing --failed--> long | short
+
+`Bot.position` keeps the settled side as journaled and shown on the dashboard
+("neutral", "buy" = long, "sell" = short); `Bot.pending` holds "opening" or "closing"
+while an order is in flight. Every transition happens under the bot's `position_lock`
+(see bot_manager.place_trade), so concurrent signals can't double-open or double-close.
+"""
+from backend import bot_cache
+
+NEUTRAL = "neutral"
+OPENING = "opening"
+LONG = "long"
+CLOSING = "closing"
+SHORT = "short"
+
+# Settled Bot.position value -> state
+SETTLED_STATES = {"neutral": NEUTRAL, "buy": LONG, "sell": SHORT}
+
+TRANSITIONS = {
+    NEUTRAL: {OPENING},
+    OPENING: {NEUTRAL, LONG, SHORT},
+    LONG: {CLOSING},
+    SHORT: {CLOSING},
+    CLOSING: {NEUTRAL, LONG, SHORT},
+}
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+def state(bot) -> str:
+    return bot.pending or SETTLED_STATES.get(bot.position, NEUTRAL)
+
+
+def _check(bot, target: str):
+    current = state(bot)
+    if target not in TRANSITIONS[current]:
+        raise InvalidTransition(f"Bot {bot.name} can't go from {current} to {target}")
+    if not bot.position_lock.locked():
+        raise InvalidTransition(f"Bot {bot.name} changed position without holding its lock")
+
+
+def begin(bot, target: str):
+    """Enter `opening` or `closing` before the order is sent."""
+    _check(bot, target)
+    bot.pending = target
+    bot_cache.record_bot_change(bot)
+
+
+def settle(bot, position: str):
+    """Leave the pending state with the resulting side: "neutral", "buy" or "sell"."""
+    _check(bot, SETTLED_STATES[position])
+    bot.pending = None
+    bot.position = position
+    bot_cache.record_bot_change(bot)
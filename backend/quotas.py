@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import date, timedelta
+
+import psycopg2.extras
+
+from backend import metrics
+from backend.main2 import get_db_connection
+
+# Rolling window the plan trade_limit applies to
+QUOTA_WINDOW_DAYS = int(os.getenv("QUOTA_WINDOW_DAYS", 30))
+
+# How often pending counter increments are written to Postgres
+QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", 5))  # seconds
+
+SECONDS_PER_DAY = 86400
+EPOCH = date(1970, 1, 1)
+
+# Per-user rolling counters: user_email -> {"buckets": deque([[day, count], ...]), "total": int}
+trade_counters = {}
+
+# Increments not yet written to Postgres: (user_email, day) -> delta
+pending_increments = {}
+
+# Held while increments are written, so a reload never misses ones in flight
+flush_lock = asyncio.Lock()
+
+
+def create_trade_usage_table():
+    """Create the trade_usage table if it doesn't exist."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS trade_usage (
+            user_email VARCHAR(100) NOT NULL,
+            day DATE NOT NULL,
+            trades INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_email, day)
+        );
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def current_day() -> int:
+    return int(time.time() // SECONDS_PER_DAY)
+
+
+def _counter(user_email: str) -> dict:
+    counter = trade_counters.get(user_email)
+    if counter is None:
+        counter = trade_counters[user_email] = {"buckets": deque(), "total": 0}
+    return counter
+
+
+def _expire(counter: dict, today: int):
+    """Drop day buckets that have left the rolling window."""
+    buckets = counter["buckets"]
+    while buckets and buckets[0][0] <= today - QUOTA_WINDOW_DAYS:
+        counter["total"] -= buckets.popleft()[1]
+
+
+def _add(user_email: str, day: int, amount: int):
+    counter = _counter(user_email)
+    buckets = counter["buckets"]
+    if buckets and buckets[-1][0] == day:
+        buckets[-1][1] += amount
+    else:
+        buckets.append([day, amount])
+    counter["total"] += amount
+
+
+def trades_used(user_email: str) -> int:
+    counter = _counter(user_email)
+    _expire(counter, current_day())
+    return counter["total"]
+
+
+def try_reserve_trade(user_email: str, trade_limit: int) -> bool:
+    """Check and count one trade against the user's limit. -1 means unlimited.
+
+    Runs without awaiting, so check-and-increment is atomic on the event loop.
+    """
+    today = current_day()
+    counter = _counter(user_email)
+    _expire(counter, today)
+    if trade_limit >= 0 and counter["total"] >= trade_limit:
+        return False
+
+    _add(user_email, today, 1)
+    key = (user_email, today)
+    pending_increments[key] = pending_increments.get(key, 0) + 1
+    return True
+
+
+def release_trade(user_email: str):
+    """Give back a reserved trade whose order never reached the exchange."""
+    today = current_day()
+    counter = _counter(user_email)
+    if counter["buckets"] and counter["buckets"][-1][0] == today and counter["buckets"][-1][1] > 0:
+        _add(user_email, today, -1)
+        key = (user_email, today)
+        pending_increments[key] = pending_increments.get(key, 0) - 1
+
+
+def take_pending_increments() -> list:
+    """Swap out the pending increments as rows ready for writing."""
+    batch = [
+        (user_email, EPOCH + timedelta(days=day), delta)
+        for (user_email, day), delta in pending_increments.items() if delta
+    ]
+    pending_increments.clear()
+    return batch
+
+
+def restore_pending_increments(batch: list):
+    """Put a batch that failed to write back so the next flush retries it."""
+    for user_email, day, delta in batch:
+        key = (user_email, (day - EPOCH).days)
+        pending_increments[key] = pending_increments.get(key, 0) + delta
+
+
+def write_increments(batch: list):
+    """Write counter increments to Postgres in one multi-row upsert."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        with metrics.db_query_seconds.time("quota_flush"):
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO trade_usage (user_email, day, trades) VALUES %s
+                ON CONFLICT (user_email, day) DO UPDATE SET trades = trade_usage.trades + EXCLUDED.trades
+            """, batch)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+async def flush_increments():
+    async with flush_lock:
+        await _flush_increments()
+
+
+async def _flush_increments():
+    batch = take_pending_increments()
+    if not batch:
+        return
+    try:
+        await asyncio.to_thread(write_increments, batch)
+    except Exception:
+        restore_pending_increments(batch)
+        raise
+
+
+def load_usage_rows(user_emails=None) -> list:
+    """Read the rolling window of trade counts (of every user, or only the given ones) from Postgres."""
+    create_trade_usage_table()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT user_email, day, trades FROM trade_usage "
+            "WHERE day > CURRENT_DATE - %s AND (%s::text[] IS NULL OR user_email = ANY(%s::text[])) "
+            "ORDER BY user_email, day",
+            (QUOTA_WINDOW_DAYS, user_emails, user_emails)
+        )
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def rehydrate_counters(rows: list):
+    """Rebuild in-memory counters from stored usage plus increments not yet flushed."""
+    trade_counters.clear()
+    for user_email, day, trades in rows:
+        _add(user_email, (day - EPOCH).days, trades)
+    for (user_email, day), delta in sorted(pending_increments.items(), key=lambda item: item[0][1]):
+        _add(user_email, day, delta)
+    logging.info(f"✅ Rehydrated trade counters for {len(trade_counters)} users")
+
+
+async def reload_users(user_emails):
+    """Re-read the stored usage of these users before running bots another process traded for.
+
+    The previous owner flushes its increments before handing bots over; without this, the limit
+    would be enforced against the counts this process loaded at startup.
+    """
+    user_emails = sorted({user_email for user_email in user_emails if user_email})
+    if not user_emails:
+        return
+    async with flush_lock:
+        # Our own increments go first, so the stored rows include them
+        await _flush_increments()
+        rows = await asyncio.to_thread(load_usage_rows, user_emails)
+        for user_email in user_emails:
+            trade_counters.pop(user_email, None)
+        for user_email, day, trades in rows:
+            _add(user_email, (day - EPOCH).days, trades)
+        for (user_email, day), delta in sorted(pending_increments.items(), key=lambda item: item[0][1]):
+            if user_email in user_emails:
+                _add(user_email, day, delta)
+
+
+async def sync_trade_counters():
+    """Rehydrate counters on startup, then flush increments periodically."""
+    try:
+        rehydrate_counters(await asyncio.to_thread(load_usage_rows))
+    except Exception as e:
+        logging.error(f"Error rehydrating trade counters: {str(e)}")
+
+    while True:
+        await asyncio.sleep(QUOTA_FLUSH_INTERVAL)
+        try:
+            await flush_increments()
+        except Exception as e:
+            logging.error(f"Error flushing trade counters: {str(e)}")
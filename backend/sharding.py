@@ -0,0 +1,369 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import time
+
+from backend import bootstrap, journal, log_store, polling, quotas, snapshots, state
+from backend.main2 import active_bots, close_imap_session, get_db_connection, inflight_checks
+
+# Stable identity of this engine node; defaults to a per-process id
+ENGINE_NODE_ID = os.getenv("ENGINE_NODE_ID", state.WORKER_ID)
+
+# Membership heartbeats and per-bot leases
+ENGINE_HEARTBEAT_INTERVAL = float(os.getenv("ENGINE_HEARTBEAT_INTERVAL", 5))  # seconds
+ENGINE_NODE_TTL = float(os.getenv("ENGINE_NODE_TTL", 20))  # seconds without heartbeat before a node is dead
+BOT_LEASE_TTL = float(os.getenv("BOT_LEASE_TTL", 30))  # seconds
+
+# Points per node on the hash ring; more points spread bots more evenly
+ENGINE_VNODES = int(os.getenv("ENGINE_VNODES", 64))
+
+# How long a handover waits for the bots' running mailbox checks and orders; leases of bots still
+# busy after that aren't released, so nobody else runs them until the lease expires
+HANDOVER_DRAIN_TIMEOUT = float(os.getenv("HANDOVER_DRAIN_TIMEOUT", 10))  # seconds
+
+# How often the full bot list is re-checked for bots nobody runs yet
+ENGINE_REBALANCE_INTERVAL = float(os.getenv("ENGINE_REBALANCE_INTERVAL", 30))  # seconds
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring: a node joining or leaving only moves the bots adjacent to its points."""
+
+    def __init__(self, nodes, vnodes: int = ENGINE_VNODES):
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self.keys = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, key: str):
+        if not self.keys:
+            return None
+        return self.owners[bisect.bisect(self.keys, _hash(key)) % len(self.keys)]
+
+
+def create_shard_tables():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS engine_nodes (
+            node_id VARCHAR(100) PRIMARY KEY,
+            heartbeat_at TIMESTAMPTZ NOT NULL,
+            started_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS bot_leases (
+            bot_name VARCHAR(100) PRIMARY KEY,
+            node_id VARCHAR(100) NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_bot_leases_node ON bot_leases (node_id);
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def heartbeat(node_id: str) -> tuple:
+    """Refresh this node's membership and leases; return (live nodes, bots leased to this node)."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO engine_nodes (node_id, heartbeat_at) VALUES (%s, CURRENT_TIMESTAMP)
+            ON CONFLICT (node_id) DO UPDATE SET heartbeat_at = CURRENT_TIMESTAMP
+        """, (node_id,))
+        cursor.execute(
+            "DELETE FROM engine_nodes WHERE heartbeat_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+            (ENGINE_NODE_TTL,)
+        )
+        cursor.execute("SELECT node_id FROM engine_nodes")
+        nodes = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            UPDATE bot_leases SET expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE node_id = %s AND expires_at > CURRENT_TIMESTAMP
+            RETURNING bot_name
+        """, (BOT_LEASE_TTL, node_id))
+        leased = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+        return nodes, leased
+    finally:
+        conn.close()
+
+
+def acquire_leases(node_id: str, bot_names: list) -> set:
+    """Take the leases of bots that are free or expired; return the ones this node now holds."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO bot_leases (bot_name, node_id, expires_at)
+            SELECT name, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second' FROM unnest(%s::text[]) AS name
+            ON CONFLICT (bot_name) DO UPDATE SET node_id = EXCLUDED.node_id, expires_at = EXCLUDED.expires_at
+            WHERE bot_leases.node_id = EXCLUDED.node_id OR bot_leases.expires_at < CURRENT_TIMESTAMP
+            RETURNING bot_name
+        """, (node_id, BOT_LEASE_TTL, bot_names))
+        acquired = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+        return acquired
+    finally:
+        conn.close()
+
+
+def release_leases(node_id: str, bot_names: list):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM bot_leases WHERE node_id = %s AND bot_name = ANY(%s)", (node_id, bot_names)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def remove_node(node_id: str):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM engine_nodes WHERE node_id = %s", (node_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def list_bot_names() -> list:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT bot_name FROM bots")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def list_bot_owners(bot_names: list) -> list:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT user_email FROM bots WHERE bot_name = ANY(%s)", (bot_names,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+class ShardCoordinator:
+    """Runs the bots this node owns: the hash ring decides who should, a lease makes it exclusive.
+
+    A bot only runs while its lease is held. Leases are renewed by a heartbeat task of their own,
+    so a slow takeover can't let them lapse, and a node that can't renew stops its bots before
+    the leases expire, so another node can take over without both watching the same mailbox.
+    """
+
+    def __init__(self, node_id: str = ENGINE_NODE_ID):
+        self.node_id = node_id
+        self.ring = HashRing([node_id])
+        self.nodes = [node_id]
+        # Shared with the state backend, so log forwarding follows ownership
+        self.held = state.store.owned_bots
+        self.last_renewed = time.monotonic()
+        self.last_rebalance = 0.0
+        self.lock = asyncio.Lock()
+        # Serializes the (slow) mailbox logins of taken-over bots, which run outside `lock`
+        self.start_lock = asyncio.Lock()
+        self.tasks = set()
+        # (started, bots held then, future) of the heartbeat query in flight
+        self.heartbeat_call = None
+        self.running = True
+
+    def wants(self, bot_name: str) -> bool:
+        return self.ring.owner(bot_name) == self.node_id
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def stop_bots(self, bot_names: set, release: bool):
+        """Stop running bots; with `release`, let their running checks and orders finish, checkpoint
+        them and hand the leases back."""
+        if not bot_names:
+            return
+        # No new checks or orders start for them from here on (see state.PostgresState.owns)
+        self.held.difference_update(bot_names)
+        busy = set()
+        if release:
+            busy = await self.drain_bots(bot_names)
+            try:
+                await snapshots.save_snapshots(bot_names)
+            except Exception as e:
+                logging.error(f"Error saving snapshots before handover: {str(e)}")
+        for bot_name in bot_names:
+            bot = active_bots.pop(bot_name, None)
+            if bot is not None:
+                await asyncio.to_thread(close_imap_session, bot)
+            snapshots.forget(bot_name)
+            polling.forget(bot_name)
+            # The next owner numbers the bot's lines from scratch; this node only mirrors them
+            log_store.remove_bot_log(bot_name, persist=True)
+        if release:
+            # The next owner restores positions, executed signals and trade counts from Postgres
+            await journal.flush_journal()
+            try:
+                await quotas.flush_increments()
+            except Exception as e:
+                logging.error(f"Error flushing trade counters before handover: {str(e)}")
+            if busy:
+                logging.warning(f"⏳ Not releasing {len(busy)} bots still trading; their leases expire instead")
+            if bot_names - busy:
+                await asyncio.to_thread(release_leases, self.node_id, sorted(bot_names - busy))
+        logging.info(f"🔀 Node {self.node_id} stopped {len(bot_names)} bots")
+
+    async def drain_bots(self, bot_names: set) -> set:
+        """Wait for the bots' in-flight mailbox checks and orders; returns those still busy after HANDOVER_DRAIN_TIMEOUT."""
+        deadline = time.monotonic() + HANDOVER_DRAIN_TIMEOUT
+        checks = {inflight_checks[bot_name] for bot_name in bot_names if bot_name in inflight_checks}
+        if checks:
+            await asyncio.wait(checks, timeout=HANDOVER_DRAIN_TIMEOUT)
+        busy = set()
+        for bot_name in bot_names:
+            check = inflight_checks.get(bot_name)
+            bot = active_bots.get(bot_name)
+            if check is not None and not check.done():
+                busy.add(bot_name)
+            elif bot is not None and bot.position_lock.locked():
+                # An order started outside a mailbox check
+                try:
+                    await asyncio.wait_for(bot.position_lock.acquire(), max(deadline - time.monotonic(), 0.01))
+                    bot.position_lock.release()
+                except asyncio.TimeoutError:
+                    busy.add(bot_name)
+        return busy
+
+    async def start_bots(self, bot_names: set):
+        """Connect taken-over bots; their logins may take longer than a lease, so this runs in the background."""
+        async with self.start_lock:
+            bot_names = bot_names & self.held
+            if bot_names:
+                try:
+                    # Count what the previous owner traded for these users
+                    owners = await asyncio.to_thread(list_bot_owners, sorted(bot_names))
+                    await quotas.reload_users(owners)
+                    await bootstrap.bootstrap_bots(only=bot_names)
+                except Exception as e:
+                    logging.error(f"Error starting taken-over bots: {str(e)}")
+            # Leases lost or handed on while the mailboxes were logging in
+            stray = {bot_name for bot_name in bot_names if bot_name in active_bots and bot_name not in self.held}
+            if stray:
+                await self.stop_bots(stray, release=False)
+
+    async def rebalance(self):
+        """Hand over bots the ring moved elsewhere, then take the free leases of bots it assigns here."""
+        self.last_rebalance = time.monotonic()
+        bot_names = await asyncio.to_thread(list_bot_names)
+        wanted = {bot_name for bot_name in bot_names if self.wants(bot_name)}
+
+        await self.stop_bots(self.held - wanted, release=True)
+
+        missing = wanted - self.held
+        if not missing:
+            return
+        acquired = await asyncio.to_thread(acquire_leases, self.node_id, sorted(missing))
+        if acquired:
+            self.held.update(acquired)
+            logging.info(f"🔀 Node {self.node_id} took over {len(acquired)} bots")
+            self._spawn(self.start_bots(acquired))
+
+    async def reconcile(self, bot_name: str):
+        """Apply a created, toggled or deleted bot if it is (or should be) run by this node."""
+        async with self.lock:
+            if not self.running:
+                return
+            if bot_name not in self.held:
+                if not self.wants(bot_name):
+                    return
+                if bot_name not in await asyncio.to_thread(acquire_leases, self.node_id, [bot_name]):
+                    return
+                self.held.add(bot_name)
+            await bootstrap.reconcile_bot(bot_name)
+            if bot_name not in active_bots:
+                # Deleted
+                await self.stop_bots({bot_name}, release=True)
+
+    async def fence(self) -> bool:
+        """Stop every bot if the leases weren't renewed in time; True while renewal is overdue."""
+        if time.monotonic() - self.last_renewed <= BOT_LEASE_TTL - ENGINE_HEARTBEAT_INTERVAL:
+            return False
+        if self.held:
+            # Leases are about to expire elsewhere; stop before another node takes over
+            logging.error(f"❌ Node {self.node_id} can't renew its leases, stopping all bots")
+            await self.stop_bots(set(self.held), release=False)
+        return True
+
+    async def renew(self):
+        """Heartbeat once: refresh membership and leases, and stop the bots whose lease is gone."""
+        if self.heartbeat_call is None or self.heartbeat_call[2].done():
+            # Only bots held before the renewal began can be missing from its result
+            self.heartbeat_call = (time.monotonic(), set(self.held), asyncio.ensure_future(
+                asyncio.to_thread(heartbeat, self.node_id)
+            ))
+        started, held, call = self.heartbeat_call
+        try:
+            # A hung query is waited on again next time instead of piling up threads
+            nodes, leased = await asyncio.wait_for(asyncio.shield(call), ENGINE_HEARTBEAT_INTERVAL)
+        except Exception as e:
+            logging.error(f"Error renewing engine leases: {str(e) or type(e).__name__}")
+        else:
+            self.last_renewed = started
+            self.nodes = nodes
+            lost = (held & self.held) - leased
+            if lost:
+                logging.error(f"❌ Node {self.node_id} lost the leases of {len(lost)} bots")
+                await self.stop_bots(lost, release=False)
+        await self.fence()
+
+    async def run_heartbeat(self):
+        while self.running:
+            started = time.monotonic()
+            await self.renew()
+            await asyncio.sleep(max(0.0, ENGINE_HEARTBEAT_INTERVAL - (time.monotonic() - started)))
+
+    async def tick(self):
+        if await self.fence():
+            return
+        ring_changed = set(self.nodes) != self.ring.nodes
+        if ring_changed:
+            self.ring = HashRing(self.nodes)
+            logging.info(f"🔀 Engine nodes changed: {sorted(self.nodes)}")
+        if ring_changed or time.monotonic() - self.last_rebalance > ENGINE_REBALANCE_INTERVAL:
+            await self.rebalance()
+
+    async def run(self):
+        await asyncio.to_thread(create_shard_tables)
+        # Join the ring before the first rebalance
+        await self.renew()
+        self._spawn(self.run_heartbeat())
+        while self.running:
+            try:
+                async with self.lock:
+                    if self.running:
+                        await self.tick()
+            except Exception as e:
+                logging.error(f"Error in shard coordinator: {str(e)}")
+            await asyncio.sleep(ENGINE_HEARTBEAT_INTERVAL)
+
+    async def leave(self):
+        """Release every lease and leave the ring (graceful shutdown)."""
+        async with self.lock:
+            self.running = False
+            for task in list(self.tasks):
+                task.cancel()
+            await self.stop_bots(set(self.held), release=True)
+            await asyncio.to_thread(remove_node, self.node_id)
+
+    def status(self) -> dict:
+        return {"node": self.node_id, "nodes": sorted(self.ring.nodes), "leases": len(self.held)}
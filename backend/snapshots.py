@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import psycopg2.extras
+
+from backend import journal, metrics
+from backend.main2 import RECENT_MESSAGE_IDS, active_bots, get_db_connection
+
+# How often changed runtime state of the running bots is checkpointed
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", 30))  # seconds
+
+# Last state written per bot, to skip unchanged snapshots
+saved_states = {}
+
+
+def create_snapshot_table():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bot_snapshots (
+            bot_name VARCHAR(100) PRIMARY KEY,
+            state JSONB NOT NULL,
+            saved_at TIMESTAMPTZ NOT NULL
+        );
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def bot_state(bot) -> dict:
+    """Compact runtime state of a bot that isn't kept in the bots table."""
+    return {
+        "position": bot.position,
+        "retry_attempts": bot.retry_attempts,
+        "next_retry_at": bot.next_retry_at,
+        "message_ids": list(bot.recent_message_ids),
+    }
+
+
+def write_snapshots(states: dict):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        with metrics.db_query_seconds.time("snapshot_write"):
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO bot_snapshots (bot_name, state, saved_at) VALUES %s
+                ON CONFLICT (bot_name) DO UPDATE SET state = EXCLUDED.state, saved_at = EXCLUDED.saved_at
+            """, [(bot_name, json.dumps(value)) for bot_name, value in states.items()],
+                template="(%s, %s, CURRENT_TIMESTAMP)")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+async def save_snapshots(bot_names=None):
+    """Checkpoint the running bots (or only the named ones) whose state changed since the last save."""
+    names = list(active_bots) if bot_names is None else [name for name in bot_names if name in active_bots]
+    changed = {}
+    for bot_name in names:
+        value = bot_state(active_bots[bot_name])
+        if saved_states.get(bot_name) != value:
+            changed[bot_name] = value
+    if not changed:
+        return
+    await asyncio.to_thread(write_snapshots, changed)
+    saved_states.update(changed)
+
+
+def load_snapshots(bot_names=None) -> dict:
+    """Saved state per bot; snapshots older than the bot itself (deleted and re-created) are ignored."""
+    create_snapshot_table()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT s.bot_name, s.state FROM bot_snapshots s
+            JOIN bots b ON b.bot_name = s.bot_name AND s.saved_at >= b.created_at
+            WHERE %s::text[] IS NULL OR s.bot_name = ANY(%s::text[])
+        """, (bot_names, bot_names))
+        return dict(cursor.fetchall())
+    finally:
+        conn.close()
+
+
+def load_restore_state(bot_names=None) -> dict:
+    """Everything needed to resume the named bots (or all): bot_name -> state.
+
+    The journal is authoritative for positions and executed signals, since it is flushed far
+    more often than snapshots; the snapshot adds reconnect backoff and fills in the rest.
+    """
+    saved = load_snapshots(bot_names)
+    positions = journal.load_last_positions(bot_names)
+    message_ids = journal.load_recent_message_ids(bot_names, RECENT_MESSAGE_IDS)
+
+    restored = {}
+    for bot_name in set(saved) | set(positions) | set(message_ids):
+        value = dict(saved.get(bot_name) or {})
+        if bot_name in positions:
+            value["position"] = positions[bot_name]
+        value["message_ids"] = list(dict.fromkeys(
+            list(value.get("message_ids") or []) + message_ids.get(bot_name, [])
+        ))[-RECENT_MESSAGE_IDS:]
+        restored[bot_name] = value
+    return restored
+
+
+def apply_restore_state(bot, value: dict):
+    """Resume a bot where it left off, before its mailbox is connected."""
+    if not value:
+        return
+    bot.position = value.get("position") or bot.position
+    bot.recent_message_ids.extend(value.get("message_ids") or ())
+    if value.get("next_retry_at", 0) > time.time():
+        # The mailbox was failing before the restart; keep waiting out its backoff
+        bot.retry_attempts = value.get("retry_attempts", 0)
+        bot.next_retry_at = value["next_retry_at"]
+    saved_states[bot.name] = bot_state(bot)
+
+
+def forget(bot_name: str):
+    saved_states.pop(bot_name, None)
+
+
+async def run_snapshot_writer():
+    """Checkpoint changed bot state every SNAPSHOT_INTERVAL."""
+    try:
+        await asyncio.to_thread(create_snapshot_table)
+    except Exception as e:
+        logging.error(f"Error creating snapshot table: {str(e)}")
+
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            await save_snapshots()
+        except Exception as e:
+            logging.error(f"Error saving bot snapshots: {str(e)}")
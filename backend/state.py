@@ -0,0 +1,363 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+
+import psycopg2
+
+# "memory" for a single process, "postgres" to share state between uvicorn workers
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+
+# LISTEN/NOTIFY channel carrying every shared event
+STATE_CHANNEL = os.getenv("STATE_CHANNEL", "bot_state_events")
+
+# Outgoing events are batched into one NOTIFY per flush
+STATE_FLUSH_MS = int(os.getenv("STATE_FLUSH_MS", 100))
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_MAX_BYTES = 7900
+
+# How often expired key/value entries are deleted
+STATE_EXPIRE_INTERVAL = float(os.getenv("STATE_EXPIRE_INTERVAL", 60))  # seconds
+
+# Identifies this process's own notifications so they aren't applied twice
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# How long a request to the engine nodes collects replies
+STATE_REQUEST_WAIT = float(os.getenv("STATE_REQUEST_WAIT", 1))  # seconds
+
+
+class MemoryState:
+    """Process-local state: key/value entries with TTL and a no-op event bus.
+
+    With a single process there is nobody to notify, and this process runs every bot.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self.values = {}  # (namespace, key) -> (value, expires_at)
+        self.handlers = {}
+        self.is_engine = True
+        # Bots whose lease this process holds (see backend.sharding); unused in memory
+        self.owned_bots = set()
+
+    async def start(self, engine: bool = True):
+        """Start the backend; `engine` is False for processes that never run bots."""
+
+    def owns(self, bot_name: str) -> bool:
+        """Whether this process runs the bot (and numbers its log lines)."""
+        return True
+
+    async def stop(self):
+        pass
+
+    async def put(self, namespace: str, key: str, value, ttl: float = None):
+        self.values[(namespace, key)] = (value, time.time() + ttl if ttl else None)
+
+    async def get(self, namespace: str, key: str):
+        item = self.values.get((namespace, key))
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self.values[(namespace, key)]
+            return None
+        return value
+
+    async def pop(self, namespace: str, key: str):
+        value = await self.get(namespace, key)
+        self.values.pop((namespace, key), None)
+        return value
+
+    def publish(self, channel: str, payload: dict):
+        """Send an event to the other workers; safe to call from any thread."""
+
+    def subscribe(self, channel: str, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    async def request(self, channel: str, payload: dict, wait: float = STATE_REQUEST_WAIT) -> list:
+        """Publish a request and return the replies of the other workers received within `wait`."""
+        return []
+
+    def reply(self, request: dict, payload: dict):
+        """Answer an event received from request()."""
+
+    def dispatch(self, messages: list):
+        for channel, payload in messages:
+            for handler in self.handlers.get(channel, ()):
+                try:
+                    handler(payload)
+                except Exception as e:
+                    logging.error(f"Error handling shared {channel} event: {str(e)}")
+
+
+class _EventBusState(MemoryState, ABC):
+    """Base for shared backends: batched outgoing events and request/reply on top of them.
+
+    Backends implement `_send`, which delivers a batch of (channel, payload) events to the other processes.
+    """
+
+    shared = True
+
+    def __init__(self):
+        super().__init__()
+        self.outbox = deque()
+        self.loop = None
+        self.tasks = []
+        self.running = False
+        self.pending_requests = {}
+        self.subscribe("reply", self._resolve)
+
+    def publish(self, channel: str, payload: dict):
+        self.outbox.append((channel, payload))
+
+    async def request(self, channel: str, payload: dict, wait: float = STATE_REQUEST_WAIT) -> list:
+        request_id = uuid.uuid4().hex
+        replies = self.pending_requests[request_id] = []
+        self.publish(channel, {**payload, "rid": request_id, "from": WORKER_ID})
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            self.pending_requests.pop(request_id, None)
+        return replies
+
+    def reply(self, request: dict, payload: dict):
+        self.publish("reply", {"rid": request["rid"], "to": request["from"], "p": payload})
+
+    def _resolve(self, event: dict):
+        if event["to"] != WORKER_ID:
+            return
+        replies = self.pending_requests.get(event["rid"])
+        if replies is not None:
+            replies.append(event["p"])
+
+    @abstractmethod
+    def _send(self, messages: list):
+        """Deliver a batch of outgoing events; called from a worker thread."""
+
+    async def _flush_outbox(self):
+        while True:
+            await asyncio.sleep(STATE_FLUSH_MS / 1000)
+            if not self.outbox:
+                continue
+            messages = [self.outbox.popleft() for _ in range(len(self.outbox))]
+            try:
+                await asyncio.to_thread(self._send, messages)
+            except Exception as e:
+                logging.error(f"Error publishing shared state events: {str(e)}")
+
+
+class PostgresState(_EventBusState):
+    """State shared through Postgres: a state_kv table and LISTEN/NOTIFY events."""
+
+    def _connect(self, autocommit: bool = False):
+        from backend.main2 import DATABASE_URL
+
+        conn = psycopg2.connect(DATABASE_URL)
+        conn.autocommit = autocommit
+        return conn
+
+    def _run(self, sql: str, params=(), fetch: bool = False):
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            row = cursor.fetchone() if fetch else None
+            conn.commit()
+            return row
+        finally:
+            conn.close()
+
+    async def start(self, engine: bool = True):
+        self.loop = asyncio.get_running_loop()
+        self.is_engine = engine
+        self.running = True
+        await asyncio.to_thread(self._run, """
+        CREATE TABLE IF NOT EXISTS state_kv (
+            namespace VARCHAR(50) NOT NULL,
+            key VARCHAR(200) NOT NULL,
+            value JSONB NOT NULL,
+            expires_at TIMESTAMPTZ,
+            PRIMARY KEY (namespace, key)
+        );
+        """)
+        threading.Thread(target=self._listen, name="state-listener", daemon=True).start()
+        self.tasks = [asyncio.create_task(self._flush_outbox()), asyncio.create_task(self._expire_loop())]
+        logging.info(f"🔗 Shared state on Postgres as worker {WORKER_ID}")
+
+    async def stop(self):
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.to_thread(self._send, list(self.outbox))
+
+    async def put(self, namespace: str, key: str, value, ttl: float = None):
+        await asyncio.to_thread(self._run, """
+            INSERT INTO state_kv (namespace, key, value, expires_at)
+            VALUES (%s, %s, %s, CASE WHEN %s::float IS NULL THEN NULL
+                                     ELSE CURRENT_TIMESTAMP + %s * INTERVAL '1 second' END)
+            ON CONFLICT (namespace, key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+        """, (namespace, key, json.dumps(value), ttl, ttl))
+
+    async def get(self, namespace: str, key: str):
+        row = await asyncio.to_thread(self._run, """
+            SELECT value FROM state_kv WHERE namespace = %s AND key = %s
+            AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+        """, (namespace, key), True)
+        return row[0] if row else None
+
+    async def pop(self, namespace: str, key: str):
+        row = await asyncio.to_thread(self._run, """
+            DELETE FROM state_kv WHERE namespace = %s AND key = %s
+            RETURNING value, (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+        """, (namespace, key), True)
+        return row[0] if row and row[1] else None
+
+    def owns(self, bot_name: str) -> bool:
+        return bot_name in self.owned_bots
+
+    def _send(self, messages: list):
+        """NOTIFY the messages, packed into as few payloads as the size limit allows."""
+        if not messages:
+            return
+        payloads, batch, size = [], [], 0
+        for message in messages:
+            encoded = json.dumps(message, separators=(",", ":"), default=str)
+            if batch and size + len(encoded) > NOTIFY_MAX_BYTES - 64:
+                payloads.append(batch)
+                batch, size = [], 0
+            batch.append(encoded)
+            size += len(encoded) + 1
+        payloads.append(batch)
+
+        conn = self._connect(autocommit=True)
+        try:
+            cursor = conn.cursor()
+            for batch in payloads:
+                payload = f'{{"o":"{WORKER_ID}","m":[{",".join(batch)}]}}'
+                if len(payload.encode()) >= 8000:
+                    logging.warning("Dropping shared state event larger than the NOTIFY limit")
+                    continue
+                cursor.execute("SELECT pg_notify(%s, %s)", (STATE_CHANNEL, payload))
+        finally:
+            conn.close()
+
+    def _listen(self):
+        """Listener thread: hand incoming notifications to the event loop."""
+        while self.running:
+            try:
+                conn = self._connect(autocommit=True)
+                conn.cursor().execute(f"LISTEN {STATE_CHANNEL}")
+                while self.running:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        event = json.loads(notification.payload)
+                        if event.get("o") != WORKER_ID:
+                            self.loop.call_soon_threadsafe(self.dispatch, event["m"])
+            except Exception as e:
+                logging.error(f"Shared state listener error, reconnecting: {str(e)}")
+                time.sleep(5)
+
+    def _expire_values(self):
+        self._run("DELETE FROM state_kv WHERE expires_at <= CURRENT_TIMESTAMP")
+
+    async def _expire_loop(self):
+        while True:
+            await asyncio.sleep(STATE_EXPIRE_INTERVAL)
+            try:
+                await asyncio.to_thread(self._expire_values)
+            except Exception as e:
+                logging.error(f"Error expiring shared state: {str(e)}")
+
+
+def shard_of(bot_name: str, shards: int) -> int:
+    """Stable shard index of a bot, the same in every process and across restarts."""
+    return int.from_bytes(hashlib.blake2b(bot_name.encode(), digest_size=8).digest(), "big") % shards
+
+
+class PipeState(_EventBusState):
+    """State shared between the web process and its engine pool workers over pipes (backend.engine_pool).
+
+    The web process holds one pipe per worker and routes bot control to the worker owning the bot;
+    a worker holds the pipe to the web process and runs the bots whose shard_of() is its shard.
+    Key/value entries stay local to the web process.
+    """
+
+    # Events addressed to the worker running the bot named in the payload
+    ROUTED_CHANNELS = {"bot_control", "log_forward"}
+
+    def __init__(self, peers: list, shards: int, shard: int = None):
+        super().__init__()
+        self.peers = peers
+        self.shards = shards
+        self.shard = shard
+
+    async def start(self, engine: bool = True):
+        self.loop = asyncio.get_running_loop()
+        self.is_engine = engine
+        self.running = True
+        for index, conn in enumerate(self.peers):
+            if conn is not None:
+                self._start_listener(index, conn)
+        self.tasks = [asyncio.create_task(self._flush_outbox())]
+
+    async def stop(self):
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.to_thread(self._send, list(self.outbox))
+
+    def owns(self, bot_name: str) -> bool:
+        return self.shard is not None and shard_of(bot_name, self.shards) == self.shard
+
+    def set_peer(self, index: int, conn):
+        """Attach the pipe of a (re)started worker."""
+        self.peers[index] = conn
+        if self.running:
+            self._start_listener(index, conn)
+
+    def _start_listener(self, index: int, conn):
+        threading.Thread(target=self._listen, args=(index, conn), name=f"pipe-listener-{index}", daemon=True).start()
+
+    def _send(self, messages: list):
+        batches = {}
+        for channel, payload in messages:
+            if self.shard is None and channel in self.ROUTED_CHANNELS:
+                targets = (shard_of(payload["b"], self.shards),)
+            else:
+                targets = range(len(self.peers))
+            for index in targets:
+                batches.setdefault(index, []).append((channel, payload))
+        for index, batch in batches.items():
+            conn = self.peers[index]
+            if conn is None:
+                continue
+            try:
+                conn.send(batch)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Dropping {len(batch)} events for pipe {index}: {str(e)}")
+
+    def _listen(self, index: int, conn):
+        """Listener thread: hand incoming batches to the event loop until the pipe closes."""
+        try:
+            while self.running:
+                messages = conn.recv()
+                self.loop.call_soon_threadsafe(self.dispatch, messages)
+        except (EOFError, OSError):
+            pass
+        if self.running and self.peers[index] is conn:
+            # Tell the local handlers the other end went away
+            self.loop.call_soon_threadsafe(self.dispatch, [("disconnect", {"peer": index})])
+
+
+store = PostgresState() if STATE_BACKEND == "postgres" else MemoryState()
@@ -0,0 +1,60 @@
+import os
+from collections import deque
+from typing import Dict
+
+# Stage timestamps carried on every signal, in pipeline order
+STAGES = ("sent", "delivered", "seen", "fetched", "parsed", "queued", "order_sent", "acked")
+
+# Latency segments reported per bot: name -> (from stage, to stage)
+SEGMENTS = {
+    "mail_delivery": ("sent", "delivered"),  # sender -> IMAP server (Date header -> INTERNALDATE)
+    "polling": ("delivered", "seen"),  # on the server until our UNSEEN search found it
+    "fetch": ("seen", "fetched"),
+    "parse": ("fetched", "parsed"),
+    "queue": ("parsed", "queued"),
+    "pre_send": ("queued", "order_sent"),
+    "exchange": ("order_sent", "acked"),
+    "total": ("sent", "acked"),
+}
+
+PERCENTILES = (50, 90, 99)
+
+# Traces kept per bot for the rolling percentiles
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", 500))
+
+# bot_name -> recent segment durations
+bot_traces: Dict[str, deque] = {}
+
+
+def segment_durations(trace: dict) -> dict:
+    """Seconds spent in each segment whose two stages were both recorded."""
+    durations = {}
+    for name, (start, end) in SEGMENTS.items():
+        if trace.get(start) is not None and trace.get(end) is not None:
+            durations[name] = trace[end] - trace[start]
+    return durations
+
+
+def record_trace(bot_name: str, trace: dict):
+    traces = bot_traces.get(bot_name)
+    if traces is None:
+        traces = bot_traces[bot_name] = deque(maxlen=TRACE_WINDOW)
+    traces.append(segment_durations(trace))
+
+
+def _percentile(sorted_values: list, percentile: int) -> float:
+    index = min(int(round(percentile / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def latency_report(bot_name: str) -> dict:
+    """Rolling p50/p90/p99 per segment for a bot, in milliseconds."""
+    traces = list(bot_traces.get(bot_name, ()))
+    report = {}
+    for name in SEGMENTS:
+        values = sorted(durations[name] for durations in traces if name in durations)
+        if not values:
+            continue
+        report[name] = {f"p{p}": round(_percentile(values, p) * 1000, 1) for p in PERCENTILES}
+        report[name]["count"] = len(values)
+    return {"bot": bot_name, "samples": len(traces), "segments": report}
@@ -0,0 +1,151 @@
+import asyncio
+import os
+from typing import Dict, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from backend import bot_cache, log_store
+from backend.main2 import active_bots
+
+# Default coalescing window for batched updates
+USER_STREAM_COALESCE_MS = int(os.getenv("USER_STREAM_COALESCE_MS", 250))
+
+# Health is not event-driven, so state is re-checked at least this often
+USER_STREAM_STATE_INTERVAL = float(os.getenv("USER_STREAM_STATE_INTERVAL", 5))
+
+# Log lines replayed per bot when a stream opens without a cursor
+USER_STREAM_INITIAL_TAIL = int(os.getenv("USER_STREAM_INITIAL_TAIL", 50))
+
+# Wake-up events of the open streams per user
+user_listeners: Dict[str, Set[asyncio.Event]] = {}
+
+
+def notify_user(user_email: str):
+    """Wake every open stream of a user (bot created, toggled, position changed...)."""
+    for event in user_listeners.get(user_email, ()):
+        event.set()
+
+
+def bot_state(bot_name: str, stored_paused=False) -> dict:
+    """Compact runtime state: p=position, z=paused, h=health."""
+    bot = active_bots.get(bot_name)
+    if bot is None:
+        if bot_name in bot_cache.remote_runtime:
+            return dict(bot_cache.remote_runtime[bot_name]["h"])
+        return {"p": "neutral", "z": bool(stored_paused), "h": "stopped"}
+
+    if bot.paused:
+        health = "paused"
+    elif bot.imap_session:
+        health = "ok"
+    elif bot.retry_attempts:
+        health = "retrying"
+    else:
+        health = "disconnected"
+    return {"p": bot.position, "z": bot.paused, "h": health}
+
+
+class UserStream:
+    """One multiplexed stream of log lines and bot state for every bot a user owns."""
+
+    def __init__(self, websocket: WebSocket, user_email: str, coalesce_ms: int):
+        self.websocket = websocket
+        self.user_email = user_email
+        self.coalesce = max(coalesce_ms, 0) / 1000
+        self.wake = asyncio.Event()
+        self.cursors = {}
+        self.states = {}
+
+    async def refresh_bots(self) -> dict:
+        """Track the user's current bot set, registering for log wake-ups of new bots."""
+        entries = await bot_cache.load_user_bots(self.user_email)
+        for bot_name in entries:
+            if bot_name not in self.cursors:
+                log_store.add_listener(bot_name, self.wake)
+                self.cursors[bot_name] = max(log_store.first_seq(bot_name) - 1, 0)
+        for bot_name in list(self.cursors):
+            if bot_name not in entries:
+                log_store.remove_listener(bot_name, self.wake)
+                del self.cursors[bot_name]
+                self.states.pop(bot_name, None)
+        return entries
+
+    def collect(self, entries: dict) -> dict:
+        """Build one batch with new log lines and changed state across all bots."""
+        logs = {}
+        for bot_name, cursor in self.cursors.items():
+            lines = log_store.get_logs(bot_name, cursor)
+            if lines:
+                self.cursors[bot_name] = lines[-1][0]
+                logs[bot_name] = [[entry[0], log_store.format_entry(entry)] for entry in lines]
+
+        state = {}
+        for bot_name, entry in entries.items():
+            current = bot_state(bot_name, entry["summary"].get("paused"))
+            if self.states.get(bot_name) != current:
+                self.states[bot_name] = current
+                state[bot_name] = current
+
+        batch = {}
+        if logs:
+            batch["l"] = logs
+        if state:
+            batch["s"] = state
+        return batch
+
+    async def run(self, cursors: dict):
+        user_listeners.setdefault(self.user_email, set()).add(self.wake)
+        try:
+            entries = await self.refresh_bots()
+            for bot_name in self.cursors:
+                if bot_name in cursors:
+                    self.cursors[bot_name] = cursors[bot_name]
+                else:
+                    latest = log_store.get_logs(bot_name, 0)
+                    if latest:
+                        self.cursors[bot_name] = max(latest[-1][0] - USER_STREAM_INITIAL_TAIL, 0)
+
+            await self.websocket.send_json({"t": "hello", "bots": list(entries), **self.collect(entries)})
+            while True:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=USER_STREAM_STATE_INTERVAL)
+                    # Let a burst of changes accumulate into a single message
+                    await asyncio.sleep(self.coalesce)
+                except asyncio.TimeoutError:
+                    pass
+
+                previous = set(self.cursors)
+                entries = await self.refresh_bots()
+                batch = self.collect(entries)
+                if set(self.cursors) != previous:
+                    batch["b"] = list(entries)
+                if batch:
+                    batch["t"] = "batch"
+                    await self.websocket.send_json(batch)
+        finally:
+            user_listeners.get(self.user_email, set()).discard(self.wake)
+            for bot_name in self.cursors:
+                log_store.remove_listener(bot_name, self.wake)
+
+
+async def serve_user_stream(websocket: WebSocket, user_email: str, coalesce_ms: int, cursors: dict):
+    """Run a user stream until the client disconnects."""
+    stream = UserStream(websocket, user_email, coalesce_ms)
+
+    async def wait_for_disconnect():
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    sender = asyncio.create_task(stream.run(cursors))
+    receiver = asyncio.create_task(wait_for_disconnect())
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sender.cancel()
+        receiver.cancel()
+    if sender.done() and not sender.cancelled() and sender.exception():
+        raise sender.exception()
@@ -5,6 +5,8 @@ import hashlib
 import base64
 import time
 
+from backend import metrics
+
 BASE_URL = "https://api.kucoin.com"
 
 def generate_kucoin_signature(api_secret, api_passphrase, timestamp, method, endpoint, body=""):
@@ -14,6 +16,7 @@ def generate_kucoin_signature(api_secret, api_passphrase, timestamp, method, end
     passphrase = base64.b64encode(hmac.new(api_secret.encode(), api_passphrase.encode(), hashlib.sha256).digest()).decode()
     return signature, passphrase
 
+@metrics.instrument_exchange("kucoin")
 async def place_order(api_key, api_secret, api_passphrase, signal):
     """Place an order on KuCoin."""
     endpoint = "/api/v1/orders"
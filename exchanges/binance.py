@@ -1,7 +1,10 @@
 import aiohttp
 
+from backend import metrics
+
 BASE_URL = "https://api.binance.com"
 
+@metrics.instrument_exchange("binance")
 async def place_order(api_key, api_secret, signal):
     """Place an order on Binance."""
     url = f"{BASE_URL}/api/v3/order"
@@ -1,8 +1,11 @@
 
 import aiohttp
 
+from backend import metrics
+
 BASE_URL = "https://api.bitget.com"
 
+@metrics.instrument_exchange("bitget")
 async def place_order(api_key, api_secret, passphrase, signal):
     """Place an order on Bitget."""
     url = f"{BASE_URL}/api/v2/spot/order"
@@ -1,7 +1,10 @@
 import aiohttp
 
+from backend import metrics
+
 BASE_URL = "https://api.bybit.com"
 
+@metrics.instrument_exchange("bybit")
 async def place_order(api_key, api_secret, signal):
     """Place an order on Bybit."""
     url = f"{BASE_URL}/v2/private/order/create"
@@ -1,8 +1,11 @@
 import aiohttp
 
+from backend import metrics
+
 # MetaTrader5 API base URL (hypothetical for example)
 METATRADER5_BASE_URL = "http://localhost:5000/api"  # Assuming MetaTrader5 API is running locally
 
+@metrics.instrument_exchange("metatrader5")
 async def place_order_metatrader5(login, password, server, signal):
     """Place an order on MetaTrader5 using login credentials."""
     url = f"{METATRADER5_BASE_URL}/trade"
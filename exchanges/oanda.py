@@ -1,8 +1,11 @@
 import aiohttp
 
+from backend import metrics
+
 # Use the demo environment for testing
 OANDA_BASE_URL = "https://api-fxpractice.oanda.com/v3"
 
+@metrics.instrument_exchange("oanda")
 async def place_order_oanda(api_key, account_id, signal):
     """Place an order on OANDA with API key and account ID."""
     url = f"{OANDA_BASE_URL}/accounts/{account_id}/orders"
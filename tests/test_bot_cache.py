@@ -0,0 +1,33 @@
+import asyncio
+
+from backend import bot_cache
+
+
+def rows(paused_version):
+    return [
+        {"id": 1, "bot_name": "alpha", "user_email": "u@example.com", "paused": False, "listing_version": 7},
+        {"id": 2, "bot_name": "beta", "user_email": "u@example.com", "paused": True, "listing_version": paused_version},
+    ]
+
+
+def load_on_fresh_worker(monkeypatch, fetched):
+    """Each API worker has its own cache; only the database is shared."""
+    monkeypatch.setattr(bot_cache, "bot_cache", {})
+    monkeypatch.setattr(bot_cache, "remote_runtime", {})
+    monkeypatch.setattr(bot_cache, "_fetch_user_bots", lambda user_email: [dict(row) for row in fetched])
+    return asyncio.run(bot_cache.load_user_bots("u@example.com"))
+
+
+def test_cursor_and_etag_mean_the_same_on_every_worker(monkeypatch):
+    worker_a = load_on_fresh_worker(monkeypatch, rows(9))
+    listing = bot_cache.get_listing(worker_a)
+    etag = bot_cache.make_etag(worker_a)
+
+    worker_b = load_on_fresh_worker(monkeypatch, rows(9))
+    assert bot_cache.make_etag(worker_b) == etag
+    assert bot_cache.get_listing(worker_b, listing["cursor"])["bots"] == []
+
+    # beta changed after worker A's response: worker B reports it against A's cursor
+    worker_b = load_on_fresh_worker(monkeypatch, rows(12))
+    assert bot_cache.make_etag(worker_b) != etag
+    assert [bot["bot_name"] for bot in bot_cache.get_listing(worker_b, listing["cursor"])["bots"]] == ["beta"]
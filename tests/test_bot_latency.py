@@ -0,0 +1,19 @@
+import asyncio
+
+import pytest
+
+from backend import main2, state
+
+
+def test_latency_comes_from_the_engine_running_the_bot(monkeypatch):
+    async def request(channel, payload, wait=None):
+        assert (channel, payload) == ("bot_latency", {"b": "remote-bot"})
+        return [{"user_email": "owner@example.com", "latency": {"total": {"p50": 120}}}]
+
+    monkeypatch.setattr(state.store, "request", request)
+    user = {"email": "owner@example.com"}
+
+    assert asyncio.run(main2.bot_latency("remote-bot", user)) == {"total": {"p50": 120}}
+
+    with pytest.raises(main2.HTTPException):
+        asyncio.run(main2.bot_latency("remote-bot", {"email": "intruder@example.com"}))
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from backend import bot_manager, journal, main2
+
+
+@pytest.mark.parametrize("exchange, response", [
+    ("oanda", {"status": "error", "message": "Cannot connect to host"}),
+    ("oanda", {"orderRejectTransaction": {"reason": "INSUFFICIENT_MARGIN"}}),
+    ("binance", {"code": -2010, "msg": "Account has insufficient balance"}),
+    ("bybit", {"retCode": 170131, "retMsg": "Insufficient balance."}),
+    ("kucoin", {"code": "400100", "msg": "Balance insufficient"}),
+])
+def test_refused_order_is_not_a_fill(monkeypatch, exchange, response):
+    bot = main2.Bot(name="refused-bot", exchange=exchange, symbol="EUR_USD", quantity=1.0,
+                    api_key="key", api_secret="secret", account_id="account")
+    journaled = []
+
+    async def place_order(*args):
+        return response
+
+    async def trading_allowed(bot, signal):
+        return True
+
+    for module, name in [(bot_manager.oanda, "place_order_oanda"), (bot_manager.binance, "place_order"),
+                         (bot_manager.bybit, "place_order"), (bot_manager.KuCoin, "place_order")]:
+        monkeypatch.setattr(module, name, place_order)
+    monkeypatch.setattr(bot_manager, "check_trading_status", trading_allowed)
+    monkeypatch.setattr(journal, "record_trade", lambda bot, signal, kind, status, *args: journaled.append(status))
+
+    async def trade():
+        async with bot.position_lock:
+            return await bot_manager.execute_trade(bot, signal)
+
+    signal = bot_manager.TradeSignal(action="buy", symbol="EUR_USD", quantity=1.0)
+    result = asyncio.run(trade())
+
+    assert result["status"] == "error"
+    assert bot.position == "neutral"
+    assert journaled == ["error"]
+
+
+def test_order_error_accepts_fills():
+    assert bot_manager.order_error("binance", {"orderId": 1, "executedQty": "1.0"}) is None
+    assert bot_manager.order_error("bybit", {"retCode": 0, "result": {"orderId": "1"}}) is None
+    assert bot_manager.order_error("kucoin", {"code": "200000", "data": {"orderId": "1"}}) is None
+    assert bot_manager.order_error("oanda", {"orderFillTransaction": {"units": "1"}}) is None
@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import pytest
+
+from backend import bot_manager, journal, main2, state
+
+
+class FakeImapSession:
+    def __init__(self):
+        self.flags = []
+
+    def store(self, num, command, flag):
+        self.flags.append((num, command, flag))
+        return "OK", []
+
+
+def batch_item(num: bytes, action: str, issued_at: float) -> dict:
+    signal = main2.TradeSignal(
+        action=action, symbol="BTCUSDT", quantity=1.0, message_id=f"<{action}-{num.decode()}@test>",
+        detected_at=issued_at, trace={"delivered": issued_at},
+    )
+    return {"num": num, "session": None, "signal": signal, "date": "", "subject": "BTCUSDT", "body": action}
+
+
+def test_execute_batch_trades_only_the_newest_signal(monkeypatch):
+    bot = main2.Bot(name="batch-bot", exchange="binance", symbol="BTCUSDT", quantity=1.0,
+                    imap_session=FakeImapSession())
+    placed = []
+    journaled = []
+
+    async def place_trade(bot, signal):
+        placed.append(signal.action)
+        return {"status": "success"}
+
+    monkeypatch.setattr(bot_manager, "place_trade", place_trade)
+    monkeypatch.setattr(journal, "record_trade", lambda bot, signal, kind, status, *args: journaled.append(status))
+
+    now = time.time()
+    batch = [batch_item(b"1", "buy", now - 20), batch_item(b"2", "sell", now - 10)]
+    asyncio.run(main2.execute_batch(bot, batch))
+
+    assert placed == ["sell"]
+    assert journaled == ["superseded"]
+    assert list(bot.recent_message_ids) == ["<buy-1@test>", "<sell-2@test>"]
+    # Both emails are consumed: the dropped one and the traded one
+    assert [(num, command) for num, command, _ in bot.imap_session.flags] == [(b"1", "+FLAGS"), (b"2", "+FLAGS")]
+
+
+@pytest.mark.parametrize("status, seen", [
+    ("success", True),
+    ("info", True),
+    ("rejected", True),
+    ("error", False),
+])
+def test_execute_batch_marks_email_by_trade_outcome(monkeypatch, status, seen):
+    bot = main2.Bot(name="outcome-bot", exchange="binance", symbol="BTCUSDT", quantity=1.0,
+                    imap_session=FakeImapSession())
+
+    async def place_trade(bot, signal):
+        return {"status": status, "message": "Trade limit reached for your free plan"}
+
+    monkeypatch.setattr(bot_manager, "place_trade", place_trade)
+
+    asyncio.run(main2.execute_batch(bot, [batch_item(b"7", "buy", time.time())]))
+
+    # Only a failure that may succeed on a retry leaves the email unread
+    assert bot.imap_session.flags[-1][:2] == (b"7", "+FLAGS" if seen else "-FLAGS")
+
+
+def test_failed_signal_is_retried_a_bounded_number_of_times(monkeypatch):
+    bot = main2.Bot(name="retry-bot", exchange="binance", symbol="BTCUSDT", quantity=1.0,
+                    imap_session=FakeImapSession())
+
+    async def place_trade(bot, signal):
+        return {"status": "error", "message": "Trading not allowed for this symbol"}
+
+    monkeypatch.setattr(bot_manager, "place_trade", place_trade)
+
+    for _ in range(main2.SIGNAL_MAX_RETRIES + 1):
+        asyncio.run(main2.execute_batch(bot, [batch_item(b"3", "buy", time.time())]))
+
+    commands = [command for _, command, _ in bot.imap_session.flags]
+    assert commands == ["-FLAGS"] * main2.SIGNAL_MAX_RETRIES + ["+FLAGS"]
+    assert bot.signal_failures == {}
+
+
+def test_failed_signal_is_not_retried_once_an_order_was_sent(monkeypatch):
+    bot = main2.Bot(name="sent-bot", exchange="binance", symbol="BTCUSDT", quantity=1.0,
+                    imap_session=FakeImapSession())
+
+    async def place_trade(bot, signal):
+        return {"status": "error", "message": "Failed to place order: timeout", "sent": True}
+
+    monkeypatch.setattr(bot_manager, "place_trade", place_trade)
+
+    asyncio.run(main2.execute_batch(bot, [batch_item(b"4", "buy", time.time())]))
+
+    assert bot.imap_session.flags[-1][:2] == (b"4", "+FLAGS")
+    assert list(bot.recent_message_ids) == ["<buy-4@test>"]
+
+
+def test_emails_are_not_marked_on_a_swapped_mailbox(monkeypatch):
+    bot = main2.Bot(name="swap-bot", exchange="binance", symbol="BTCUSDT", quantity=1.0,
+                    imap_session=FakeImapSession())
+    old_session = bot.imap_session
+    item = {**batch_item(b"5", "buy", time.time()), "session": old_session}
+
+    async def place_trade(bot, signal):
+        # PATCH /bots switched the mailbox while the order was in flight
+        bot.imap_session = FakeImapSession()
+        return {"status": "success"}
+
+    monkeypatch.setattr(bot_manager, "place_trade", place_trade)
+
+    asyncio.run(main2.execute_batch(bot, [item]))
+
+    assert old_session.flags == []
+    assert bot.imap_session.flags == []
+
+
+def test_signals_are_left_unread_when_the_lease_was_lost(monkeypatch):
+    bot = main2.Bot(name="lost-bot", exchange="binance", symbol="BTCUSDT", quantity=1.0,
+                    imap_session=FakeImapSession())
+    monkeypatch.setattr(state.store, "owns", lambda bot_name: False)
+
+    asyncio.run(main2.execute_batch(bot, [batch_item(b"6", "buy", time.time())]))
+
+    assert bot.imap_session.flags == [(b"6", "-FLAGS", "\\Seen")]
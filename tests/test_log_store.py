@@ -0,0 +1,58 @@
+import asyncio
+
+from backend import log_store
+
+
+def record(code="keepalive"):
+    return log_store.BotLogRecord(20, code, "Mailbox kept alive", {})
+
+
+def test_repeats_collapse_until_the_line_is_read():
+    log_store.remove_bot_log("collapse-bot")
+    log_store.append_log("collapse-bot", record())
+    log_store.append_log("collapse-bot", record())
+    lines = log_store.get_logs("collapse-bot")
+    assert [str(entry[2]) for entry in lines] == ["Mailbox kept alive (x2)"]
+
+    # The reader is past that line, so the next repeats show up as a new one
+    log_store.append_log("collapse-bot", record())
+    log_store.append_log("collapse-bot", record())
+    lines = log_store.get_logs("collapse-bot", lines[-1][0])
+    assert [(entry[0], str(entry[2])) for entry in lines] == [(2, "Mailbox kept alive (x2)")]
+
+
+def test_repeat_after_read_wakes_waiting_subscribers():
+    async def scenario():
+        log_store.remove_bot_log("wake-bot")
+        log_store.append_log("wake-bot", record())
+        seen = await log_store.wait_for_logs("wake-bot", 0)
+        log_store.subscribe("wake-bot")
+        waiter = asyncio.create_task(log_store.wait_for_logs("wake-bot", seen[-1][0]))
+        await asyncio.sleep(0)
+        log_store.append_log("wake-bot", record())
+        return await asyncio.wait_for(waiter, 1)
+
+    assert [entry[0] for entry in asyncio.run(scenario())] == [2]
+
+
+def test_removing_a_bot_log_ends_waiting_streams_and_keeps_listeners():
+    async def scenario():
+        log_store.remove_bot_log("gone-bot")
+        listener = asyncio.Event()
+        log_store.add_listener("gone-bot", listener)
+        log_store.append_log("gone-bot", record())
+        waiter = asyncio.create_task(log_store.wait_for_logs("gone-bot", 1))
+        await asyncio.sleep(0)
+        log_store.remove_bot_log("gone-bot", persist=True)
+        return await asyncio.wait_for(waiter, 1), listener
+
+    lines, listener = asyncio.run(scenario())
+    assert lines is None
+    assert "gone-bot" not in log_store.log_store
+    assert log_store.pending_lines[-1][:2] == ("gone-bot", 1)
+    # A stream following the bot is woken by the log that replaces it
+    listener.clear()
+    log_store.append_log("gone-bot", record("other"))
+    assert log_store.log_store["gone-bot"].listeners == {listener}
+    log_store.remove_listener("gone-bot", listener)
+    assert "gone-bot" not in log_store.log_listeners
@@ -0,0 +1,62 @@
+import asyncio
+
+from backend import log_store, main2
+
+
+class FakeWebSocket:
+    def __init__(self, *messages):
+        self.messages = list(messages)
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def receive_json(self):
+        return self.messages.pop(0)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def fake_decode_token(token):
+    if token != "valid":
+        raise main2.HTTPException(status_code=401, detail="Invalid token")
+    return {"email": "owner@example.com"}
+
+
+def test_log_stream_requires_a_token(monkeypatch):
+    monkeypatch.setattr(main2, "decode_token", fake_decode_token)
+    websocket = FakeWebSocket({"token": "forged"})
+
+    asyncio.run(main2.websocket_logs(websocket, "some-bot"))
+
+    assert websocket.closed_with == 4401
+
+
+def test_log_stream_rejects_bots_of_other_users(monkeypatch):
+    monkeypatch.setattr(main2, "decode_token", fake_decode_token)
+    monkeypatch.setattr(main2, "fetch_user_bot", lambda bot_name, user_email: None)
+    websocket = FakeWebSocket({"token": "valid"})
+
+    asyncio.run(main2.websocket_logs(websocket, "someone-elses-bot"))
+
+    assert websocket.closed_with == 4404
+    # Nothing is allocated for names the caller doesn't own
+    assert "someone-elses-bot" not in log_store.log_store
+
+
+def test_user_stream_reads_token_and_cursors_from_the_first_message(monkeypatch):
+    from backend import user_stream
+
+    served = {}
+
+    async def serve_user_stream(websocket, user_email, coalesce_ms, cursors):
+        served.update(user=user_email, cursors=cursors)
+
+    monkeypatch.setattr(main2, "decode_token", fake_decode_token)
+    monkeypatch.setattr(user_stream, "serve_user_stream", serve_user_stream)
+    websocket = FakeWebSocket({"token": "valid", "cursors": {"a:b,c": 12, "bad": "x"}})
+
+    asyncio.run(main2.websocket_user(websocket))
+
+    assert served == {"user": "owner@example.com", "cursors": {"a:b,c": 12}}